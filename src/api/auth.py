@@ -1,3 +1,6 @@
+import base64
+import hashlib
+import hmac
 import time
 from datetime import datetime
 from typing import Optional, Dict, cast, Any
@@ -8,8 +11,12 @@ from fastapi.security.utils import get_authorization_scheme_param
 from fastapi.security import HTTPAuthorizationCredentials, OAuth2, OAuth2AuthorizationCodeBearer
 from fastapi.security.http import HTTPBase
 
+import orjson
+from jose import jwt
 from aiogram.utils.web_app import safe_parse_webapp_init_data, WebAppUser, WebAppInitData
 from src.api.services.user_service import UserService
+from src.core.cache import TTLCache
+from src.core.exceptions import InvalidTokenException, TokenExpiredException
 from src.settings import get_settings
 from loguru import logger as log
 
@@ -60,14 +67,25 @@ oauth2_scheme = OAuth2BearerWithCookie(
 )
 
 
+# Проверенные initData: webapp часами присылает одну и ту же строку, поэтому HMAC и разбор
+# выполняются один раз. Запись живет до auth_date + init_data_ttl, как и проверка в get_webapp_data
+init_data_cache = TTLCache(maxsize=cfg.init_data_cache_size)
+
+
+def parse_init_data(init_data: str) -> WebAppInitData:
+    key = hashlib.blake2b(init_data.encode(), digest_size=16).digest()
+    data: Optional[WebAppInitData] = init_data_cache.get(key)
+    if data is None:
+        data = safe_parse_webapp_init_data(token=cfg.bot_token, init_data=init_data)
+        init_data_cache.set(key, data, expires_at=data.auth_date.timestamp() + cfg.init_data_ttl)
+    return data
+
+
 async def verify_init_data(
         auth_cred: HTTPAuthorizationCredentials
 ) -> WebAppInitData:
     try:
-        data: WebAppInitData = safe_parse_webapp_init_data(
-            token=cfg.bot_token,
-            init_data=str(auth_cred.credentials),
-        )
+        data: WebAppInitData = parse_init_data(str(auth_cred.credentials))
         # Создаем пользователя в базе, если его нет
         await UserService.create_or_update_webapp(
             user=data.user,
@@ -82,5 +100,68 @@ async def verify_init_data(
         )
 
 
+# Проверенные access токены: digest токена -> claims. Запись живет до exp токена.
+# Отзыва access токенов нет (logout удаляет только refresh сессию), поэтому кэш безопасен
+access_token_cache = TTLCache(maxsize=cfg.jwt_cache_size)
+
+
+def _b64url_decode(segment: str) -> bytes:
+    return base64.urlsafe_b64decode(segment + '=' * (-len(segment) % 4))
+
+
+def _decode_hs256(token: str) -> Dict[str, Any]:
+    # Та же проверка, что и в jose для HS256, но без общего разбора алгоритмов и ключей
+    try:
+        signing_input, _, signature = token.rpartition('.')
+        header = orjson.loads(_b64url_decode(signing_input.split('.', 1)[0]))
+        payload = orjson.loads(_b64url_decode(signing_input.split('.', 1)[1]))
+        expected = hmac.new(cfg.SECRET_KEY.encode(), signing_input.encode(), hashlib.sha256).digest()
+        valid = header.get('alg') == 'HS256' and hmac.compare_digest(expected, _b64url_decode(signature))
+    except Exception:
+        raise InvalidTokenException
+    if not valid:
+        raise InvalidTokenException
+
+    exp = payload.get('exp')
+    if exp is not None and exp <= time.time():
+        raise TokenExpiredException
+    return payload
+
+
+def _decode_jose(token: str) -> Dict[str, Any]:
+    try:
+        return jwt.decode(token, cfg.SECRET_KEY, algorithms=[cfg.ALGORITHM])
+    except jwt.ExpiredSignatureError:
+        raise TokenExpiredException
+    except Exception:
+        raise InvalidTokenException
 
 
+def decode_access_token(token: str) -> Dict[str, Any]:
+    """
+    Проверяет access токен и возвращает claims в виде dict(user_id=..., tg_id=...)
+    """
+    key = hashlib.blake2b(token.encode(), digest_size=16).digest()
+    claims = access_token_cache.get(key)
+    if claims is not None:
+        return dict(claims)
+
+    if cfg.jwt_backend == 'hs256' and cfg.ALGORITHM == 'HS256':
+        payload = _decode_hs256(token)
+    else:
+        payload = _decode_jose(token)
+
+    user_id = payload.get('sub')
+    if user_id is None or payload.get('tg_id') is None:
+        raise InvalidTokenException
+    try:
+        claims = dict(user_id=user_id, tg_id=int(payload['tg_id']))
+    except (TypeError, ValueError):
+        raise InvalidTokenException
+
+    exp = payload.get('exp')
+    access_token_cache.set(
+        key, claims,
+        expires_at=exp if exp is not None else time.time() + cfg.ACCESS_TOKEN_EXPIRE_MINUTES * 60
+    )
+    return dict(claims)
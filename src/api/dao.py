@@ -8,6 +8,8 @@ from src.core.models import (
     UserReferralRewardsModel, UserLevelRewardsModel, MarketEnterpriseModel,
     UserMarketEnterprisePriceModel, UserMarketEnterpriseHistoryModel, CurrencyModel,
 )
+from src.core.extra_models import TapFlushBatchModel, ReferralLevelStatModel, MarketSearchModel, \
+    RatingPositionModel
 from src.api.schemas.auth_schemas import RefreshSessionCreate, RefreshSessionUpdate
 from src.api.schemas.user_schemas import UserCreate, UserUpdate, UserRewardedTaskCreate, \
     UserDailyRewardedTaskCreate, UserReferralRewardsCreate, UserLevelRewardsCreate
@@ -131,3 +133,19 @@ class UserMarketPricesDAO(BaseDAO[UserMarketPriceModel, UserMarketPriceCreate, U
 
 class UserMarketHistoryDAO(BaseDAO[UserMarketHistoryModel, UserMarketHistoryCreate, None]):
     model = UserMarketHistoryModel
+
+
+class TapFlushBatchDAO(BaseDAO[TapFlushBatchModel, None, None]):
+    model = TapFlushBatchModel
+
+
+class ReferralLevelStatDAO(BaseDAO[ReferralLevelStatModel, None, None]):
+    model = ReferralLevelStatModel
+
+
+class MarketSearchDAO(BaseDAO[MarketSearchModel, None, None]):
+    model = MarketSearchModel
+
+
+class RatingPositionDAO(BaseDAO[RatingPositionModel, None, None]):
+    model = RatingPositionModel
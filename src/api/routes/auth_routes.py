@@ -93,12 +93,13 @@ async def swagger_login(
 async def logout(
     request: Request,
     response: Response,
-    user: UserModel = Depends(get_current_active_user),
+    user: Dict[str, Any] = Depends(get_current_active_user),
 ):
     response.delete_cookie('access_token')
     response.delete_cookie('refresh_token')
 
-    await AuthService.logout(request.cookies.get("access_token"))
+    refresh_token = request.cookies.get("refresh_token")
+    await AuthService.logout(uuid.UUID(refresh_token) if refresh_token else None)
     return {"message": "Logged out successfully"}
 
 
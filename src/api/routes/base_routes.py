@@ -2,6 +2,7 @@ from typing import Any, Union, Dict
 from fastapi import APIRouter
 from src.core.database import db_helper as db
 from api.dao import CurrencyDAO
+from src.api.services.catalog_service import CatalogService
 from api.schemas.base_schemas import Currency
 from src.core.schemas import Pagination
 from src.settings import get_settings
@@ -20,7 +21,5 @@ async def get_currencies(
     """
     Получение валют
     """
-    async with db.session_factory() as ses:
-        currencies = await CurrencyDAO.find_all(ses)
-
-    return currencies
\ No newline at end of file
+    currencies = (await CatalogService.get()).currencies.rows
+    return list(currencies)
\ No newline at end of file
@@ -1,23 +1,24 @@
 from typing import Any, Union, Dict, Callable, Optional
-from fastapi import APIRouter, Depends, Request, HTTPException, status
+
+from fastapi import APIRouter, Depends, Request, Response, HTTPException, status
 from sqlalchemy import select
-from sqlalchemy.orm import joinedload, selectinload
+from sqlalchemy.orm import selectinload
 
-from src.core.database import db_helper as db
-from core.utils import get_translation
+from src.core.database import db_helper as db, rows_to_dicts, dump_json
+from core.utils import negotiate_language
 from src.core.dependencies import get_current_user
 
-from api.dao import UserEnterpriseDAO, MarketDAO, UserMarketPricesDAO, CurrencyDAO, UserDAO, \
+from api.dao import UserEnterpriseDAO, MarketDAO, UserMarketPricesDAO, UserDAO, \
     UserMarketHistoryDAO, MarketModel, UserMarketPriceModel, \
-    UserMarketHistoryModel, EnterpriseDAO
+    UserMarketHistoryModel
 
 from src.core.schemas import Pagination
-from api.schemas.market_schemas import UserMarketHistoryCreate, Market, \
-    UserMarketPriceCreate, MarketCreate
-from api.schemas.enterprise_schemas import (
-    Enterprise,
-    UserEnterpriseCreate
-)
+from src.core.utils import set_next_cursor
+from src.api.services.market_service import MarketService
+from src.api.services.catalog_service import CatalogService
+from src.api.services.market_cache_service import MarketCacheService
+from src.core.enums import SortType
+from api.schemas.market_schemas import Market, UserMarketPriceCreate, MarketCreate
 
 from src.settings import get_settings
 from loguru import logger as log
@@ -35,58 +36,62 @@ async def get_market_ads_by_filter(
         type_id: Optional[int] = None,
         price_down: Optional[int] = None,
         price_up: Optional[int] = None,
+        sort_type: SortType = SortType.ASC,
         pag: Pagination = Depends(Pagination),
         user: Dict[str, Any] = Depends(get_current_user),
 ) -> list[Dict[str, Any]]:
     """
-    Получение списка объявлений на маркете по фильтрам
+    Получение списка объявлений на маркете по фильтрам \n
+    Сортировка по цене (sort_type) в валюте currency_id, без currency_id - по цене в GDP \n
+    Курсор следующей страницы отдается в заголовке X-Next-Cursor
     """
-    async with db.session_factory() as ses:
-        stmt = (
-            select(MarketModel)
-            .options(joinedload(MarketModel.enterprise))
-            .options(selectinload(MarketModel.prices))
-            .limit(pag.limit)
-            .offset(pag.offset)
-        )
-        if capacity:
-            stmt = stmt.filter(MarketModel.enterprise.has(capacity=capacity))
-        if currency_id:
-            stmt = stmt.filter(MarketModel.prices.any(currency_id=currency_id))
-        if type_id:
-            stmt = stmt.filter(MarketModel.enterprise.has(type_id=type_id))
-        if price_down:
-            stmt = stmt.filter(MarketModel.prices.any(price_down <= UserMarketPriceModel.price))
-        if price_up:
-            stmt = stmt.filter(MarketModel.prices.any(UserMarketPriceModel.price <= price_up))
-
-        result = await ses.execute(stmt)
-        market_ads = result.scalars().all()
-
-    _ = get_translation(request=request, domain='enterprises')
-
-    return [
+    cache_key = MarketCacheService.make_key(
+        capacity or None, currency_id or None, type_id or None, price_down or None, price_up or None,
+        sort_type.value, pag.offset, pag.limit, pag.cursor,
+        negotiate_language(request.headers.get('Accept-Language')),
+    )
+    if cfg.market_cache_enabled:
+        cached, cache_version = await MarketCacheService.get(cache_key)
+        if cached is not None:
+            next_cursor, body = cached
+            cached_response = Response(content=body, media_type='application/json')
+            set_next_cursor(cached_response, next_cursor)
+            return cached_response
+
+    market_ads, next_cursor = await MarketService.search(
+        pag,
+        capacity=capacity,
+        currency_id=currency_id,
+        type_id=type_id,
+        price_down=price_down,
+        price_up=price_up,
+        sort_type=sort_type,
+    )
+
+    catalog = await CatalogService.with_enterprises(item.enterprise_id for item in market_ads)
+    lang = negotiate_language(request.headers.get('Accept-Language'))
+
+    content = [
         {
             **item.to_dict(),
-            "enterprise": Enterprise(
-                id=item.enterprise.id,
-                name=_(item.enterprise.name),
-                description=_(item.enterprise.description),
-                image_url=item.enterprise.image_url,
-                type_id=item.enterprise.type_id,
-                capacity=item.enterprise.capacity,
-                game_price=item.enterprise.game_price,
-                stars_price=item.enterprise.stars_price,
-            ).dict(),
+            "enterprise": catalog.enterprise_dto(item.enterprise_id, lang),
             "prices": [price.to_dict() for price in item.prices]
         }
         for item in market_ads
     ] if market_ads else []
 
+    body = dump_json(content)
+    if cfg.market_cache_enabled:
+        await MarketCacheService.set(cache_key, cache_version, next_cursor, body)
+    fresh_response = Response(content=body, media_type='application/json')
+    set_next_cursor(fresh_response, next_cursor)
+    return fresh_response
+
 
 @market_router.get("/userActiveAds")
 async def get_user_active_ads(
         request: Request,
+        response: Response,
         pag: Pagination = Depends(Pagination),
         user: Dict[str, Any] = Depends(get_current_user),
 ) -> list[Dict[str, Any]]:
@@ -97,31 +102,23 @@ async def get_user_active_ads(
         # Создаем запрос с использованием join и подгрузкой связанных данных
         stmt = (
             select(MarketModel)
-            .options(joinedload(MarketModel.enterprise))
             .options(selectinload(MarketModel.prices))
             .where(MarketModel.tg_id == user.get("tg_id"))
-            .limit(pag.limit)
-            .offset(pag.offset)
         )
+        stmt = MarketDAO.paginate(stmt, offset=pag.offset, limit=pag.limit, cursor=pag.cursor)
 
         result = await ses.execute(stmt)
         market_enterprises = result.scalars().all()
 
-    _ = get_translation(request=request, domain='enterprises')
+    set_next_cursor(response, MarketDAO.next_cursor(market_enterprises, pag.limit))
+
+    catalog = await CatalogService.with_enterprises(item.enterprise_id for item in market_enterprises)
+    lang = negotiate_language(request.headers.get('Accept-Language'))
 
     return [
         {
             **item.to_dict(),
-            "enterprise": Enterprise(
-                id=item.enterprise.id,
-                name=_(item.enterprise.name),
-                description=_(item.enterprise.description),
-                image_url=item.enterprise.image_url, # объект Enterprise тут нужен из-за валидатора в этом поле
-                type_id=item.enterprise.type_id,
-                capacity=item.enterprise.capacity,
-                game_price=item.enterprise.game_price,
-                stars_price=item.enterprise.stars_price,
-            ).dict(),
+            "enterprise": catalog.enterprise_dto(item.enterprise_id, lang),
             "prices": [price.to_dict() for price in item.prices]
         }
         for item in market_enterprises
@@ -139,34 +136,26 @@ async def get_market_history(
     Получение истории завершенных объявлений на маркете для текущего юзера
     """
     async with db.session_factory() as ses:
+        # Только колонки, без ORM объектов: строки сразу превращаются в dict и уходят в orjson
         stmt = (
-            select(UserMarketHistoryModel)
-            .options(joinedload(UserMarketHistoryModel.enterprise))
+            select(*UserMarketHistoryModel.columns())
             .where(UserMarketHistoryModel.tg_id == user.get("tg_id"))
-            .limit(pag.limit)
-            .offset(pag.offset)
         )
+        stmt = UserMarketHistoryDAO.paginate(stmt, offset=pag.offset, limit=pag.limit, cursor=pag.cursor)
 
         result = await ses.execute(stmt)
-        market_history = result.scalars().all()
+        market_history = result.all()
 
-    _ = get_translation(request=request, domain='enterprises')
-    return [
-        {
-            **item.to_dict(),
-            "enterprise": Enterprise(
-                id=item.enterprise.id,
-                name=_(item.enterprise.name) if _ else item.enterprise.name,
-                description=_(item.enterprise.description) if _ else item.enterprise.description,
-                image_url=item.enterprise.image_url,
-                type_id=item.enterprise.type_id,
-                capacity=item.enterprise.capacity,
-                game_price=item.enterprise.game_price,
-                stars_price=item.enterprise.stars_price,
-            ).dict(),
-        }
-        for item in market_history
-    ] if market_history else []
+    catalog = await CatalogService.with_enterprises(item.enterprise_id for item in market_history)
+    lang = negotiate_language(request.headers.get('Accept-Language'))
+
+    content = rows_to_dicts(market_history)
+    for item in content:
+        item["enterprise"] = catalog.enterprise_dto(item["enterprise_id"], lang)
+
+    history_response = Response(content=dump_json(content), media_type='application/json')
+    set_next_cursor(history_response, UserMarketHistoryDAO.next_cursor(market_history, pag.limit))
+    return history_response
 
 
 @market_router.post("/create")
@@ -194,12 +183,21 @@ async def create_enterprise_ad(
         await ses.flush()  # Выполняем flush, чтобы получить id новой записи
 
         start_price = await UserMarketPricesDAO.add(ses, obj_in=UserMarketPriceCreate(
-            market_enterprise_id=new_ad.id, currency_id=currency_id, price=price
+            market_id=new_ad.id, currency_id=currency_id, price=price
         ))
+        await MarketService.index_price(
+            ses,
+            market_id=new_ad.id,
+            enterprise_id=enterprise_id,
+            tg_id=user.get("tg_id"),
+            currency_id=currency_id,
+            price=price,
+        )
 
         # удаляем выставленное на продажу предприятие из таблицы user_enterprises
         await ses.delete(user_ents)
         await ses.commit()
+    await MarketCacheService.bump()
 
     return {'created_ad': new_ad.to_dict(), 'price': start_price.to_dict()}
 
@@ -213,11 +211,18 @@ async def add_price_in_ad(
     """
     Создание новой цены для указанного объявления \n
     1 валюта = 1 цена \n
-    market_enterprise_id - это id объявления из таблицы market_enterprises
+    market_id - это id объявления из таблицы market
     """
     async with db.session_factory() as ses:
+        target_ad = await MarketDAO.find_one_or_none(ses, id=price.market_id, tg_id=user.get("tg_id"))
+        if not target_ad:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="The ad does not exist"
+            )
+
         exist_prices = await UserMarketPricesDAO.find_all(
-            ses, market_enterprise_id=price.market_enterprise_id
+            ses, market_id=price.market_id
         )
         currencies_set = set(map(lambda x: x.currency_id, exist_prices))
         if price.currency_id in currencies_set:
@@ -228,12 +233,21 @@ async def add_price_in_ad(
 
         new_price = await UserMarketPricesDAO.add(
             ses, obj_in=UserMarketPriceCreate(
-                market_enterprise_id=price.market_enterprise_id,
+                market_id=price.market_id,
                 currency_id=price.currency_id,
                 price=price.price
             )
         )
+        await MarketService.index_price(
+            ses,
+            market_id=target_ad.id,
+            enterprise_id=target_ad.enterprise_id,
+            tg_id=target_ad.tg_id,
+            currency_id=price.currency_id,
+            price=price.price,
+        )
         await ses.commit()
+    await MarketCacheService.bump()
 
     return new_price.to_dict()
 
@@ -248,99 +262,16 @@ async def buy_enterprise_on_market(
     """
     Покупка предприятия на маркете \n
     """
-    async with db.session_factory() as ses:
-        currency = await CurrencyDAO.find_one_or_none(ses, id=currency_id)
-        if not currency:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Currency not found"
-            )
-
-        target_ad = await MarketDAO.find_one_or_none(
-            ses, id=market_id
-        )
-        if not target_ad:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="The ad does not exist"
-            )
-
-        prices = await UserMarketPricesDAO.find_all(
-            ses, market_id=market_id
-        )
-
-        target_price = [item for item in prices if item.currency_id == currency_id]
-        if target_price is None or len(target_price) == 0:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Price for this currency not found"
-            )
-        target_price = target_price[0]
-
-        buyer_user = await UserDAO.find_one_or_none(ses, tg_id=user.get('tg_id'))
-        seller_user = await UserDAO.find_one_or_none(ses, tg_id=target_ad.tg_id)
-        if not buyer_user or not seller_user:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Buyer user or Seller user not found"
-            )
-
-        buyed_ad = None
-        buyed_enterprise = None
-
-        if currency.code == 'GDP':
-            if buyer_user.game_balance < target_price.price:
-                raise HTTPException(
-                    status_code=status.HTTP_403_FORBIDDEN,
-                    detail="Not enough gdp"
-                )
-            else:
-                buyer_user.game_balance = buyer_user.game_balance - target_price.price
-                seller_user.game_balance = seller_user.game_balance + target_price.price
-                # Добавляем купленное предприятие покупателю
-                buyed_ad = await UserEnterpriseDAO.add(
-                    ses, obj_in=UserEnterpriseCreate(
-                        tg_id=buyer_user.tg_id,
-                        enterprise_id=target_ad.enterprise_id,
-                    )
-                )
-                buyed_enterprise = await EnterpriseDAO.find_one_or_none(
-                    ses, id=buyed_ad.enterprise_id
-                )
-
-                # Удаляем объявление с маркета
-                await MarketDAO.delete(
-                    ses, id=market_id
-                )
-                # Создаем запись в истории продаж
-                await UserMarketHistoryDAO.add(
-                    ses, obj_in=UserMarketHistoryCreate(
-                        tg_id=seller_user.tg_id,
-                        enterprise_id=target_ad.enterprise_id,
-                        buyer_id=buyer_user.id,
-                        sold_currency_id=currency.id,
-                        sold_price=target_price.price,
-                    )
-                )
-                await ses.commit()
-        else:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Other currencies are currently not supported."
-            )
+    buyed_ad, _ = await MarketService.buy(
+        buyer_tg_id=user.get('tg_id'),
+        market_id=market_id,
+        currency_id=currency_id,
+    )
 
-    _ = get_translation(request=request, domain='enterprises')
+    catalog = await CatalogService.with_enterprises([buyed_ad.enterprise_id])
+    lang = negotiate_language(request.headers.get('Accept-Language'))
 
     return {
         **buyed_ad.to_dict(),
-        'enteprise': Enterprise(
-            id=buyed_enterprise.id,
-            name=_(buyed_enterprise.name) if _ else buyed_enterprise.name,
-            description=_(buyed_enterprise.description) if _ else buyed_enterprise.description,
-            image_url=buyed_enterprise.image_url,
-            type_id=buyed_enterprise.type_id,
-            capacity=buyed_enterprise.capacity,
-            game_price=buyed_enterprise.game_price,
-            stars_price=buyed_enterprise.stars_price,
-        ).dict()
+        'enteprise': catalog.enterprise_dto(buyed_ad.enterprise_id, lang)
     } if buyed_ad else {}
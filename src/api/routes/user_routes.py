@@ -1,13 +1,15 @@
 from typing import Any, Optional, Dict
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query
 from fastapi.responses import ORJSONResponse
 
 from src.core.dependencies import get_current_user, get_current_superuser
-from src.core.enums import RatingType
+from src.core.enums import RatingType, RatingScope
 from src.core.schemas import Pagination
 from src.api.schemas.user_schemas import (UserUpdate, UserBalanceUpdate, User, UserCreate)
 from src.api.services.user_service import UserService
+from src.api.services.tap_service import TapService
+from src.api.services.leaderboard_service import LeaderboardService
 
 from src.settings import get_settings
 
@@ -83,7 +85,11 @@ async def update_game_balance(
     current_tap_count - текущее значение счетчика тапов, которое сделал юзер \n\n
 
     """
-    # tap_count = await redis.get(tg_id)
+    if cfg.taps_buffer_enabled:
+        # Тапы копятся в redis и пачками сбрасываются в базу
+        return await TapService.update_game_balance(
+            tg_id=user.get("tg_id"), new_tap_count=balance.current_tap_count)
+
     res = await UserService.update_game_balance(
         tg_id=user.get("tg_id"), new_tap_count=balance.current_tap_count)
     return res
@@ -101,3 +107,39 @@ async def get_referrals_stats_by_telegram_id(
     )
     return ORJSONResponse(content=stat)
 
+
+@user_router.get("/rating")
+async def get_rating(
+        rating_type: RatingType = RatingType.gdp,
+        scope: RatingScope = RatingScope.global_,
+        scope_id: Optional[int] = None,
+        pag: Pagination = Depends(Pagination),
+        user: Dict[str, Any] = Depends(get_current_user),
+) -> ORJSONResponse:
+    """
+    Топ юзеров по рейтингу\n
+    rating_type - gdp или capacity\n
+    scope - global, country или region (для country и region нужен scope_id)\n
+    """
+    top = await LeaderboardService.get_top(
+        rating_type, scope, scope_id, offset=pag.offset, limit=pag.limit
+    )
+    return ORJSONResponse(content=top)
+
+
+@user_router.get("/ratingAroundMe")
+async def get_rating_around_me(
+        rating_type: RatingType = RatingType.gdp,
+        scope: RatingScope = RatingScope.global_,
+        scope_id: Optional[int] = None,
+        radius: int = Query(default=10, gt=0, le=100),
+        user: Dict[str, Any] = Depends(get_current_user),
+) -> ORJSONResponse:
+    """
+    Позиция юзера в рейтинге и соседи сверху и снизу\n
+    """
+    around = await LeaderboardService.get_around(
+        user.get("user_id"), rating_type, scope, scope_id, radius=radius
+    )
+    position = await LeaderboardService.get_position(user.get("user_id"), rating_type, scope, scope_id)
+    return ORJSONResponse(content=dict(position=position, users=around))
@@ -1,4 +1,5 @@
 import uuid
+from datetime import datetime
 from typing_extensions import Annotated, Optional
 from pydantic import BaseModel, Field, StringConstraints
 
@@ -17,6 +18,14 @@ class RefreshSessionUpdate(RefreshSessionCreate):
     user_id: Optional[uuid.UUID] = Field(None)
 
 
+class RefreshSession(BaseModel):
+    refresh_token: uuid.UUID
+    user_id: uuid.UUID
+    tg_id: int
+    created_at: datetime
+    expires_in: int
+
+
 class Token(BaseModel):
     access_token: str
     refresh_token: uuid.UUID
@@ -10,6 +10,7 @@ from src.core.models import UserModel, RefreshSessionModel
 from src.api.dao import UserDAO, RefreshSessionDAO
 from src.core.database import db_helper as db
 from src.core.exceptions import InvalidTokenException, TokenExpiredException
+from src.api.services.session_store import get_session_store
 
 from src.api.logging import exception_and_log, log
 from src.settings import get_settings
@@ -25,63 +26,46 @@ class AuthService:
             days=cfg.REFRESH_TOKEN_EXPIRE_DAYS)
         refresh_token = cls._create_refresh_token()
 
-        async with db.session_factory() as ses:
-            await RefreshSessionDAO.add(
-                ses,
-                RefreshSessionCreate(
-                    user_id=user_id,
-                    refresh_token=refresh_token,
-                    expires_in=refresh_token_expires.total_seconds()
-                )
-            )
-            await ses.commit()
+        await get_session_store().add(
+            user_id=user_id,
+            tg_id=tg_id,
+            refresh_token=refresh_token,
+            expires_in=int(refresh_token_expires.total_seconds())
+        )
         return Token(access_token=access_token, refresh_token=refresh_token, token_type="bearer")
 
 
     @classmethod
-    async def logout(cls, token: uuid.UUID) -> None:
-        async with db.session_factory() as ses:
-            refresh_session = await RefreshSessionDAO.find_one_or_none(
-                ses,
-                RefreshSessionModel.refresh_token == token
-            )
-            if refresh_session:
-                await RefreshSessionDAO.delete(ses, id=refresh_session.id)
-            await ses.commit()
+    async def logout(cls, token: Optional[uuid.UUID]) -> None:
+        if token is None:
+            return
+        await get_session_store().delete(token)
 
 
     @classmethod
     async def refresh_token(cls, token: uuid.UUID) -> Token:
-        async with db.session_factory() as ses:
-            refresh_session = await RefreshSessionDAO.find_one_or_none(
-                ses,
-                RefreshSessionModel.refresh_token == token
-            )
-
-            if refresh_session is None:
-                raise InvalidTokenException
-            if datetime.now(timezone.utc) >= refresh_session.created_at + timedelta(seconds=refresh_session.expires_in):
-                await RefreshSessionDAO.delete(ses, id=refresh_session.id)
-                raise TokenExpiredException
-
-            user = await UserDAO.find_one_or_none(ses, id=refresh_session.user_id)
-            if user is None:
-                raise InvalidTokenException
-
-            access_token = cls._create_access_token(user.id, user.tg_id)
-            refresh_token_expires = timedelta(
-                days=cfg.REFRESH_TOKEN_EXPIRE_DAYS)
-            refresh_token = cls._create_refresh_token()
-
-            await RefreshSessionDAO.update(
-                ses,
-                RefreshSessionModel.id == refresh_session.id,
-                obj_in=RefreshSessionUpdate(
-                    refresh_token=refresh_token,
-                    expires_in=refresh_token_expires.total_seconds()
-                )
-            )
-            await ses.commit()
+        store = get_session_store()
+        refresh_session = await store.get(token)
+
+        if refresh_session is None:
+            raise InvalidTokenException
+        if datetime.now(timezone.utc) >= refresh_session.created_at + timedelta(seconds=refresh_session.expires_in):
+            await store.delete(token)
+            raise TokenExpiredException
+
+        access_token = cls._create_access_token(refresh_session.user_id, refresh_session.tg_id)
+        refresh_token_expires = timedelta(
+            days=cfg.REFRESH_TOKEN_EXPIRE_DAYS)
+        refresh_token = cls._create_refresh_token()
+
+        # Токен одноразовый: если его уже обменяли параллельным запросом, второй обмен не пройдет
+        rotated = await store.rotate(
+            refresh_session,
+            new_token=refresh_token,
+            expires_in=int(refresh_token_expires.total_seconds())
+        )
+        if not rotated:
+            raise InvalidTokenException
         return Token(access_token=access_token, refresh_token=refresh_token, token_type="bearer")
 
 
@@ -96,9 +80,7 @@ class AuthService:
 
     @classmethod
     async def abort_all_sessions(cls, user_id: uuid.UUID):
-        async with db.session_factory() as ses:
-            await RefreshSessionDAO.delete(ses, RefreshSessionModel.user_id == user_id)
-            await ses.commit()
+        await get_session_store().delete_user(user_id)
 
 
     @classmethod
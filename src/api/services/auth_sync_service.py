@@ -0,0 +1,246 @@
+import asyncio
+import hashlib
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import orjson
+from aiogram.utils.web_app import WebAppUser
+from sqlalchemy import update, values, column, func, BigInteger, String
+
+from src.core.models import UserModel
+from src.core.database import db_helper as db
+from src.others.redis_client import redis_client
+
+from src.api.logging import log
+from src.settings import get_settings
+
+cfg = get_settings()
+
+
+AUTH_PROFILE_PREFIX = 'auth:profile:'  # отпечаток последних данных профиля из initData
+AUTH_CHECKIN_PREFIX = 'auth:checkin:'  # отметка о ежедневном входе юзера за день
+AUTH_PENDING_KEY = 'auth:pending'  # изменения, ожидающие записи в базу
+AUTH_JOURNAL_KEY = 'auth:journal'  # пачка, которая сейчас пишется в базу
+
+# Поля hash с изменениями: p:<tg_id> - профиль (json), a:<tg_id> - auth_date
+PROFILE_FIELD = 'p:'
+AUTH_DATE_FIELD = 'a:'
+
+CHECKIN_TTL = 2 * 24 * 3600
+
+
+# Переносит накопленные изменения в журнал.
+# Если журнал уже есть (прошлый сброс не завершился), возвращает его для повторной записи
+# KEYS[1] - изменения, KEYS[2] - журнал, ARGV[1] - id новой пачки
+DRAIN_TO_JOURNAL_LUA = """
+if redis.call('EXISTS', KEYS[2]) == 0 then
+    if redis.call('EXISTS', KEYS[1]) == 0 then
+        return {}
+    end
+    redis.call('RENAME', KEYS[1], KEYS[2])
+    redis.call('HSET', KEYS[2], '__batch_id', ARGV[1])
+end
+return redis.call('HGETALL', KEYS[2])
+"""
+
+# Удаляет журнал, только если в нем лежит та же пачка
+# KEYS[1] - журнал, ARGV[1] - id пачки
+DELETE_JOURNAL_LUA = """
+if redis.call('HGET', KEYS[1], '__batch_id') == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def profile_fingerprint(user: WebAppUser) -> str:
+    raw = f'{user.username or ""}\x00{user.first_name or ""}\x00{user.last_name or ""}'
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def _checkin_key(tg_id: int) -> str:
+    return f'{AUTH_CHECKIN_PREFIX}{tg_id}:{datetime.utcnow().date().isoformat()}'
+
+
+class AuthSyncService:
+    """
+    Отложенная запись служебных данных, которые обновляются при каждой авторизации через webapp.
+    Неизменившиеся данные не пишутся вовсе (сравнение с отпечатком в redis),
+    изменения копятся в redis и периодически пачками сбрасываются в postgres.
+    Ежедневный вход (счетчик ежедневных наград) обрабатывается в базе один раз в день
+    """
+    _scripts: Dict[str, Any] = {}
+    _flush_task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def _script(cls, name: str, lua: str):
+        script = cls._scripts.get(name)
+        if script is None:
+            script = redis_client.redis.register_script(lua)
+            cls._scripts[name] = script
+        return script
+
+    @classmethod
+    async def touch_profile(cls, user: WebAppUser) -> bool:
+        """
+        Возвращает True, если юзер уже известен и синхронная запись не нужна.
+        Если профиль изменился, изменения ставятся в очередь на запись
+        """
+        key = f'{AUTH_PROFILE_PREFIX}{user.id}'
+        fingerprint = profile_fingerprint(user)
+        cached = await redis_client.redis.get(key)
+        if cached is None:
+            return False
+        if cached == fingerprint:
+            return True
+
+        profile = dict(
+            username=user.username,
+            first_name=user.first_name,
+            last_name=user.last_name,
+            tg_url=f'https://t.me/{user.username}' if user.username else None,
+        )
+        async with redis_client.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(AUTH_PENDING_KEY, f'{PROFILE_FIELD}{user.id}', orjson.dumps(profile).decode())
+            pipe.set(key, fingerprint, ex=cfg.auth_fingerprint_ttl)
+            await pipe.execute()
+        return True
+
+    @classmethod
+    async def remember_profile(cls, user: WebAppUser) -> None:
+        await redis_client.redis.set(
+            f'{AUTH_PROFILE_PREFIX}{user.id}', profile_fingerprint(user), ex=cfg.auth_fingerprint_ttl
+        )
+
+    @classmethod
+    async def claim_check_in(cls, tg_id: int) -> bool:
+        """
+        Возвращает True только для первого входа юзера за текущий день (UTC)
+        """
+        return bool(await redis_client.redis.set(_checkin_key(tg_id), 1, nx=True, ex=CHECKIN_TTL))
+
+    @classmethod
+    async def release_check_in(cls, tg_id: int) -> None:
+        await redis_client.redis.delete(_checkin_key(tg_id))
+
+    @classmethod
+    async def enqueue_auth_date(cls, tg_id: int, auth_timestamp: int) -> None:
+        await redis_client.redis.hset(AUTH_PENDING_KEY, f'{AUTH_DATE_FIELD}{tg_id}', auth_timestamp)
+
+    @classmethod
+    async def forget(cls, tg_id: int) -> None:
+        """
+        Сбрасывает кэш юзера. Вызывать при удалении юзера из базы
+        """
+        try:
+            async with redis_client.redis.pipeline(transaction=False) as pipe:
+                pipe.delete(f'{AUTH_PROFILE_PREFIX}{tg_id}', _checkin_key(tg_id))
+                pipe.hdel(AUTH_PENDING_KEY, f'{PROFILE_FIELD}{tg_id}', f'{AUTH_DATE_FIELD}{tg_id}')
+                await pipe.execute()
+        except Exception as e:
+            log.error(f'Auth cache reset error: {e}')
+
+    @classmethod
+    async def flush(cls) -> int:
+        """
+        Сбрасывает накопленные изменения в базу.
+        Возвращает количество записанных изменений
+        """
+        raw = await cls._script('drain', DRAIN_TO_JOURNAL_LUA)(
+            keys=[AUTH_PENDING_KEY, AUTH_JOURNAL_KEY], args=[uuid.uuid4().hex]
+        )
+        if not raw:
+            return 0
+
+        journal = dict(zip(raw[::2], raw[1::2]))
+        batch_id = journal.pop('__batch_id')
+        profiles: List[tuple] = []
+        auth_dates: List[tuple] = []
+        for field, value in journal.items():
+            if field.startswith(PROFILE_FIELD):
+                profile = orjson.loads(value)
+                profiles.append((
+                    int(field[len(PROFILE_FIELD):]),
+                    profile['username'], profile['first_name'], profile['last_name'], profile['tg_url'],
+                ))
+            elif field.startswith(AUTH_DATE_FIELD):
+                auth_dates.append((int(field[len(AUTH_DATE_FIELD):]), int(value)))
+
+        # Записи идемпотентны (перезапись значений), поэтому повторный сброс журнала после падения безопасен
+        await cls._write_batch(profiles, auth_dates)
+
+        await cls._script('delete_journal', DELETE_JOURNAL_LUA)(
+            keys=[AUTH_JOURNAL_KEY], args=[batch_id]
+        )
+        return len(profiles) + len(auth_dates)
+
+    @classmethod
+    async def _write_batch(cls, profiles: List[tuple], auth_dates: List[tuple]) -> None:
+        size = cfg.auth_flush_batch_size
+        async with db.session_factory() as ses:
+            for start in range(0, len(profiles), size):
+                data = values(
+                    column('tg_id', BigInteger),
+                    column('username', String),
+                    column('first_name', String),
+                    column('last_name', String),
+                    column('tg_url', String),
+                    name='profiles',
+                ).data(profiles[start:start + size])
+
+                # Пустые поля из initData не затирают сохраненные, как и в _auto_update_user
+                await ses.execute(
+                    update(UserModel)
+                    .where(UserModel.tg_id == data.c.tg_id)
+                    .values(
+                        username=func.coalesce(data.c.username, UserModel.username),
+                        first_name=func.coalesce(data.c.first_name, UserModel.first_name),
+                        last_name=func.coalesce(data.c.last_name, UserModel.last_name),
+                        tg_url=func.coalesce(data.c.tg_url, UserModel.tg_url),
+                    )
+                )
+
+            for start in range(0, len(auth_dates), size):
+                data = values(
+                    column('tg_id', BigInteger),
+                    column('auth_date', BigInteger),
+                    name='auth_dates',
+                ).data(auth_dates[start:start + size])
+
+                await ses.execute(
+                    update(UserModel)
+                    .where(UserModel.tg_id == data.c.tg_id)
+                    .values(auth_date=func.greatest(func.coalesce(UserModel.auth_date, 0), data.c.auth_date))
+                )
+
+            await ses.commit()
+
+    @classmethod
+    async def _flush_loop(cls) -> None:
+        while True:
+            try:
+                await cls.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.error(f'Auth flush error: {e}')
+            await asyncio.sleep(cfg.auth_flush_interval)
+
+    @classmethod
+    def start(cls) -> None:
+        if cls._flush_task is None:
+            cls._flush_task = asyncio.create_task(cls._flush_loop())
+
+    @classmethod
+    async def stop(cls) -> None:
+        if cls._flush_task is not None:
+            cls._flush_task.cancel()
+            try:
+                await cls._flush_task
+            except asyncio.CancelledError:
+                pass
+            cls._flush_task = None
+        # Дописываем все, что успели накопить до остановки
+        while await cls.flush():
+            pass
@@ -0,0 +1,209 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, Generic, Iterable, Optional, Tuple, TypeVar
+
+from sqlalchemy import select
+
+from src.core.models import LevelModel, CurrencyModel, EnterpriseModel, DailyRewardsModel, ReferralRewardsModel
+from src.core.database import db_helper as db, Base
+from src.core.utils import translations, DEFAULT_LANGUAGE
+from src.api.schemas.enterprise_schemas import Enterprise
+from src.others.redis_client import redis_client
+
+from src.api.logging import log
+from src.settings import get_settings
+
+cfg = get_settings()
+
+ModelType = TypeVar("ModelType", bound=Base)
+
+
+@dataclass(frozen=True)
+class CatalogTable(Generic[ModelType]):
+    """
+    Снимок маленькой справочной таблицы с поиском за O(1)
+    по первичному ключу и по вторичному ключу (level, code, day_number...)
+    """
+    rows: Tuple[ModelType, ...] = ()
+    by_id: Dict[Any, ModelType] = field(default_factory=dict)
+    by_key: Dict[Any, ModelType] = field(default_factory=dict)
+
+    @classmethod
+    def build(cls, rows, key: Optional[str] = None) -> "CatalogTable[ModelType]":
+        by_key = {}
+        if key:
+            for row in rows:
+                # как и find_first, при дублях берем первую запись
+                by_key.setdefault(getattr(row, key), row)
+        return cls(rows=tuple(rows), by_id={row.id: row for row in rows}, by_key=by_key)
+
+    def get(self, id: Any) -> Optional[ModelType]:
+        return self.by_id.get(id)
+
+    def find(self, key: Any) -> Optional[ModelType]:
+        return self.by_key.get(key)
+
+
+@dataclass(frozen=True)
+class Catalog:
+    levels: CatalogTable[LevelModel]
+    currencies: CatalogTable[CurrencyModel]
+    enterprises: CatalogTable[EnterpriseModel]
+    daily_rewards: CatalogTable[DailyRewardsModel]
+    referral_rewards: CatalogTable[ReferralRewardsModel]
+    loaded_at: float
+    # Готовые локализованные dict предприятий для ответов api: (enterprise_id, lang) -> dict
+    enterprise_dtos: Dict[Tuple[int, str], Dict[str, Any]] = field(default_factory=dict)
+
+    def enterprise_dto(self, enterprise_id: int, lang: str) -> Optional[Dict[str, Any]]:
+        """
+        Предприятие в формате Enterprise().dict() с переведенными name и description.
+        Возвращается общий для всех запросов dict, изменять его нельзя
+        """
+        dto = self.enterprise_dtos.get((enterprise_id, lang))
+        if dto is None:
+            enterprise = self.enterprises.get(enterprise_id)
+            if enterprise is None:
+                return None
+            dto = self._build_enterprise_dto(enterprise, lang)
+        return dto
+
+    def build_enterprise_dtos(self, languages) -> None:
+        for lang in languages:
+            for enterprise in self.enterprises.rows:
+                self._build_enterprise_dto(enterprise, lang)
+
+    def _build_enterprise_dto(self, enterprise: EnterpriseModel, lang: str) -> Dict[str, Any]:
+        _ = translations.gettext('enterprises', lang)
+        # объект Enterprise нужен из-за валидатора image_url
+        dto = Enterprise(
+            id=enterprise.id,
+            name=_(enterprise.name),
+            description=_(enterprise.description),
+            image_url=enterprise.image_url,
+            type_id=enterprise.type_id,
+            capacity=enterprise.capacity,
+            game_price=enterprise.game_price,
+            stars_price=enterprise.stars_price,
+        ).dict()
+        self.enterprise_dtos[(enterprise.id, lang)] = dto
+        return dto
+
+
+class CatalogService:
+    """
+    In-process кэш почти статичных справочников.
+    Загружается при старте приложения, обновляется по ttl или по сообщению в redis канал
+    """
+    _catalog: Optional[Catalog] = None
+    _lock: Optional[asyncio.Lock] = None
+    _tasks: list[asyncio.Task] = []
+
+    @classmethod
+    async def load(cls) -> Catalog:
+        async with db.session_factory() as ses:
+            async def fetch(model):
+                result = await ses.execute(select(model).order_by(model.id))
+                return result.scalars().all()
+
+            catalog = Catalog(
+                levels=CatalogTable.build(await fetch(LevelModel), key='level'),
+                currencies=CatalogTable.build(await fetch(CurrencyModel), key='code'),
+                enterprises=CatalogTable.build(await fetch(EnterpriseModel)),
+                daily_rewards=CatalogTable.build(await fetch(DailyRewardsModel), key='day_number'),
+                referral_rewards=CatalogTable.build(await fetch(ReferralRewardsModel), key='ref_count'),
+                loaded_at=time.monotonic(),
+            )
+
+        catalog.build_enterprise_dtos(translations.languages | {DEFAULT_LANGUAGE})
+
+        # Подменяем снимок целиком, чтобы читатели не видели полуобновленное состояние
+        cls._catalog = catalog
+        cfg.debug and log.info('Catalog loaded')
+        return catalog
+
+    @classmethod
+    async def get(cls) -> Catalog:
+        catalog = cls._catalog
+        if catalog is not None and time.monotonic() - catalog.loaded_at < cfg.catalog_ttl:
+            return catalog
+
+        if cls._lock is None:
+            cls._lock = asyncio.Lock()
+        async with cls._lock:
+            # пока ждали блокировку, справочники мог обновить другой запрос
+            catalog = cls._catalog
+            if catalog is not None and time.monotonic() - catalog.loaded_at < cfg.catalog_ttl:
+                return catalog
+            return await cls.load()
+
+    @classmethod
+    async def with_enterprises(cls, enterprise_ids: Iterable[Optional[int]]) -> Catalog:
+        """
+        Справочники, в которых есть все enterprise_ids.
+        Предприятие могли добавить в базу после загрузки снимка: тогда справочники перечитываются сразу,
+        но не чаще catalog_miss_reload_interval, чтобы несуществующий id не вызывал загрузку на каждый запрос
+        """
+        catalog = await cls.get()
+        if all(catalog.enterprises.get(id) is not None for id in enterprise_ids if id is not None):
+            return catalog
+
+        if cls._lock is None:
+            cls._lock = asyncio.Lock()
+        async with cls._lock:
+            # пока ждали блокировку, справочники мог обновить другой запрос
+            catalog = cls._catalog or catalog
+            if time.monotonic() - catalog.loaded_at >= cfg.catalog_miss_reload_interval:
+                cfg.debug and log.info('Unknown enterprise requested, reloading catalog')
+                catalog = await cls.load()
+        return catalog
+
+    @classmethod
+    async def invalidate(cls) -> None:
+        """
+        Просит все воркеры перечитать справочники (вызывать после изменения таблиц)
+        """
+        cls._catalog = None
+        await redis_client.redis.publish(cfg.catalog_channel, 'invalidate')
+
+    @classmethod
+    async def _listen_invalidation(cls) -> None:
+        while True:
+            try:
+                async with redis_client.redis.pubsub() as pubsub:
+                    await pubsub.subscribe(cfg.catalog_channel)
+                    async for message in pubsub.listen():
+                        if message.get('type') == 'message':
+                            await cls.load()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.error(f'Catalog invalidation listener error: {e}')
+                await asyncio.sleep(1)
+
+    @classmethod
+    async def _refresh_loop(cls) -> None:
+        while True:
+            await asyncio.sleep(cfg.catalog_ttl)
+            try:
+                await cls.load()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.error(f'Catalog refresh error: {e}')
+
+    @classmethod
+    async def start(cls) -> None:
+        await cls.load()
+        cls._tasks = [
+            asyncio.create_task(cls._refresh_loop()),
+            asyncio.create_task(cls._listen_invalidation()),
+        ]
+
+    @classmethod
+    async def stop(cls) -> None:
+        for task in cls._tasks:
+            task.cancel()
+        await asyncio.gather(*cls._tasks, return_exceptions=True)
+        cls._tasks = []
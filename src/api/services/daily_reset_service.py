@@ -0,0 +1,209 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+from datetime import time as dt_time
+from typing import Any, Dict, Optional
+
+from sqlalchemy import select, update, delete, or_
+
+from src.core.models import UserModel, UserDailyRewardedTaskModel
+from src.core.database import db_helper as db
+from src.api.dao import UserDAO
+from src.others.redis_client import redis_client
+from src.api.services.tap_service import TapService
+
+from src.api.logging import log
+from src.settings import get_settings
+
+cfg = get_settings()
+
+
+DAILY_RESET_PROGRESS_KEY = 'daily_reset:progress'  # hash с прогрессом последнего запуска
+DAILY_RESET_LOCK_KEY = 'daily_reset:lock'  # обработку ведет только один воркер
+DAILY_RESET_LOCK_TTL = 300  # секунды, продлевается после каждой пачки
+
+STATUS_RUNNING = 'running'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+
+class DailyResetService:
+    """
+    Ночная обработка всех юзеров: восстановление энергии до energy_limit
+    и сброс ежедневных наград у тех, кто пропустил больше одного дня.
+    Таблица users проходится пачками по первичному ключу (keyset), каждая пачка - отдельная короткая
+    транзакция, между пачками пауза, чтобы не мешать основной нагрузке.
+    Прогресс лежит в redis: прерванный запуск продолжается с последней пачки
+    """
+    _task: Optional[asyncio.Task] = None
+
+    @classmethod
+    async def run(
+            cls,
+            batch_size: Optional[int] = None,
+            pause: Optional[float] = None,
+            force: bool = False,
+    ) -> Dict[str, Any]:
+        """
+        Обработка за текущие сутки (UTC). Если она уже завершена, повторно не запускается (кроме force).
+        Возвращает прогресс запуска
+        """
+        batch_size = batch_size or cfg.daily_reset_batch_size
+        pause = cfg.daily_reset_pause if pause is None else pause
+        run_date = datetime.utcnow().date()
+
+        lock_token = await redis_client.acquire_lock(DAILY_RESET_LOCK_KEY, DAILY_RESET_LOCK_TTL)
+        if lock_token is None:
+            cfg.debug and log.info('Daily reset is already running in another worker')
+            return await cls.progress()
+
+        try:
+            progress = await cls.progress()
+            if progress.get('date') == run_date.isoformat() and not force:
+                if progress.get('status') == STATUS_DONE:
+                    return progress
+                # Продолжаем прерванный запуск с последней обработанной пачки
+                last_id = progress.get('last_id') or None
+            else:
+                progress = dict(
+                    date=run_date.isoformat(), status=STATUS_RUNNING, started_at=int(time.time()),
+                    finished_at='', last_id='', chunks=0, scanned=0, energy_refilled=0, cache_refilled=0,
+                    counters_reset=0, tasks_deleted=0, elapsed=0.0,
+                )
+                last_id = None
+            progress['status'] = STATUS_RUNNING
+            await redis_client.redis.hset(DAILY_RESET_PROGRESS_KEY, mapping=progress)
+
+            if last_id is not None:
+                last_id = UserDAO._coerce_cursor_value(UserModel.id, last_id)
+            # Ежедневные награды сбрасываются так же, как при входе (UserService._telegram_check_in):
+            # если последний вход был раньше вчерашнего дня
+            reset_before = int(datetime.combine(run_date - timedelta(days=1), dt_time.min).timestamp())
+
+            started = time.perf_counter()
+            while True:
+                chunk = await cls._process_chunk(last_id, batch_size, reset_before)
+                if chunk is None:
+                    break
+                last_id = chunk.pop('last_id')
+
+                progress['chunks'] = int(progress['chunks']) + 1
+                for name, value in chunk.items():
+                    progress[name] = int(progress[name]) + value
+                progress['last_id'] = str(last_id)
+                progress['elapsed'] = round(float(progress['elapsed']) + time.perf_counter() - started, 3)
+                started = time.perf_counter()
+
+                # Лок продлевается только своим владельцем. Если пачка шла дольше ttl и лок забрал
+                # другой воркер, прогресс уже ведет он: останавливаемся, не трогая его лок
+                if not await redis_client.extend_lock(DAILY_RESET_LOCK_KEY, lock_token, DAILY_RESET_LOCK_TTL):
+                    log.error('Daily reset lost its lock, stopping')
+                    return progress
+                await redis_client.redis.hset(DAILY_RESET_PROGRESS_KEY, mapping=progress)
+
+                if chunk['scanned'] < batch_size:
+                    break
+                if pause:
+                    await asyncio.sleep(pause)
+
+            progress['status'] = STATUS_DONE
+            progress['finished_at'] = int(time.time())
+            await redis_client.redis.hset(DAILY_RESET_PROGRESS_KEY, mapping=progress)
+            log.info(f'Daily reset finished: {progress}')
+            return progress
+        except Exception:
+            await redis_client.redis.hset(DAILY_RESET_PROGRESS_KEY, 'status', STATUS_FAILED)
+            raise
+        finally:
+            await redis_client.release_lock(DAILY_RESET_LOCK_KEY, lock_token)
+
+    @classmethod
+    async def _process_chunk(cls, last_id: Any, batch_size: int, reset_before: int) -> Optional[Dict[str, Any]]:
+        async with db.session_factory() as ses:
+            stmt = select(UserModel.id).order_by(UserModel.id).limit(batch_size)
+            if last_id is not None:
+                stmt = stmt.where(UserModel.id > last_id)
+            ids = (await ses.scalars(stmt)).all()
+            if not ids:
+                return None
+
+            # Границы пачки вместо списка id: обновления идут по диапазону индекса первичного ключа
+            in_chunk = [UserModel.id >= ids[0], UserModel.id <= ids[-1]]
+
+            refilled = await ses.execute(
+                update(UserModel)
+                .where(*in_chunk, or_(UserModel.energy.is_(None), UserModel.energy < cfg.energy_limit))
+                .values(energy=cfg.energy_limit)
+                .returning(UserModel.tg_id)
+                .execution_options(synchronize_session=False)
+            )
+            refilled_tg_ids = refilled.scalars().all()
+
+            reset = await ses.execute(
+                update(UserModel)
+                .where(*in_chunk, UserModel.auth_date < reset_before, UserModel.daily_reward_counter > 1)
+                .values(daily_reward_counter=1)
+                .returning(UserModel.tg_id)
+                .execution_options(synchronize_session=False)
+            )
+            reset_tg_ids = reset.scalars().all()
+
+            tasks_deleted = 0
+            if reset_tg_ids:
+                deleted = await ses.execute(
+                    delete(UserDailyRewardedTaskModel)
+                    .where(UserDailyRewardedTaskModel.tg_id.in_(reset_tg_ids))
+                    .execution_options(synchronize_session=False)
+                )
+                tasks_deleted = deleted.rowcount
+            await ses.commit()
+
+        # Энергия в буфере тапов должна совпасть с базой, иначе ближайший сброс тапов ее перезапишет
+        cache_refilled = await TapService.refill_energy(refilled_tg_ids)
+
+        return dict(
+            last_id=ids[-1],
+            scanned=len(ids),
+            energy_refilled=len(refilled_tg_ids),
+            cache_refilled=cache_refilled,
+            counters_reset=len(reset_tg_ids),
+            tasks_deleted=tasks_deleted,
+        )
+
+    @classmethod
+    async def progress(cls) -> Dict[str, Any]:
+        return await redis_client.redis.hgetall(DAILY_RESET_PROGRESS_KEY)
+
+    @classmethod
+    def _is_due(cls, progress: Dict[str, Any]) -> bool:
+        now = datetime.utcnow()
+        if now.hour < cfg.daily_reset_hour:
+            return False
+        return not (progress.get('date') == now.date().isoformat() and progress.get('status') == STATUS_DONE)
+
+    @classmethod
+    async def _loop(cls) -> None:
+        while True:
+            try:
+                if cls._is_due(await cls.progress()):
+                    await cls.run()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.error(f'Daily reset error: {e}')
+            await asyncio.sleep(cfg.daily_reset_check_interval)
+
+    @classmethod
+    def start(cls) -> None:
+        if cls._task is None:
+            cls._task = asyncio.create_task(cls._loop())
+
+    @classmethod
+    async def stop(cls) -> None:
+        if cls._task is not None:
+            cls._task.cancel()
+            try:
+                await cls._task
+            except asyncio.CancelledError:
+                pass
+            cls._task = None
@@ -0,0 +1,331 @@
+import uuid
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+from sqlalchemy import select
+
+from src.core.enums import RatingType, RatingScope
+from src.core.models import UserModel
+from src.core.database import db_helper as db
+from src.others.redis_client import redis_client
+
+from src.api.logging import log
+from src.settings import get_settings
+
+cfg = get_settings()
+
+
+LEADERBOARD_PREFIX = 'leaderboard'
+# Пока идет пересборка, юзеры, рейтинги которых менялись, запоминаются и после подмены ключей пересинхронизируются
+LEADERBOARD_REBUILD_KEY = 'leaderboard_rebuild:active'  # id текущей пересборки
+LEADERBOARD_TOUCHED_KEY = 'leaderboard_rebuild:touched'  # id юзеров, очки которых обновлялись
+LEADERBOARD_REMOVED_KEY = 'leaderboard_rebuild:removed'  # "id:country_id:region_id" удалений из рейтингов
+LEADERBOARD_REBUILD_TTL = 600  # секунды, продлевается после каждой пачки
+LEADERBOARD_READY_KEY = 'leaderboard_rebuild:done'  # ставится после первой полной пересборки
+
+# Запоминает изменения, только если сейчас идет пересборка
+# KEYS[1] - отметка пересборки, KEYS[2] - множество изменений
+# ARGV[1] - ttl, ARGV[2..] - элементы
+TRACK_REBUILD_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+redis.call('SADD', KEYS[2], unpack(ARGV, 2))
+redis.call('EXPIRE', KEYS[2], ARGV[1])
+return 1
+"""
+
+# Какое поле юзера является очками для каждого типа рейтинга
+RATING_FIELDS = {
+    RatingType.gdp: 'game_balance',
+    RatingType.capacity: 'total_capacity',
+}
+
+
+def leaderboard_key(rating_type: RatingType, scope: RatingScope, scope_id: Optional[int] = None) -> str:
+    if scope == RatingScope.global_:
+        return f'{LEADERBOARD_PREFIX}:{rating_type.value}:{scope.value}'
+    return f'{LEADERBOARD_PREFIX}:{rating_type.value}:{scope.value}:{scope_id}'
+
+
+def _user_keys(rating_type: RatingType, country_id: Optional[int], region_id: Optional[int]) -> List[str]:
+    keys = [leaderboard_key(rating_type, RatingScope.global_)]
+    if country_id is not None:
+        keys.append(leaderboard_key(rating_type, RatingScope.country, country_id))
+    if region_id is not None:
+        keys.append(leaderboard_key(rating_type, RatingScope.region, region_id))
+    return keys
+
+
+class LeaderboardService:
+    """
+    Рейтинги юзеров на redis sorted sets.
+    Для каждого типа рейтинга (gdp, capacity) ведутся глобальный рейтинг, рейтинги по странам и по регионам.
+    Поиск позиции - O(log n), страница топа и страница "вокруг меня" - O(log n + limit)
+    """
+    _scripts: Dict[str, Any] = {}
+
+    @classmethod
+    def _script(cls, name: str, lua: str):
+        script = cls._scripts.get(name)
+        if script is None:
+            script = redis_client.redis.register_script(lua)
+            cls._scripts[name] = script
+        return script
+
+    @classmethod
+    def _track_rebuild(cls, pipe, key: str, items: List[str]) -> None:
+        if items:
+            cls._script('track_rebuild', TRACK_REBUILD_LUA)(
+                keys=[LEADERBOARD_REBUILD_KEY, key], args=[LEADERBOARD_REBUILD_TTL, *items], client=pipe
+            )
+
+    @classmethod
+    async def sync_users(
+            cls,
+            users: Iterable[Any],
+            rating_types: Sequence[RatingType] = (RatingType.gdp, RatingType.capacity),
+    ) -> None:
+        """
+        Обновляет очки юзеров во всех их рейтингах.
+        users - любые объекты с полями id, country_id, region_id, game_balance и/или total_capacity
+        """
+        try:
+            async with redis_client.redis.pipeline(transaction=False) as pipe:
+                members = []
+                for user in users:
+                    member = str(user.id)
+                    members.append(member)
+                    for rating_type in rating_types:
+                        score = getattr(user, RATING_FIELDS[rating_type], None)
+                        if score is None:
+                            continue
+                        for key in _user_keys(rating_type, user.country_id, user.region_id):
+                            pipe.zadd(key, {member: score})
+                cls._track_rebuild(pipe, LEADERBOARD_TOUCHED_KEY, members)
+                await pipe.execute()
+        except Exception as e:
+            # Рейтинг вторичен по отношению к базе и может быть пересобран, поэтому не роняем запрос
+            log.error(f'Leaderboard update error: {e}')
+
+    @classmethod
+    async def remove_user(
+            cls,
+            user_id: uuid.UUID,
+            country_id: Optional[int],
+            region_id: Optional[int],
+    ) -> None:
+        try:
+            async with redis_client.redis.pipeline(transaction=False) as pipe:
+                for rating_type in RATING_FIELDS:
+                    for key in _user_keys(rating_type, country_id, region_id):
+                        pipe.zrem(key, str(user_id))
+                placement = ['' if item is None else str(item) for item in (country_id, region_id)]
+                cls._track_rebuild(pipe, LEADERBOARD_REMOVED_KEY, [':'.join([str(user_id), *placement])])
+                await pipe.execute()
+        except Exception as e:
+            log.error(f'Leaderboard remove error: {e}')
+
+    @classmethod
+    async def move_user(
+            cls,
+            user: Any,
+            old_country_id: Optional[int],
+            old_region_id: Optional[int],
+    ) -> None:
+        """
+        Переносит юзера между рейтингами после смены страны/региона
+        """
+        if old_country_id != user.country_id or old_region_id != user.region_id:
+            await cls.remove_user(user.id, old_country_id, old_region_id)
+        await cls.sync_users([user])
+
+    @classmethod
+    async def is_ready(cls) -> bool:
+        """
+        Рейтинги хотя бы раз собраны целиком (rebuild_leaderboards).
+        До этого в ключах только юзеры, очки которых менялись после включения рейтингов
+        """
+        return bool(await redis_client.redis.exists(LEADERBOARD_READY_KEY))
+
+    @classmethod
+    async def get_position(
+            cls,
+            user_id: uuid.UUID,
+            rating_type: RatingType,
+            scope: RatingScope,
+            scope_id: Optional[int] = None,
+    ) -> Optional[int]:
+        rank = await redis_client.redis.zrevrank(leaderboard_key(rating_type, scope, scope_id), str(user_id))
+        return rank + 1 if rank is not None else None
+
+    @classmethod
+    async def get_top(
+            cls,
+            rating_type: RatingType,
+            scope: RatingScope,
+            scope_id: Optional[int] = None,
+            offset: int = 0,
+            limit: int = 100,
+    ) -> list[Dict[str, Any]]:
+        entries = await redis_client.redis.zrevrange(
+            leaderboard_key(rating_type, scope, scope_id), offset, offset + limit - 1, withscores=True
+        )
+        return await cls._with_users(entries, first_position=offset + 1)
+
+    @classmethod
+    async def get_around(
+            cls,
+            user_id: uuid.UUID,
+            rating_type: RatingType,
+            scope: RatingScope,
+            scope_id: Optional[int] = None,
+            radius: int = 10,
+    ) -> list[Dict[str, Any]]:
+        key = leaderboard_key(rating_type, scope, scope_id)
+        rank = await redis_client.redis.zrevrank(key, str(user_id))
+        if rank is None:
+            return []
+        start = max(rank - radius, 0)
+        entries = await redis_client.redis.zrevrange(key, start, rank + radius, withscores=True)
+        return await cls._with_users(entries, first_position=start + 1)
+
+    @classmethod
+    async def _with_users(cls, entries: list, first_position: int) -> list[Dict[str, Any]]:
+        if not entries:
+            return []
+
+        async with db.session_factory() as ses:
+            stmt = (
+                select(
+                    UserModel.id, UserModel.first_name, UserModel.last_name,
+                    UserModel.game_balance, UserModel.total_capacity
+                )
+                .where(UserModel.id.in_([member for member, _ in entries]))
+            )
+            users = {str(row.id): row for row in (await ses.execute(stmt)).all()}
+
+        out = []
+        for position, (member, score) in enumerate(entries, start=first_position):
+            user = users.get(member)
+            if user is None:
+                continue
+            out.append({
+                'id': user.id,
+                'position': position,
+                'first_name': user.first_name,
+                'last_name': user.last_name,
+                'gdp': user.game_balance,
+                'capacity': user.total_capacity,
+                'score': int(score),
+            })
+        return out
+
+    @classmethod
+    async def rebuild(cls, batch_size: int = 5000) -> int:
+        """
+        Полная пересборка всех рейтингов из таблицы users.
+        Юзеры читаются пачками по первичному ключу, рейтинги собираются во временных ключах
+        и атомарно подменяют текущие через RENAME.
+        Изменения, сделанные во время пересборки, попали бы только в старые ключи и пропали бы при подмене,
+        поэтому они запоминаются (sync_users, remove_user) и повторяются после нее
+        """
+        build_id = uuid.uuid4().hex
+        redis = redis_client.redis
+        built_keys = set()
+        last_id = None
+        total = 0
+
+        await redis.delete(LEADERBOARD_TOUCHED_KEY, LEADERBOARD_REMOVED_KEY)
+        await redis.set(LEADERBOARD_REBUILD_KEY, build_id, ex=LEADERBOARD_REBUILD_TTL)
+
+        while True:
+            async with db.session_factory() as ses:
+                stmt = (
+                    select(
+                        UserModel.id, UserModel.country_id, UserModel.region_id,
+                        UserModel.game_balance, UserModel.total_capacity
+                    )
+                    .order_by(UserModel.id)
+                    .limit(batch_size)
+                )
+                if last_id is not None:
+                    stmt = stmt.where(UserModel.id > last_id)
+                users = (await ses.execute(stmt)).all()
+
+            if not users:
+                break
+
+            async with redis.pipeline(transaction=False) as pipe:
+                for user in users:
+                    for rating_type, field in RATING_FIELDS.items():
+                        score = getattr(user, field)
+                        if score is None:
+                            continue
+                        for key in _user_keys(rating_type, user.country_id, user.region_id):
+                            tmp_key = f'{key}:rebuild:{build_id}'
+                            built_keys.add(key)
+                            pipe.zadd(tmp_key, {str(user.id): score})
+                pipe.expire(LEADERBOARD_REBUILD_KEY, LEADERBOARD_REBUILD_TTL)
+                await pipe.execute()
+
+            total += len(users)
+            last_id = users[-1].id
+            cfg.debug and log.info(f'Leaderboard rebuild: {total} users processed')
+
+        # Рейтинги, которые опустели (например, регион без юзеров), удаляем
+        stale_keys = set()
+        async for key in redis.scan_iter(match=f'{LEADERBOARD_PREFIX}:*'):
+            if ':rebuild:' not in key and key not in built_keys:
+                stale_keys.add(key)
+
+        async with redis.pipeline(transaction=True) as pipe:
+            for key in built_keys:
+                pipe.rename(f'{key}:rebuild:{build_id}', key)
+            for key in stale_keys:
+                pipe.delete(key)
+            pipe.set(LEADERBOARD_READY_KEY, build_id)
+            await pipe.execute()
+
+        # Дальше изменения идут уже в новые ключи, остается повторить накопленные
+        await redis.delete(LEADERBOARD_REBUILD_KEY)
+        replayed = await cls._replay_rebuild_changes(batch_size)
+        cfg.debug and log.info(f'Leaderboard rebuild: {replayed} changed users re-synced')
+
+        return total
+
+    @classmethod
+    async def _replay_rebuild_changes(cls, batch_size: int) -> int:
+        """
+        Повторяет изменения, сделанные во время пересборки: сначала удаления из старых рейтингов,
+        затем текущие очки юзеров из базы
+        """
+        redis = redis_client.redis
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.smembers(LEADERBOARD_TOUCHED_KEY)
+            pipe.smembers(LEADERBOARD_REMOVED_KEY)
+            pipe.delete(LEADERBOARD_TOUCHED_KEY, LEADERBOARD_REMOVED_KEY)
+            touched, removed, _ = await pipe.execute()
+
+        user_ids = set(touched)
+        for item in removed:
+            user_id, country_id, region_id = item.split(':')
+            user_ids.add(user_id)
+            await cls.remove_user(
+                user_id,
+                int(country_id) if country_id else None,
+                int(region_id) if region_id else None,
+            )
+
+        user_ids = sorted(user_ids)
+        for start in range(0, len(user_ids), batch_size):
+            async with db.session_factory() as ses:
+                stmt = (
+                    select(
+                        UserModel.id, UserModel.country_id, UserModel.region_id,
+                        UserModel.game_balance, UserModel.total_capacity
+                    )
+                    .where(UserModel.id.in_(user_ids[start:start + batch_size]))
+                )
+                users = (await ses.execute(stmt)).all()
+            await cls.sync_users(users)
+        return len(user_ids)
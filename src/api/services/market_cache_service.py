@@ -0,0 +1,99 @@
+import hashlib
+from typing import Any, Optional, Tuple
+
+from src.core.cache import TTLCache
+from src.others.redis_client import redis_client
+
+from src.api.logging import log
+from src.settings import get_settings
+
+cfg = get_settings()
+
+
+MARKET_VERSION_KEY = 'market:version'  # увеличивается при любом изменении объявлений
+MARKET_ADS_PREFIX = 'market:ads:'
+
+
+class MarketCacheService:
+    """
+    Кэш готовых ответов /market/ads: L1 в памяти процесса и L2 в redis.
+    Хранятся уже сериализованные байты (курсор следующей страницы + json), поэтому при попадании
+    не выполняются ни запросы в базу, ни сборка pydantic моделей, ни переводы.
+    Ключ redis содержит версию маркета, поэтому после bump старые ответы просто перестают читаться
+    и истекают по ttl. L1 живет market_cache_l1_ttl секунд - это максимальная задержка
+    видимости изменений из других воркеров.
+    Версия читается один раз в get() до запроса в базу и передается в set(): если во время запроса
+    случился bump, ответ запишется под старой версией и читаться уже не будет
+    """
+    _l1 = TTLCache(maxsize=cfg.market_cache_l1_size, ttl=cfg.market_cache_l1_ttl)
+    _generation: int = 0  # счетчик bump в этом процессе, защищает L1 от записи устаревших ответов
+
+    @staticmethod
+    def make_key(*parts: Any) -> str:
+        return hashlib.blake2b(repr(parts).encode(), digest_size=16).hexdigest()
+
+    @classmethod
+    async def get(cls, key: str) -> Tuple[Optional[Tuple[Optional[str], bytes]], Tuple[int, Optional[str]]]:
+        """
+        Возвращает (закэшированный ответ или None, версия кэша для последующего set)
+        """
+        generation = cls._generation
+        cached = cls._l1.get(key)
+        if cached is not None:
+            return cls._unpack(cached), (generation, None)
+
+        try:
+            version = await redis_client.redis.get(MARKET_VERSION_KEY) or '0'
+        except Exception as e:
+            log.error(f'Market cache read error: {e}')
+            return None, (generation, None)
+        try:
+            cached = await redis_client.binary.get(f'{MARKET_ADS_PREFIX}{version}:{key}')
+        except Exception as e:
+            log.error(f'Market cache read error: {e}')
+            return None, (generation, version)
+        if cached is None:
+            return None, (generation, version)
+        if generation == cls._generation:
+            cls._l1.set(key, cached)
+        return cls._unpack(cached), (generation, version)
+
+    @classmethod
+    async def set(
+            cls,
+            key: str,
+            version: Tuple[int, Optional[str]],
+            next_cursor: Optional[str],
+            body: bytes,
+    ) -> None:
+        """
+        version - то, что вернул get() до запроса в базу
+        """
+        generation, redis_version = version
+        packed = (next_cursor or '').encode() + b'\n' + body
+        if redis_version is not None:
+            try:
+                await redis_client.binary.set(
+                    f'{MARKET_ADS_PREFIX}{redis_version}:{key}', packed, ex=cfg.market_cache_ttl
+                )
+            except Exception as e:
+                log.error(f'Market cache write error: {e}')
+        if generation == cls._generation:
+            cls._l1.set(key, packed)
+
+    @classmethod
+    async def bump(cls) -> None:
+        """
+        Сбрасывает кэш маркета. Вызывать после коммита изменений объявлений или цен
+        """
+        cls._generation += 1
+        cls._l1.clear()
+        try:
+            await redis_client.redis.incr(MARKET_VERSION_KEY)
+        except Exception as e:
+            log.error(f'Market cache bump error: {e}')
+
+    @staticmethod
+    def _unpack(packed: bytes) -> Tuple[Optional[str], bytes]:
+        cursor, _, body = packed.partition(b'\n')
+        return cursor.decode() or None, body
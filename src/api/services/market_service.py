@@ -0,0 +1,266 @@
+from typing import Any, List, Optional, Tuple
+
+from fastapi import HTTPException, status
+from sqlalchemy import select, insert, update, delete, literal, func, tuple_, asc, desc
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import selectinload
+
+from src.core.models import UserModel, UserEnterpriseModel, MarketModel, UserMarketPriceModel, \
+    UserMarketHistoryModel
+from src.core.extra_models import MarketSearchModel
+from src.api.dao import MarketSearchDAO
+from src.core.database import db_helper as db
+from src.api.services.catalog_service import CatalogService
+from src.api.services.leaderboard_service import LeaderboardService
+from src.api.services.tap_service import TapService
+from src.api.services.market_cache_service import MarketCacheService
+from src.core.enums import RatingType, SortType
+from src.core.schemas import Pagination
+
+from src.api.logging import log
+from src.settings import get_settings
+
+cfg = get_settings()
+
+
+class MarketService:
+
+    @classmethod
+    async def index_price(
+            cls,
+            ses,
+            market_id: int,
+            enterprise_id: int,
+            tg_id: int,
+            currency_id: int,
+            price: int,
+    ) -> None:
+        """
+        Добавляет (или обновляет) цену объявления в поисковой проекции market_search.
+        Вызывать в той же транзакции, что и запись цены; коммит остается за вызывающим кодом
+        """
+        enterprise = (await CatalogService.with_enterprises([enterprise_id])).enterprises.get(enterprise_id)
+        stmt = pg_insert(MarketSearchModel).values(
+            market_id=market_id,
+            currency_id=currency_id,
+            price=price,
+            enterprise_id=enterprise_id,
+            capacity=enterprise.capacity if enterprise else None,
+            type_id=enterprise.type_id if enterprise else None,
+            tg_id=tg_id,
+        )
+        await ses.execute(stmt.on_conflict_do_update(
+            index_elements=[MarketSearchModel.market_id, MarketSearchModel.currency_id],
+            set_=dict(price=stmt.excluded.price),
+        ))
+
+    @classmethod
+    async def search(
+            cls,
+            pag: Pagination,
+            capacity: Optional[int] = None,
+            currency_id: Optional[int] = None,
+            type_id: Optional[int] = None,
+            price_down: Optional[int] = None,
+            price_up: Optional[int] = None,
+            sort_type: SortType = SortType.ASC,
+    ) -> Tuple[List[Any], Optional[str]]:
+        """
+        Поиск объявлений по проекции market_search с сортировкой по цене и keyset пагинацией.
+        Запрос целиком идет по индексам (..., currency_id, price, market_id).
+        Цены в разных валютах несравнимы, поэтому без currency_id поиск идет по цене в GDP.
+        Возвращает (объявления с предприятием и ценами, курсор следующей страницы)
+        """
+        if not currency_id:
+            currency = (await CatalogService.get()).currencies.find('GDP')
+            if currency is None:
+                return [], None
+            currency_id = currency.id
+
+        filters = [MarketSearchModel.currency_id == currency_id]
+        if capacity:
+            filters.append(MarketSearchModel.capacity == capacity)
+        if type_id:
+            filters.append(MarketSearchModel.type_id == type_id)
+        if price_down:
+            filters.append(MarketSearchModel.price >= price_down)
+        if price_up:
+            filters.append(MarketSearchModel.price <= price_up)
+
+        stmt = select(MarketSearchModel.market_id, MarketSearchModel.price).where(*filters)
+        price_col, id_col = MarketSearchModel.price, MarketSearchModel.market_id
+
+        direction = asc if sort_type == SortType.ASC else desc
+        stmt = stmt.order_by(direction(price_col), direction(id_col))
+        if pag.cursor:
+            cursor = MarketSearchDAO.decode_cursor(pag.cursor, order_by='price')
+            if sort_type == SortType.ASC:
+                stmt = stmt.where(tuple_(price_col, id_col) > tuple_(*cursor))
+            else:
+                stmt = stmt.where(tuple_(price_col, id_col) < tuple_(*cursor))
+        else:
+            stmt = stmt.offset(pag.offset)
+        stmt = stmt.limit(pag.limit)
+
+        async with db.session_factory() as ses:
+            rows = (await ses.execute(stmt)).all()
+            if not rows:
+                return [], None
+
+            ads = (await ses.execute(
+                select(MarketModel)
+                .options(selectinload(MarketModel.prices))
+                .where(MarketModel.id.in_([row.market_id for row in rows]))
+            )).scalars().all()
+
+        by_id = {ad.id: ad for ad in ads}
+        ordered = [by_id[row.market_id] for row in rows if row.market_id in by_id]
+        return ordered, MarketSearchDAO.next_cursor(rows, pag.limit, order_by='price')
+
+    @classmethod
+    async def buy(cls, buyer_tg_id: int, market_id: int, currency_id: int) -> Tuple[Any, Any]:
+        """
+        Покупка объявления одной транзакцией.
+        Объявление блокируется через FOR UPDATE SKIP LOCKED, поэтому из параллельных покупателей
+        его получает только один, остальные сразу получают 409.
+        Балансы меняются условными UPDATE: списание не пройдет, если денег не хватает.
+        Возвращает (купленное предприятие юзера, предприятие из справочника)
+        """
+        catalog = await CatalogService.get()
+        currency = catalog.currencies.get(currency_id)
+        if not currency:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Currency not found"
+            )
+        if currency.code != 'GDP':
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Other currencies are currently not supported."
+            )
+
+        async with db.session_factory() as ses:
+            # Объявление и цена в нужной валюте одним запросом, с блокировкой строки объявления
+            stmt = (
+                select(MarketModel.id, MarketModel.tg_id, MarketModel.enterprise_id, UserMarketPriceModel.price)
+                .join(
+                    UserMarketPriceModel,
+                    (UserMarketPriceModel.market_id == MarketModel.id)
+                    & (UserMarketPriceModel.currency_id == currency_id)
+                )
+                .where(MarketModel.id == market_id)
+                .limit(1)
+                .with_for_update(of=MarketModel, skip_locked=True)
+            )
+            ad = (await ses.execute(stmt)).first()
+            if ad is None:
+                await cls._raise_ad_unavailable(ses, market_id, currency_id)
+
+            users = await cls._transfer(ses, buyer_tg_id, ad.tg_id, ad.price)
+
+            # Удаление объявления (цены удалятся каскадом), запись в историю продаж
+            # и выдача предприятия покупателю - одним запросом
+            deleted_ad = (
+                delete(MarketModel)
+                .where(MarketModel.id == market_id)
+                .returning(MarketModel.tg_id, MarketModel.enterprise_id)
+                .cte('deleted_ad')
+            )
+            history = (
+                insert(UserMarketHistoryModel)
+                .from_select(
+                    ['tg_id', 'enterprise_id', 'buyer_id', 'sold_currency_id', 'sold_price'],
+                    select(
+                        deleted_ad.c.tg_id,
+                        deleted_ad.c.enterprise_id,
+                        literal(users[buyer_tg_id].id, UserModel.id.type),
+                        literal(currency.id),
+                        literal(ad.price),
+                    )
+                )
+                .cte('sold_history')
+            )
+            stmt = (
+                insert(UserEnterpriseModel)
+                .from_select(
+                    ['tg_id', 'enterprise_id'],
+                    select(literal(buyer_tg_id, UserModel.tg_id.type), deleted_ad.c.enterprise_id)
+                )
+                .returning(UserEnterpriseModel)
+                .add_cte(history)
+            )
+            buyed_ad = (await ses.execute(stmt)).scalar_one()
+            await ses.commit()
+
+        await MarketCacheService.bump()
+        balances = list(users.values())
+        await TapService.sync_balances(balances)
+        await LeaderboardService.sync_users(balances, rating_types=(RatingType.gdp,))
+        cfg.debug and log.info(f'Market ad {market_id} bought by {buyer_tg_id} for {ad.price} {currency.code}')
+
+        return buyed_ad, catalog.enterprises.get(buyed_ad.enterprise_id)
+
+    @classmethod
+    async def _transfer(cls, ses, buyer_tg_id: int, seller_tg_id: int, price: int) -> dict:
+        """
+        Списывает price у покупателя и зачисляет продавцу.
+        Строки юзеров блокируются в порядке tg_id, чтобы встречные покупки не взаимоблокировались
+        """
+        changes = {buyer_tg_id: -price}
+        changes[seller_tg_id] = changes.get(seller_tg_id, 0) + price
+
+        users = {}
+        for tg_id in sorted(changes):
+            delta = changes[tg_id]
+            stmt = (
+                update(UserModel)
+                .where(UserModel.tg_id == tg_id)
+                .values(game_balance=func.coalesce(UserModel.game_balance, 0) + delta)
+                .returning(
+                    UserModel.id, UserModel.tg_id, UserModel.country_id,
+                    UserModel.region_id, UserModel.game_balance
+                )
+            )
+            if delta < 0:
+                stmt = stmt.where(func.coalesce(UserModel.game_balance, 0) >= -delta)
+
+            row = (await ses.execute(stmt)).first()
+            if row is None:
+                await ses.rollback()
+                exists = await ses.scalar(select(UserModel.id).where(UserModel.tg_id == tg_id).limit(1))
+                if exists is None:
+                    raise HTTPException(
+                        status_code=status.HTTP_404_NOT_FOUND,
+                        detail="Buyer user or Seller user not found"
+                    )
+                raise HTTPException(
+                    status_code=status.HTTP_403_FORBIDDEN,
+                    detail="Not enough gdp"
+                )
+            users[tg_id] = row
+        return users
+
+    @classmethod
+    async def _raise_ad_unavailable(cls, ses, market_id: int, currency_id: int) -> None:
+        # Объявление не заблокировалось: выясняем причину уже без блокировок
+        ad_exists = await ses.scalar(select(MarketModel.id).where(MarketModel.id == market_id))
+        if ad_exists is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="The ad does not exist"
+            )
+
+        price_exists = await ses.scalar(
+            select(UserMarketPriceModel.id)
+            .where(UserMarketPriceModel.market_id == market_id, UserMarketPriceModel.currency_id == currency_id)
+            .limit(1)
+        )
+        if price_exists is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Price for this currency not found"
+            )
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="The ad is being purchased by another user"
+        )
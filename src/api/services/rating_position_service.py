@@ -0,0 +1,216 @@
+import asyncio
+import time
+from typing import Any, Dict, Optional, Sequence
+
+from sqlalchemy import select, delete, func, case, literal, null, or_, and_, tuple_
+from sqlalchemy.dialects.postgresql import insert
+
+from src.core.models import UserModel
+from src.core.extra_models import RatingPositionModel
+from src.core.database import db_helper as db
+from src.others.redis_client import redis_client
+from src.api.services.leaderboard_service import RATING_FIELDS
+from src.core.enums import RatingType
+
+from src.api.logging import log
+from src.settings import get_settings
+
+cfg = get_settings()
+
+
+RATING_POSITIONS_LOCK_KEY = 'rating_positions:lock'  # пересчет ведет только один воркер
+
+
+class RatingPositionService:
+    """
+    Пересчет позиций юзеров в рейтингах (таблица rating_positions) оконными функциями в postgres.
+    Пересчет инкрементальный: сначала ищутся юзеры, у которых очки, страна или регион
+    изменились с прошлого пересчета. Если таких нет, ничего не считается.
+    Иначе записываются только строки, позиции которых могли сдвинуться: юзеры с очками между
+    старыми и новыми очками изменившихся, а также все юзеры затронутых стран и регионов.
+    Удаление юзера изменением не считается, поэтому раз в rating_positions_full_interval
+    выполняется полный пересчет
+    """
+    _task: Optional[asyncio.Task] = None
+    _full_at: float = 0.0
+
+    @classmethod
+    async def recompute(cls, rating_type: RatingType, full: bool = False) -> Dict[str, Any]:
+        """
+        Пересчет одного рейтинга одной транзакцией. full=True - записать все позиции без учета изменений.
+        Возвращает статистику: changed - изменившиеся юзеры, written - записанные строки
+        """
+        started = time.perf_counter()
+        score = getattr(UserModel, RATING_FIELDS[rating_type])
+        rp = RatingPositionModel
+
+        async with db.session_factory() as ses:
+            changes = None
+            if not full:
+                changes = await cls._find_changes(ses, rating_type, score)
+                if changes['changed'] == 0:
+                    return dict(rating_type=rating_type.value, changed=0, written=0, elapsed=0.0)
+
+            ranked = (
+                select(
+                    UserModel.id.label('user_id'),
+                    score.label('score'),
+                    UserModel.country_id,
+                    UserModel.region_id,
+                    func.rank().over(order_by=score.desc()).label('position'),
+                    func.rank().over(partition_by=UserModel.country_id, order_by=score.desc())
+                    .label('country_position'),
+                    func.rank().over(partition_by=UserModel.region_id, order_by=score.desc())
+                    .label('region_position'),
+                )
+                .where(score.isnot(None))
+                .cte('ranked')
+            )
+            source = select(
+                literal(rating_type.value),
+                ranked.c.user_id,
+                ranked.c.score,
+                ranked.c.country_id,
+                ranked.c.region_id,
+                ranked.c.position,
+                case((ranked.c.country_id.isnot(None), ranked.c.country_position), else_=null()),
+                case((ranked.c.region_id.isnot(None), ranked.c.region_position), else_=null()),
+            )
+            if changes is not None:
+                # Окна считаются по всем юзерам, фильтр применяется уже к посчитанным позициям
+                source = source.where(cls._affected(ranked, changes))
+
+            stmt = insert(rp).from_select(
+                ['rating_type', 'user_id', 'score', 'country_id', 'region_id',
+                 'position', 'country_position', 'region_position'],
+                source,
+            )
+            snapshot = (rp.score, rp.country_id, rp.region_id, rp.position, rp.country_position, rp.region_position)
+            excluded = tuple(stmt.excluded[column.key] for column in snapshot)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[rp.rating_type, rp.user_id],
+                set_=dict(zip([column.key for column in snapshot], excluded), updated_at=func.now()),
+                # Строки, в которых ничего не поменялось, не переписываются
+                where=tuple_(*snapshot).is_distinct_from(tuple_(*excluded)),
+            )
+            written = (await ses.execute(stmt)).rowcount
+
+            if full:
+                # Юзеры, у которых очки стали NULL, выпадают из рейтинга
+                await ses.execute(
+                    delete(rp)
+                    .where(rp.rating_type == rating_type.value)
+                    .where(rp.user_id.in_(select(UserModel.id).where(score.is_(None))))
+                )
+            await ses.commit()
+
+        stats = dict(
+            rating_type=rating_type.value,
+            changed=changes['changed'] if changes else None,
+            written=written,
+            elapsed=round(time.perf_counter() - started, 3),
+        )
+        cfg.debug and log.info(f'Rating positions recomputed: {stats}')
+        return stats
+
+    @classmethod
+    async def _find_changes(cls, ses, rating_type: RatingType, score) -> Dict[str, Any]:
+        """
+        Сравнивает users со снимком rating_positions. Возвращает количество изменившихся юзеров,
+        диапазон очков, в котором могли сдвинуться позиции, и затронутые страны и регионы.
+        Новый юзер (еще без строки в снимке) сдвигает вниз всех с меньшими очками,
+        поэтому с ним у диапазона нет нижней границы (min_score=None)
+        """
+        rp = RatingPositionModel
+        stmt = (
+            select(
+                func.count().label('changed'),
+                func.min(func.least(score, rp.score)).label('min_score'),
+                func.max(func.greatest(score, rp.score)).label('max_score'),
+                func.bool_or(rp.user_id.is_(None)).label('has_new'),
+                func.array_agg(UserModel.country_id.distinct()).label('countries'),
+                func.array_agg(rp.country_id.distinct()).label('old_countries'),
+                func.array_agg(UserModel.region_id.distinct()).label('regions'),
+                func.array_agg(rp.region_id.distinct()).label('old_regions'),
+            )
+            .select_from(UserModel)
+            .outerjoin(rp, and_(rp.user_id == UserModel.id, rp.rating_type == rating_type.value))
+            .where(score.isnot(None))
+            .where(or_(
+                rp.user_id.is_(None),
+                rp.score.is_distinct_from(score),
+                rp.country_id.is_distinct_from(UserModel.country_id),
+                rp.region_id.is_distinct_from(UserModel.region_id),
+            ))
+        )
+        row = (await ses.execute(stmt)).one()
+        return dict(
+            changed=row.changed,
+            min_score=None if row.has_new else row.min_score,
+            max_score=row.max_score,
+            countries=cls._ids(row.countries, row.old_countries),
+            regions=cls._ids(row.regions, row.old_regions),
+        )
+
+    @staticmethod
+    def _ids(*arrays: Optional[Sequence[Optional[int]]]) -> list[int]:
+        return sorted({item for array in arrays if array for item in array if item is not None})
+
+    @staticmethod
+    def _affected(ranked, changes: Dict[str, Any]):
+        if changes['min_score'] is None:
+            conditions = [ranked.c.score <= changes['max_score']]
+        else:
+            conditions = [ranked.c.score.between(changes['min_score'], changes['max_score'])]
+        if changes['countries']:
+            conditions.append(ranked.c.country_id.in_(changes['countries']))
+        if changes['regions']:
+            conditions.append(ranked.c.region_id.in_(changes['regions']))
+        return or_(*conditions)
+
+    @classmethod
+    async def recompute_all(cls, full: bool = False) -> list[Dict[str, Any]]:
+        # Пересчет долгий, поэтому лок живет дольше интервала и снимается сразу по окончании.
+        # Снимается только своим владельцем: если пересчет шел дольше ttl, лок мог уже взять другой воркер
+        lock_ttl = max(cfg.rating_positions_interval * 2, 600)
+        lock_token = await redis_client.acquire_lock(RATING_POSITIONS_LOCK_KEY, lock_ttl)
+        if lock_token is None:
+            return []
+        try:
+            stats = []
+            for rating_type in RATING_FIELDS:
+                stats.append(await cls.recompute(rating_type, full=full))
+                if not await redis_client.extend_lock(RATING_POSITIONS_LOCK_KEY, lock_token, lock_ttl):
+                    log.error('Rating positions recompute lost its lock, stopping')
+                    break
+            return stats
+        finally:
+            await redis_client.release_lock(RATING_POSITIONS_LOCK_KEY, lock_token)
+
+    @classmethod
+    async def _loop(cls) -> None:
+        while True:
+            try:
+                full = time.monotonic() - cls._full_at >= cfg.rating_positions_full_interval
+                if await cls.recompute_all(full=full) and full:
+                    cls._full_at = time.monotonic()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.error(f'Rating positions recompute error: {e}')
+            await asyncio.sleep(cfg.rating_positions_interval)
+
+    @classmethod
+    def start(cls) -> None:
+        if cls._task is None:
+            cls._task = asyncio.create_task(cls._loop())
+
+    @classmethod
+    async def stop(cls) -> None:
+        if cls._task is not None:
+            cls._task.cancel()
+            try:
+                await cls._task
+            except asyncio.CancelledError:
+                pass
+            cls._task = None
@@ -0,0 +1,388 @@
+import asyncio
+import time
+import uuid
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+import orjson
+from sqlalchemy import select, insert, update, delete, func, values, column
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from src.core.models import RefreshSessionModel, UserModel
+from src.core.database import db_helper as db
+from src.api.schemas.auth_schemas import RefreshSession
+from src.others.redis_client import redis_client
+
+from src.api.logging import log
+from src.settings import get_settings
+
+cfg = get_settings()
+
+
+SESSION_PREFIX = 'refresh:session:'  # hash с данными сессии, живет expires_in секунд
+USER_SESSIONS_PREFIX = 'refresh:user:'  # zset токенов юзера, score - время истечения
+AUDIT_KEY = 'refresh:audit'  # журнал изменений сессий для записи в postgres
+AUDIT_LOCK_KEY = 'refresh:audit:lock'
+
+
+# Одноразовая замена refresh токена: старый удаляется, новый создается атомарно,
+# поэтому два параллельных /refresh с одним токеном не получат две сессии
+# KEYS[1] - старая сессия, KEYS[2] - новая сессия, KEYS[3] - сессии юзера
+# ARGV[1] - старый токен, ARGV[2] - новый токен, ARGV[3] - created_at, ARGV[4] - expires_in, ARGV[5] - user_id
+ROTATE_SESSION_LUA = """
+if redis.call('HGET', KEYS[1], 'user_id') ~= ARGV[5] then
+    return 0
+end
+local tg_id = redis.call('HGET', KEYS[1], 'tg_id')
+redis.call('DEL', KEYS[1])
+redis.call('ZREM', KEYS[3], ARGV[1])
+redis.call('HSET', KEYS[2], 'user_id', ARGV[5], 'tg_id', tg_id, 'created_at', ARGV[3], 'expires_in', ARGV[4])
+redis.call('EXPIRE', KEYS[2], ARGV[4])
+redis.call('ZADD', KEYS[3], tonumber(ARGV[3]) + tonumber(ARGV[4]), ARGV[2])
+redis.call('EXPIRE', KEYS[3], ARGV[4])
+return 1
+"""
+
+
+class RefreshSessionStore(ABC):
+    """
+    Хранилище refresh сессий
+    """
+
+    @abstractmethod
+    async def add(self, user_id: uuid.UUID, tg_id: int, refresh_token: uuid.UUID, expires_in: int) -> None:
+        ...
+
+    @abstractmethod
+    async def get(self, refresh_token: uuid.UUID) -> Optional[RefreshSession]:
+        ...
+
+    @abstractmethod
+    async def rotate(self, session: RefreshSession, new_token: uuid.UUID, expires_in: int) -> bool:
+        """
+        Заменяет токен сессии на новый. Возвращает False, если сессию уже использовали или удалили
+        """
+
+    @abstractmethod
+    async def delete(self, refresh_token: uuid.UUID) -> None:
+        ...
+
+    @abstractmethod
+    async def delete_user(self, user_id: uuid.UUID) -> None:
+        ...
+
+
+class PostgresSessionStore(RefreshSessionStore):
+
+    async def add(self, user_id: uuid.UUID, tg_id: int, refresh_token: uuid.UUID, expires_in: int) -> None:
+        async with db.session_factory() as ses:
+            await ses.execute(
+                insert(RefreshSessionModel).values(
+                    user_id=user_id,
+                    refresh_token=refresh_token,
+                    expires_in=expires_in,
+                    created_at=datetime.now(timezone.utc),
+                )
+            )
+            await ses.commit()
+
+    async def get(self, refresh_token: uuid.UUID) -> Optional[RefreshSession]:
+        async with db.session_factory() as ses:
+            stmt = (
+                select(
+                    RefreshSessionModel.refresh_token, RefreshSessionModel.user_id, UserModel.tg_id,
+                    RefreshSessionModel.created_at, RefreshSessionModel.expires_in
+                )
+                .join(UserModel, UserModel.id == RefreshSessionModel.user_id)
+                .where(RefreshSessionModel.refresh_token == refresh_token)
+                .limit(1)
+            )
+            row = (await ses.execute(stmt)).first()
+        return RefreshSession.model_validate(row._asdict()) if row else None
+
+    async def rotate(self, session: RefreshSession, new_token: uuid.UUID, expires_in: int) -> bool:
+        async with db.session_factory() as ses:
+            result = await ses.execute(
+                update(RefreshSessionModel)
+                .where(
+                    RefreshSessionModel.refresh_token == session.refresh_token,
+                    RefreshSessionModel.user_id == session.user_id,
+                )
+                .values(refresh_token=new_token, expires_in=expires_in, created_at=datetime.now(timezone.utc))
+                .returning(RefreshSessionModel.id)
+            )
+            rotated = result.scalar() is not None
+            await ses.commit()
+        return rotated
+
+    async def delete(self, refresh_token: uuid.UUID) -> None:
+        async with db.session_factory() as ses:
+            await ses.execute(delete(RefreshSessionModel).where(RefreshSessionModel.refresh_token == refresh_token))
+            await ses.commit()
+
+    async def delete_user(self, user_id: uuid.UUID) -> None:
+        async with db.session_factory() as ses:
+            await ses.execute(delete(RefreshSessionModel).where(RefreshSessionModel.user_id == user_id))
+            await ses.commit()
+
+
+class RedisSessionStore(RefreshSessionStore):
+    """
+    Сессии живут в redis и протухают по ttl ключа.
+    Токены юзера лежат в zset (score - время истечения), поэтому выход со всех устройств - O(кол-во сессий).
+    При refresh_session_audit изменения пишутся в журнал и пачками переносятся в postgres
+    """
+
+    def __init__(self):
+        self._rotate_script = None
+
+    async def add(self, user_id: uuid.UUID, tg_id: int, refresh_token: uuid.UUID, expires_in: int) -> None:
+        now = time.time()
+        user_key = f'{USER_SESSIONS_PREFIX}{user_id}'
+        async with redis_client.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(f'{SESSION_PREFIX}{refresh_token}', mapping={
+                'user_id': str(user_id),
+                'tg_id': tg_id,
+                'created_at': now,
+                'expires_in': expires_in,
+            })
+            pipe.expire(f'{SESSION_PREFIX}{refresh_token}', expires_in)
+            # заодно выкидываем из множества токены уже протухших сессий
+            pipe.zremrangebyscore(user_key, '-inf', now)
+            pipe.zadd(user_key, {str(refresh_token): now + expires_in})
+            pipe.expire(user_key, expires_in)
+            await pipe.execute()
+
+        await self._audit([
+            dict(op='add', refresh_token=str(refresh_token), user_id=str(user_id), created_at=now, expires_in=expires_in)
+        ])
+
+    async def get(self, refresh_token: uuid.UUID) -> Optional[RefreshSession]:
+        state = await redis_client.redis.hgetall(f'{SESSION_PREFIX}{refresh_token}')
+        if not state:
+            return None
+        return RefreshSession(
+            refresh_token=refresh_token,
+            user_id=uuid.UUID(state['user_id']),
+            tg_id=int(state['tg_id']),
+            created_at=datetime.fromtimestamp(float(state['created_at']), tz=timezone.utc),
+            expires_in=int(state['expires_in']),
+        )
+
+    async def rotate(self, session: RefreshSession, new_token: uuid.UUID, expires_in: int) -> bool:
+        if self._rotate_script is None:
+            self._rotate_script = redis_client.redis.register_script(ROTATE_SESSION_LUA)
+
+        now = time.time()
+        rotated = await self._rotate_script(
+            keys=[
+                f'{SESSION_PREFIX}{session.refresh_token}',
+                f'{SESSION_PREFIX}{new_token}',
+                f'{USER_SESSIONS_PREFIX}{session.user_id}',
+            ],
+            args=[str(session.refresh_token), str(new_token), now, expires_in, str(session.user_id)],
+        )
+        if rotated:
+            await self._audit([
+                dict(op='delete', refresh_token=str(session.refresh_token)),
+                dict(op='add', refresh_token=str(new_token), user_id=str(session.user_id),
+                     created_at=now, expires_in=expires_in),
+            ])
+        return bool(rotated)
+
+    async def delete(self, refresh_token: uuid.UUID) -> None:
+        key = f'{SESSION_PREFIX}{refresh_token}'
+        user_id = await redis_client.redis.hget(key, 'user_id')
+        if user_id is None:
+            return
+        async with redis_client.redis.pipeline(transaction=True) as pipe:
+            pipe.delete(key)
+            pipe.zrem(f'{USER_SESSIONS_PREFIX}{user_id}', str(refresh_token))
+            await pipe.execute()
+        await self._audit([dict(op='delete', refresh_token=str(refresh_token))])
+
+    async def delete_user(self, user_id: uuid.UUID) -> None:
+        user_key = f'{USER_SESSIONS_PREFIX}{user_id}'
+        tokens = await redis_client.redis.zrange(user_key, 0, -1)
+        await redis_client.redis.delete(user_key, *[f'{SESSION_PREFIX}{token}' for token in tokens])
+        await self._audit([dict(op='delete_user', user_id=str(user_id))])
+
+    @staticmethod
+    async def _audit(events: List[Dict[str, Any]]) -> None:
+        if not cfg.refresh_session_audit:
+            return
+        try:
+            await redis_client.redis.rpush(AUDIT_KEY, *[orjson.dumps(event) for event in events])
+        except Exception as e:
+            # журнал вторичен, сессия уже сохранена в redis
+            log.error(f'Refresh session audit error: {e}')
+
+
+@lru_cache
+def get_session_store() -> RefreshSessionStore:
+    if cfg.refresh_session_backend == 'redis':
+        return RedisSessionStore()
+    return PostgresSessionStore()
+
+
+class RefreshSessionMaintenance:
+    """
+    Фоновые задачи хранилища сессий:
+    перенос журнала из redis в postgres и чистка протухших сессий в postgres
+    """
+    _tasks: List[asyncio.Task] = []
+
+    @classmethod
+    async def flush_audit(cls, batch_size: int = 1000) -> int:
+        """
+        Переносит пачку событий журнала в postgres. Пачка удаляется из журнала только после коммита,
+        поэтому после падения между коммитом и LTRIM она запишется повторно:
+        вставка идемпотентна (ON CONFLICT по уникальному refresh_token), удаления - тем более
+        """
+        # Журнал пишет один воркер за раз, иначе одни и те же события попадут в базу дважды
+        lock_token = await redis_client.acquire_lock(AUDIT_LOCK_KEY, 60)
+        if lock_token is None:
+            return 0
+        try:
+            raw = await redis_client.redis.lrange(AUDIT_KEY, 0, batch_size - 1)
+            if not raw:
+                return 0
+
+            # Сворачиваем события пачки: сессия, созданная и удаленная в одной пачке, в базу не попадет
+            added: Dict[str, Dict[str, Any]] = {}
+            deleted_tokens = set()
+            deleted_users = set()
+            for item in raw:
+                try:
+                    event = orjson.loads(item)
+                except orjson.JSONDecodeError:
+                    # битое событие не должно навсегда блокировать журнал
+                    log.error(f'Invalid refresh session audit event skipped: {item!r}')
+                    continue
+                if event['op'] == 'add':
+                    added[event['refresh_token']] = dict(
+                        refresh_token=uuid.UUID(event['refresh_token']),
+                        user_id=uuid.UUID(event['user_id']),
+                        created_at=datetime.fromtimestamp(event['created_at'], tz=timezone.utc),
+                        expires_in=event['expires_in'],
+                    )
+                elif event['op'] == 'delete':
+                    if added.pop(event['refresh_token'], None) is None:
+                        deleted_tokens.add(uuid.UUID(event['refresh_token']))
+                elif event['op'] == 'delete_user':
+                    added = {token: row for token, row in added.items() if str(row['user_id']) != event['user_id']}
+                    deleted_users.add(uuid.UUID(event['user_id']))
+
+            async with db.session_factory() as ses:
+                if deleted_users:
+                    await ses.execute(delete(RefreshSessionModel).where(RefreshSessionModel.user_id.in_(deleted_users)))
+                if deleted_tokens:
+                    await ses.execute(
+                        delete(RefreshSessionModel).where(RefreshSessionModel.refresh_token.in_(deleted_tokens))
+                    )
+                if added:
+                    await ses.execute(cls._insert_sessions(list(added.values())))
+                await ses.commit()
+
+            await redis_client.redis.ltrim(AUDIT_KEY, len(raw), -1)
+            return len(raw)
+        finally:
+            await redis_client.release_lock(AUDIT_LOCK_KEY, lock_token)
+
+    @staticmethod
+    def _insert_sessions(rows: List[Dict[str, Any]]):
+        """
+        Вставка сессий из журнала. Сессии юзеров, которых уже нет в базе, отбрасываются join'ом с users,
+        иначе нарушение внешнего ключа повторялось бы на каждой попытке и журнал встал бы навсегда
+        """
+        fields = ('refresh_token', 'user_id', 'created_at', 'expires_in')
+        sessions = values(
+            *[column(name, getattr(RefreshSessionModel, name).type) for name in fields],
+            name='audit_sessions',
+        ).data([tuple(row[name] for name in fields) for row in rows])
+        return (
+            pg_insert(RefreshSessionModel)
+            .from_select(
+                list(fields),
+                select(*[sessions.c[name] for name in fields])
+                .join(UserModel, UserModel.id == sessions.c.user_id),
+            )
+            .on_conflict_do_nothing(index_elements=[RefreshSessionModel.refresh_token])
+        )
+
+    @classmethod
+    async def sweep_expired(cls, batch_size: Optional[int] = None) -> int:
+        """
+        Удаляет протухшие сессии из postgres пачками, чтобы не держать долгих блокировок
+        """
+        batch_size = batch_size or cfg.refresh_session_sweep_batch
+        total = 0
+        while True:
+            async with db.session_factory() as ses:
+                expired = (
+                    select(RefreshSessionModel.id)
+                    .where(
+                        RefreshSessionModel.created_at
+                        + func.make_interval(0, 0, 0, 0, 0, 0, RefreshSessionModel.expires_in) < func.now()
+                    )
+                    .limit(batch_size)
+                    .scalar_subquery()
+                )
+                result = await ses.execute(delete(RefreshSessionModel).where(RefreshSessionModel.id.in_(expired)))
+                await ses.commit()
+
+            total += result.rowcount
+            if result.rowcount < batch_size:
+                break
+            await asyncio.sleep(0.1)
+
+        cfg.debug and total and log.info(f'Expired refresh sessions removed: {total}')
+        return total
+
+    @classmethod
+    async def _audit_loop(cls) -> None:
+        while True:
+            try:
+                while await cls.flush_audit() > 0:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.error(f'Refresh session audit flush error: {e}')
+            await asyncio.sleep(cfg.refresh_session_audit_interval)
+
+    @classmethod
+    async def _sweep_loop(cls) -> None:
+        while True:
+            try:
+                await cls.sweep_expired()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.error(f'Refresh session sweep error: {e}')
+            await asyncio.sleep(cfg.refresh_session_sweep_interval)
+
+    @classmethod
+    def start(cls) -> None:
+        if cls._tasks:
+            return
+        uses_postgres = cfg.refresh_session_backend == 'postgres' or cfg.refresh_session_audit
+        if cfg.refresh_session_backend == 'redis' and cfg.refresh_session_audit:
+            cls._tasks.append(asyncio.create_task(cls._audit_loop()))
+        if uses_postgres:
+            cls._tasks.append(asyncio.create_task(cls._sweep_loop()))
+
+    @classmethod
+    async def stop(cls) -> None:
+        for task in cls._tasks:
+            task.cancel()
+        for task in cls._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        cls._tasks = []
+        if cfg.refresh_session_backend == 'redis' and cfg.refresh_session_audit:
+            await cls.flush_audit()
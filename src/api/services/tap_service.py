@@ -0,0 +1,392 @@
+import asyncio
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, status
+from sqlalchemy import select, update, values, column, func, BigInteger, Integer
+from sqlalchemy.dialects.postgresql import insert
+
+from src.core.models import UserModel
+from src.core.extra_models import TapFlushBatchModel
+from src.core.database import db_helper as db
+from src.others.redis_client import redis_client
+from src.api.services.catalog_service import CatalogService
+from src.api.services.leaderboard_service import LeaderboardService
+from src.core.enums import RatingType
+
+from src.api.logging import log
+from src.settings import get_settings
+
+cfg = get_settings()
+
+
+TAPS_STATE_PREFIX = 'taps:state:'  # hash с состоянием юзера: energy, balance, pending, tap_price
+TAPS_DIRTY_KEY = 'taps:dirty'  # множество tg_id, у которых есть несброшенные тапы
+TAPS_JOURNAL_KEY = 'taps:journal'  # пачка, которая сейчас пишется в базу
+
+# Коды ответа lua-скрипта
+TAPS_NOT_CACHED = -1
+TAPS_OK = 0
+TAPS_NO_ENERGY = 1
+TAPS_INVALID_COUNT = 2
+TAPS_ZERO_COUNT = 3
+
+
+# Те же правила, что и в UserService.update_game_balance, но атомарно внутри redis
+# KEYS[1] - состояние юзера, KEYS[2] - множество "грязных" юзеров
+# ARGV[1] - new_tap_count, ARGV[2] - energy_limit, ARGV[3] - tg_id
+APPLY_TAPS_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return {-1, 0}
+end
+local state = redis.call('HMGET', KEYS[1], 'energy', 'balance', 'tap_price')
+local energy = tonumber(state[1])
+local balance = tonumber(state[2])
+local tap_price = tonumber(state[3])
+local new_tap_count = tonumber(ARGV[1])
+
+if energy == 0 then
+    return {1, balance}
+end
+
+local current_tap_count = tonumber(ARGV[2]) - energy
+if new_tap_count < current_tap_count or new_tap_count < 0 then
+    return {2, balance}
+end
+if new_tap_count == 0 then
+    return {3, balance}
+end
+
+local taps = new_tap_count - current_tap_count
+if taps > energy then
+    taps = energy
+end
+local earned = taps * tap_price
+
+redis.call('HSET', KEYS[1], 'energy', energy - taps)
+redis.call('HINCRBY', KEYS[1], 'balance', earned)
+redis.call('HINCRBY', KEYS[1], 'pending', earned)
+-- пока есть несброшенные тапы, ключ не должен протухнуть
+redis.call('PERSIST', KEYS[1])
+redis.call('SADD', KEYS[2], ARGV[3])
+return {0, balance + earned}
+"""
+
+# KEYS[1] - состояние юзера
+# ARGV[1] - energy, ARGV[2] - game_balance, ARGV[3] - tap_price, ARGV[4] - ttl
+SEED_STATE_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'energy', ARGV[1], 'balance', ARGV[2], 'tap_price', ARGV[3], 'pending', 0)
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return 1
+"""
+
+# Переносит накопленные тапы из состояний юзеров в журнал.
+# Если журнал уже есть (прошлый сброс не завершился), возвращает его для повторной записи
+# KEYS[1] - множество "грязных" юзеров, KEYS[2] - журнал
+# ARGV[1] - префикс ключей состояния, ARGV[2] - размер пачки, ARGV[3] - id новой пачки, ARGV[4] - ttl
+DRAIN_TO_JOURNAL_LUA = """
+if redis.call('EXISTS', KEYS[2]) == 1 then
+    return redis.call('HGETALL', KEYS[2])
+end
+local ids = redis.call('SPOP', KEYS[1], tonumber(ARGV[2]))
+if #ids == 0 then
+    return {}
+end
+for _, tg_id in ipairs(ids) do
+    local key = ARGV[1] .. tg_id
+    local state = redis.call('HMGET', key, 'pending', 'energy')
+    if state[2] then
+        redis.call('HSET', KEYS[2], tg_id, (state[1] or '0') .. ':' .. state[2])
+        redis.call('HSET', key, 'pending', 0)
+        redis.call('EXPIRE', key, ARGV[4])
+    end
+end
+redis.call('HSET', KEYS[2], '__batch_id', ARGV[3])
+return redis.call('HGETALL', KEYS[2])
+"""
+
+# Удаляет журнал, только если в нем лежит та же пачка (другой воркер мог уже создать новую)
+# KEYS[1] - журнал, ARGV[1] - id пачки
+DELETE_JOURNAL_LUA = """
+if redis.call('HGET', KEYS[1], '__batch_id') == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# Выставляет в кэше актуальный баланс из базы с учетом тапов, накопленных во время сброса
+# KEYS[1] - состояние юзера, ARGV[1] - game_balance из базы
+SYNC_BALANCE_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+local pending = tonumber(redis.call('HGET', KEYS[1], 'pending') or '0')
+redis.call('HSET', KEYS[1], 'balance', tonumber(ARGV[1]) + pending)
+return 1
+"""
+
+# Восстанавливает энергию в кэше юзеров, у которых есть состояние.
+# Юзер помечается "грязным", чтобы ближайший сброс записал энергию в базу
+# поверх пачки, которая могла писаться в базу одновременно с восстановлением
+# KEYS[1] - множество "грязных" юзеров, KEYS[2..] - состояния юзеров
+# ARGV[1] - energy_limit, ARGV[2..] - tg_id в том же порядке, что и ключи состояний
+REFILL_ENERGY_LUA = """
+local refilled = 0
+for i = 2, #KEYS do
+    if redis.call('EXISTS', KEYS[i]) == 1 then
+        redis.call('HSET', KEYS[i], 'energy', ARGV[1])
+        redis.call('SADD', KEYS[1], ARGV[i])
+        refilled = refilled + 1
+    end
+end
+return refilled
+"""
+
+
+def _state_key(tg_id: int) -> str:
+    return f'{TAPS_STATE_PREFIX}{tg_id}'
+
+
+class TapService:
+    """
+    Буфер тапов в redis.
+    Энергия и накопленный баланс юзера живут в redis и периодически пачками сбрасываются в postgres
+    """
+    _scripts: Dict[str, Any] = {}
+    _flush_task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def _script(cls, name: str, lua: str):
+        script = cls._scripts.get(name)
+        if script is None:
+            script = redis_client.redis.register_script(lua)
+            cls._scripts[name] = script
+        return script
+
+    @classmethod
+    async def update_game_balance(
+            cls,
+            tg_id: int,
+            new_tap_count: int,
+    ) -> dict:
+        if new_tap_count is None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"current_tap_count is required"
+            )
+
+        code, balance = await cls._apply_taps(tg_id, new_tap_count)
+        if code == TAPS_NOT_CACHED:
+            await cls._seed_state(tg_id)
+            code, balance = await cls._apply_taps(tg_id, new_tap_count)
+
+        if code == TAPS_NO_ENERGY:
+            return dict(
+                message="The energy is gone",
+                balance=balance
+            )
+        if code == TAPS_INVALID_COUNT:
+            return dict(
+                message="""Вы не можете передать кол-во кликов меньше 0 или меньше,
+                     чем уже сделали за сегодня""",
+                balance=balance
+            )
+        if code == TAPS_ZERO_COUNT:
+            return dict(
+                message="Make taps before update your balance",
+                balance=balance
+            )
+        return dict(
+            message="Balance successfully updated",
+            balance=balance
+        )
+
+    @classmethod
+    async def _apply_taps(cls, tg_id: int, new_tap_count: int) -> Tuple[int, int]:
+        res = await cls._script('apply', APPLY_TAPS_LUA)(
+            keys=[_state_key(tg_id), TAPS_DIRTY_KEY],
+            args=[new_tap_count, cfg.energy_limit, tg_id],
+        )
+        return int(res[0]), int(res[1])
+
+    @classmethod
+    async def _seed_state(cls, tg_id: int) -> None:
+        async with db.session_factory() as ses:
+            stmt = (
+                select(UserModel.energy, UserModel.game_balance, UserModel.level)
+                .where(UserModel.tg_id == tg_id)
+                .limit(1)
+            )
+            row = (await ses.execute(stmt)).first()
+
+        if row is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"User not found"
+            )
+        level = (await CatalogService.get()).levels.find(row.level)
+        if level is None or level.tap_price is None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Level not found or tap_price is empty"
+            )
+
+        await cls._script('seed', SEED_STATE_LUA)(
+            keys=[_state_key(tg_id)],
+            args=[row.energy or 0, row.game_balance or 0, level.tap_price, cfg.taps_state_ttl],
+        )
+
+    @classmethod
+    async def invalidate(cls, tg_id: int) -> None:
+        """
+        Сбрасывает кэш юзера, если в нем нет несброшенных тапов.
+        Вызывать после изменения energy/level в базе в обход буфера
+        """
+        key = _state_key(tg_id)
+        pending = await redis_client.redis.hget(key, 'pending')
+        if pending is None or int(pending) == 0:
+            await redis_client.redis.delete(key)
+
+    @classmethod
+    async def refill_energy(cls, tg_ids: List[int]) -> int:
+        """
+        Выставляет energy_limit в кэше юзеров, энергия которых восстановлена в базе в обход буфера.
+        Возвращает количество обновленных состояний
+        """
+        if not cfg.taps_buffer_enabled or not tg_ids:
+            return 0
+        return int(await cls._script('refill_energy', REFILL_ENERGY_LUA)(
+            keys=[TAPS_DIRTY_KEY, *[_state_key(tg_id) for tg_id in tg_ids]],
+            args=[cfg.energy_limit, *tg_ids],
+        ))
+
+    @classmethod
+    async def sync_balances(cls, users: List[Any]) -> None:
+        """
+        Выставляет в кэше баланс из базы (с учетом несброшенных тапов).
+        Вызывать после изменения game_balance в базе в обход буфера.
+        users - объекты с полями tg_id и game_balance
+        """
+        if not cfg.taps_buffer_enabled:
+            return
+        sync_balance = cls._script('sync_balance', SYNC_BALANCE_LUA)
+        for user in users:
+            await sync_balance(keys=[_state_key(user.tg_id)], args=[user.game_balance])
+
+    @classmethod
+    async def flush(cls) -> int:
+        """
+        Сбрасывает одну пачку накопленных тапов в базу.
+        Возвращает количество обработанных юзеров
+        """
+        raw = await cls._script('drain', DRAIN_TO_JOURNAL_LUA)(
+            keys=[TAPS_DIRTY_KEY, TAPS_JOURNAL_KEY],
+            args=[TAPS_STATE_PREFIX, cfg.taps_flush_batch_size, uuid.uuid4().hex, cfg.taps_state_ttl],
+        )
+        if not raw:
+            return 0
+
+        journal = dict(zip(raw[::2], raw[1::2]))
+        batch_id = journal.pop('__batch_id')
+        rows: List[Dict[str, int]] = []
+        for tg_id, item in journal.items():
+            delta, energy = item.split(':')
+            rows.append(dict(tg_id=int(tg_id), delta=int(delta), energy=int(energy)))
+
+        balances = await cls._write_batch(batch_id, rows)
+
+        await cls._script('delete_journal', DELETE_JOURNAL_LUA)(
+            keys=[TAPS_JOURNAL_KEY], args=[batch_id]
+        )
+        await cls.sync_balances(balances)
+        await LeaderboardService.sync_users(balances, rating_types=(RatingType.gdp,))
+
+        return len(rows)
+
+    @classmethod
+    async def _write_batch(cls, batch_id: str, rows: List[Dict[str, int]]) -> List[Any]:
+        async with db.session_factory() as ses:
+            # Отметка о пачке пишется в той же транзакции, что и балансы.
+            # Если пачка уже была записана до падения, просто чистим журнал
+            applied = await ses.execute(
+                insert(TapFlushBatchModel)
+                .values(id=batch_id, users_count=len(rows))
+                .on_conflict_do_nothing(index_elements=[TapFlushBatchModel.id])
+                .returning(TapFlushBatchModel.id)
+            )
+            if applied.scalar() is None:
+                cfg.debug and log.warning(f'Taps batch {batch_id} already applied')
+                await ses.rollback()
+                return []
+
+            # Строки юзеров блокируются в порядке tg_id, как и в MarketService._transfer,
+            # иначе сброс и покупка на маркете могут взаимоблокироваться.
+            # UPDATE ... FROM VALUES блокирует строки в порядке плана, поэтому сначала явный SELECT FOR UPDATE
+            rows = sorted(rows, key=lambda row: row['tg_id'])
+            balances = []
+            for start in range(0, len(rows), cfg.taps_flush_batch_size):
+                chunk = rows[start:start + cfg.taps_flush_batch_size]
+                await ses.execute(
+                    select(UserModel.id)
+                    .where(UserModel.tg_id.in_([row['tg_id'] for row in chunk]))
+                    .order_by(UserModel.tg_id)
+                    .with_for_update()
+                )
+                taps = values(
+                    column('tg_id', BigInteger),
+                    column('delta', BigInteger),
+                    column('energy', Integer),
+                    name='taps',
+                ).data([(row['tg_id'], row['delta'], row['energy']) for row in chunk])
+
+                stmt = (
+                    update(UserModel)
+                    .where(UserModel.tg_id == taps.c.tg_id)
+                    .values(
+                        game_balance=func.coalesce(UserModel.game_balance, 0) + taps.c.delta,
+                        energy=taps.c.energy,
+                    )
+                    .returning(
+                        UserModel.id, UserModel.tg_id, UserModel.country_id,
+                        UserModel.region_id, UserModel.game_balance
+                    )
+                )
+                result = await ses.execute(stmt)
+                balances.extend(result.all())
+
+            await ses.commit()
+        return balances
+
+    @classmethod
+    async def _flush_loop(cls) -> None:
+        while True:
+            try:
+                # Пока пачки полные, сбрасываем без паузы
+                while await cls.flush() >= cfg.taps_flush_batch_size:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.error(f'Taps flush error: {e}')
+            await asyncio.sleep(cfg.taps_flush_interval)
+
+    @classmethod
+    def start(cls) -> None:
+        if cls._flush_task is None:
+            cls._flush_task = asyncio.create_task(cls._flush_loop())
+
+    @classmethod
+    async def stop(cls) -> None:
+        if cls._flush_task is not None:
+            cls._flush_task.cancel()
+            try:
+                await cls._flush_task
+            except asyncio.CancelledError:
+                pass
+            cls._flush_task = None
+        # Дописываем все, что успели натапать до остановки
+        while await cls.flush():
+            pass
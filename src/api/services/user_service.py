@@ -9,21 +9,29 @@ from typing import Optional, Any, Dict
 from aiogram.enums import ChatMemberStatus
 from aiogram.utils.web_app import WebAppUser
 from fastapi import HTTPException, status
-from sqlalchemy import select, func, text, desc, and_, cast, Date
+from sqlalchemy import select, insert, update, func, text, desc, and_, cast, Date, case, null, type_coerce, literal, JSON
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.orm import joinedload
 
-from src.core.enums import SortType
+from src.core.enums import SortType, RatingType, RatingScope
+from src.core.constants import REFERRAL_MAX_LEVEL
 from src.api.schemas.country_schemas import CountryBase
 from src.api.schemas.enterprise_schemas import UserEnterpriseCreate
 from src.api.schemas.user_schemas import User, UserCreate, UserUpdate, UserRating, \
     UserDailyRewardedTaskCreate, UserReferralRewardsCreate, Level, LevelBase, UserRewardedTaskCreate
-from src.api.schemas.user_referral_schemas import UserReferralCreate
 from src.core.models import UserModel, ReferralModel, UserEnterpriseModel, \
-    GdpUserRatingModel, CapacityUserRatingModel, UserBoostModel
-from src.api.dao import UserDAO, UserReferralDAO, UserEnterpriseDAO, EnterpriseDAO, CountryDAO, RegionDAO, \
-    GdpUserRatingDAO, CapacityUserRatingDAO, RewardedTaskDAO, UserRewardedTaskDAO, LevelDAO, \
-    DailyRewardsDAO, UserDailyRewardedTaskDAO, UserReferralRewardsDAO, ReferralRewardsDAO, UserLevelRewardsDAO
+    GdpUserRatingModel, CapacityUserRatingModel, UserBoostModel, BoostModel, CountryModel, RegionModel
+from src.core.extra_models import ReferralLevelStatModel, RatingPositionModel
+from src.api.dao import UserDAO, UserEnterpriseDAO, CountryDAO, RegionDAO, \
+    GdpUserRatingDAO, CapacityUserRatingDAO, RewardedTaskDAO, UserRewardedTaskDAO, \
+    UserDailyRewardedTaskDAO, UserReferralRewardsDAO, UserLevelRewardsDAO
 from src.core.database import db_helper as db
+from src.api.services.catalog_service import CatalogService
+from src.api.services.leaderboard_service import LeaderboardService
+from src.api.services.tap_service import TapService
+from src.api.services.auth_sync_service import AuthSyncService
+from src.api.services.session_store import get_session_store
+from src.others.redis_client import redis_client
 
 from src.api.logging import log
 from src.settings import get_settings
@@ -34,6 +42,9 @@ if cfg.run_type != 'local':
     from telegram.bot import get_bot
 
 
+USER_FLAGS_PREFIX = 'user:flags:'  # hash с флагами is_superuser, is_active
+
+
 def generate_unique_id() -> str:
     epoch_ms = int(time.time())
     random_int = random.randint(1000, 9999)
@@ -58,6 +69,44 @@ class UserService:
                     status_code=status.HTTP_404_NOT_FOUND, detail='User not found')
 
 
+    @classmethod
+    async def get_user_flags(cls, user_id: str) -> Dict[str, bool]:
+        """
+        Флаги is_superuser/is_active для проверки прав.
+        Кэшируются в redis, чтобы кэш был общим для всех воркеров и сбрасывался одним удалением ключа
+        """
+        key = f'{USER_FLAGS_PREFIX}{user_id}'
+        cached = await redis_client.redis.hgetall(key)
+        if cached:
+            return dict(
+                is_superuser=cached['is_superuser'] == '1',
+                is_active=cached['is_active'] == '1',
+            )
+
+        async with db.session_factory() as session:
+            stmt = (
+                select(UserModel.is_superuser, UserModel.is_active)
+                .where(UserModel.id == user_id)
+                .limit(1)
+            )
+            row = (await session.execute(stmt)).first()
+        if row is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail='User not found')
+
+        flags = dict(is_superuser=bool(row.is_superuser), is_active=bool(row.is_active))
+        async with redis_client.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(key, mapping={name: int(value) for name, value in flags.items()})
+            pipe.expire(key, cfg.user_flags_ttl)
+            await pipe.execute()
+        return flags
+
+
+    @classmethod
+    async def invalidate_user_flags(cls, user_id: Any) -> None:
+        await redis_client.redis.delete(f'{USER_FLAGS_PREFIX}{user_id}')
+
+
     @classmethod
     async def check_user_by_telegram_id(cls, tg_id: int) -> User | None:
         async with db.session_factory() as session:
@@ -81,6 +130,7 @@ class UserService:
                     user.referrer_id = owner.id
 
                 db_user = await UserDAO.add(ses, user)
+                catalog = await CatalogService.get()
                 total_capacity = 0
 
                 for i in range(1, 4):  # Добавляем 3 начальных предприятия юзеру
@@ -91,53 +141,17 @@ class UserService:
                             enterprise_id=i,
                         )
                     )
-                    current_ent = await EnterpriseDAO.find_one_or_none(ses, id=i)
+                    current_ent = catalog.enterprises.get(i)
                     total_capacity += current_ent.capacity
-                    await ses.commit()
 
                 db_user.total_capacity = total_capacity
-                await ses.commit()
 
                 if owner:
                     log.info(f'Owner:{owner}')
-                    level = 1
-                    current_referrer_id = owner.referrer_id
-
-                    # Реализация многоуровневой реферальной системы
-                    # Идем вверх по цепочке, пока не достигнем 10 уровня или юзера, которого никто не приглашал
-                    while level <= 10:
-
-                        # если такой юзер найден, добавляем одну запись и выходим из цикла
-                        if current_referrer_id is None:
-                            ref_obj = UserReferralCreate(
-                                owner_id=owner.id,
-                                referral_id=db_user.id,
-                                level_id=1
-                            )
-                            log.success(f'Юзер найден. Добавляем одну запись:{ref_obj}')
-                            await UserReferralDAO.add(ses, obj_in=ref_obj)
-                            await ses.commit()
-                            break
-                        else:   # если нет, добавляем записи (рефералов) для каждого юзера вверх по цепочке
-                            log.warning(f'Юзер не найден. Идем вверх по цепочке')
-                            next_owner = await UserDAO.find_one_or_none(ses, id=current_referrer_id)
-                            if next_owner is None:
-                                log.warning(f'Next owner не найден')
-                                break
-
-                            level += 1
-                            ref_for_next_owner = UserReferralCreate(
-                                owner_id=next_owner.id,
-                                referral_id=db_user.id,
-                                level_id=level
-                            )
-                            await UserReferralDAO.add(ses, obj_in=ref_for_next_owner)
-                            await ses.commit()
-                            current_referrer_id = next_owner.referrer_id
-                    else:
-                        log.warning(f"Owner by uuid: {user.referrer_id} not found")
-
+                    await cls._add_referral_chain(ses, owner_id=owner.id, referral_id=db_user.id)
 
+                await ses.commit()
+                await LeaderboardService.sync_users([db_user])
                 return db_user
             else:
                 raise HTTPException(
@@ -193,6 +207,84 @@ class UserService:
     async def get_user_by_telegram_id(
             cls,
             tg_id: int,
+    ) -> dict[str, Any]:
+        if cfg.profile_single_query:
+            return await cls._get_profile_single_query(tg_id)
+        return await cls._get_profile_sequential(tg_id)
+
+
+    @classmethod
+    async def _get_profile_single_query(
+            cls,
+            tg_id: int,
+    ) -> dict[str, Any]:
+        """
+        Профиль юзера одним запросом: страна, регион и позиции в рейтингах через outer join'ы,
+        бусты - через json_agg подзапрос. Уровень берется из справочника в памяти
+        """
+        countries = CountryModel.__table__
+        regions = RegionModel.__table__
+        boosts = BoostModel.__table__
+
+        boosts_subq = (
+            select(
+                func.json_agg(
+                    func.json_build_object(
+                        'created_at', UserBoostModel.created_at,
+                        'boost_info', func.row_to_json(boosts.table_valued(), type_=JSON),
+                    )
+                )
+            )
+            .select_from(UserBoostModel)
+            .join(boosts, boosts.c.id == UserBoostModel.boost_id)
+            .where(UserBoostModel.tg_id == UserModel.tg_id)
+            .scalar_subquery()
+        )
+        gdp_position_subq = cls._rating_position_subq(RatingType.gdp, GdpUserRatingModel)
+        capacity_position_subq = cls._rating_position_subq(RatingType.capacity, CapacityUserRatingModel)
+
+        stmt = (
+            select(
+                UserModel,
+                case((countries.c.id.isnot(None), func.row_to_json(countries.table_valued(), type_=JSON)), else_=null())
+                .label('country'),
+                case((regions.c.id.isnot(None), func.row_to_json(regions.table_valued(), type_=JSON)), else_=null())
+                .label('region'),
+                type_coerce(boosts_subq, JSON).label('boosts'),
+                gdp_position_subq.label('gdp_position'),
+                capacity_position_subq.label('capacity_position'),
+            )
+            .outerjoin(countries, countries.c.id == UserModel.country_id)
+            .outerjoin(regions, regions.c.id == UserModel.region_id)
+            .where(UserModel.tg_id == tg_id)
+            .limit(1)
+        )
+
+        async with db.session_factory() as ses:
+            row = (await ses.execute(stmt)).first()
+
+        if row is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"User not found"
+            )
+
+        level_data = (await CatalogService.get()).levels.get(row.UserModel.level)
+        return cls._build_profile(
+            db_user=row.UserModel,
+            country=CountryBase(**row.country) if row.country else None,
+            region=row.region,
+            level=LevelBase(**level_data.to_dict()) if level_data else None,
+            user_boosts=row.boosts,
+            gdp_rating_position=row.gdp_position,
+            capacity_rating_position=row.capacity_position,
+        )
+
+
+    @classmethod
+    async def _get_profile_sequential(
+            cls,
+            tg_id: int,
     ) -> dict[str, Any]:
         async with (db.session_factory() as ses):
             db_user = await UserDAO.find_first(ses, tg_id=tg_id)
@@ -205,7 +297,7 @@ class UserService:
             country_data = await CountryDAO.find_first(ses, id=db_user.country_id)
             country = CountryBase(**country_data.to_dict()) if country_data else None
             region = await RegionDAO.find_first(ses, id=db_user.region_id)
-            level_data = await LevelDAO.find_first(ses, id=db_user.level)
+            level_data = (await CatalogService.get()).levels.get(db_user.level)
             level = LevelBase(**level_data.to_dict()) if level_data else None
             # user_boosts = await UserBoostDAO.find_all(ses, tg_id=tg_id)
 
@@ -218,37 +310,83 @@ class UserService:
             results = await ses.execute(boost_stmt)
             user_boosts = [{'created_at': boost.created_at, 'boost_info': boost.boost.to_dict()} for boost in results.scalars().all()]
 
-            user_rating_gdp = await GdpUserRatingDAO.find_first(ses, user_id=db_user.id)
-            user_rating_capacity = await CapacityUserRatingDAO.find_first(ses, user_id=db_user.id)
-
-            gdp_rating_position = user_rating_gdp.position if user_rating_gdp else None
-            capacity_rating_position = user_rating_capacity.position if user_rating_capacity else None
-
-            output_dict = {
-                'id': str(db_user.id),
-                'tg_id': db_user.tg_id,
-                'username': db_user.username,
-                'first_name': db_user.first_name,
-                'last_name': db_user.last_name,
-                'level': level.dict() if level else None,
-                'country': country.dict() if country else None,
-                'region': region.to_dict() if region else None,
-                'total_capacity': db_user.total_capacity,
-                'boosts': user_boosts if user_boosts else None,
-                'total_boost_value': db_user.total_boost_value,
-                'user_rating_position': gdp_rating_position,
-                'capacity_rating_position': capacity_rating_position,
-                'energy': db_user.energy,
-                'game_balance': db_user.game_balance,
-                'enterprises_slots': db_user.enterprises_slots,
-                'can_open_case': db_user.can_open_case,
-                'referrer_id': str(db_user.referrer_id),
-                'auth_date': db_user.auth_date,
-                'daily_reward_counter': db_user.daily_reward_counter,
-                'referrals_counter': db_user.referrals_counter
-            }
+            if cfg.rating_positions_enabled:
+                positions = dict((await ses.execute(
+                    select(RatingPositionModel.rating_type, RatingPositionModel.position)
+                    .where(RatingPositionModel.user_id == db_user.id)
+                )).all())
+                gdp_rating_position = positions.get(RatingType.gdp.value)
+                capacity_rating_position = positions.get(RatingType.capacity.value)
+            else:
+                user_rating_gdp = await GdpUserRatingDAO.find_first(ses, user_id=db_user.id)
+                user_rating_capacity = await CapacityUserRatingDAO.find_first(ses, user_id=db_user.id)
+
+                gdp_rating_position = user_rating_gdp.position if user_rating_gdp else None
+                capacity_rating_position = user_rating_capacity.position if user_rating_capacity else None
+
+            return cls._build_profile(
+                db_user=db_user,
+                country=country,
+                region=region.to_dict() if region else None,
+                level=level,
+                user_boosts=user_boosts,
+                gdp_rating_position=gdp_rating_position,
+                capacity_rating_position=capacity_rating_position,
+            )
 
-            return output_dict
+
+    @staticmethod
+    def _rating_position_subq(rating_type: RatingType, legacy_model):
+        # Позиции берутся из rating_positions, если их пересчитывает RatingPositionService
+        if cfg.rating_positions_enabled:
+            return (
+                select(RatingPositionModel.position)
+                .where(
+                    RatingPositionModel.rating_type == rating_type.value,
+                    RatingPositionModel.user_id == UserModel.id,
+                )
+                .scalar_subquery()
+            )
+        return (
+            select(legacy_model.position)
+            .where(legacy_model.user_id == UserModel.id)
+            .limit(1)
+            .scalar_subquery()
+        )
+
+    @staticmethod
+    def _build_profile(
+            db_user: UserModel,
+            country: Optional[CountryBase],
+            region: Optional[dict[str, Any]],
+            level: Optional[LevelBase],
+            user_boosts: Optional[list[dict[str, Any]]],
+            gdp_rating_position: Optional[int],
+            capacity_rating_position: Optional[int],
+    ) -> dict[str, Any]:
+        return {
+            'id': str(db_user.id),
+            'tg_id': db_user.tg_id,
+            'username': db_user.username,
+            'first_name': db_user.first_name,
+            'last_name': db_user.last_name,
+            'level': level.dict() if level else None,
+            'country': country.dict() if country else None,
+            'region': region if region else None,
+            'total_capacity': db_user.total_capacity,
+            'boosts': user_boosts if user_boosts else None,
+            'total_boost_value': db_user.total_boost_value,
+            'user_rating_position': gdp_rating_position,
+            'capacity_rating_position': capacity_rating_position,
+            'energy': db_user.energy,
+            'game_balance': db_user.game_balance,
+            'enterprises_slots': db_user.enterprises_slots,
+            'can_open_case': db_user.can_open_case,
+            'referrer_id': str(db_user.referrer_id),
+            'auth_date': db_user.auth_date,
+            'daily_reward_counter': db_user.daily_reward_counter,
+            'referrals_counter': db_user.referrals_counter
+        }
 
 
 
@@ -286,7 +424,10 @@ class UserService:
             user_update: UserUpdate,
     ) -> Any:
         async with db.session_factory() as ses:
-            db_user = await UserDAO.find_first(ses, tg_id=tg_id)
+            # Строка блокируется до коммита: сброс тапов не перезапишет ополовиненный баланс и наоборот
+            db_user = await ses.scalar(
+                select(UserModel).where(UserModel.tg_id == tg_id).with_for_update()
+            )
             if db_user is None:
                 raise HTTPException(
                     status_code=status.HTTP_404_NOT_FOUND,
@@ -294,6 +435,8 @@ class UserService:
                 )
 
             output_dict = {}
+            old_country_id, old_region_id = db_user.country_id, db_user.region_id
+            balance_changed = False
 
             # if user_update.username is not None:
             #     db_user.username = user_update.username
@@ -323,6 +466,7 @@ class UserService:
 
                 if user_update.country_id != db_user.country_id:
                     db_user.game_balance = int(db_user.game_balance / 2)
+                    balance_changed = True
 
                 db_user.country_id = user_update.country_id
                 db_user.region_id = None
@@ -355,6 +499,7 @@ class UserService:
 
                 if user_update.country_id is None and db_user.country_id == 1 and user_update.region_id != db_user.region_id:
                     db_user.game_balance = int(db_user.game_balance / 2)
+                    balance_changed = True
 
                 db_user.region_id = user_update.region_id
 
@@ -365,6 +510,10 @@ class UserService:
                 )
 
             await ses.commit()
+            if balance_changed:
+                await TapService.sync_balances([db_user])
+            if user_update.country_id is not None or user_update.region_id is not None:
+                await LeaderboardService.move_user(db_user, old_country_id, old_region_id)
             return output_dict
 
 
@@ -415,8 +564,7 @@ class UserService:
             # total_boost = db_user.total_boost_value if db_user.total_boost_value != 0 else 1
             # composition = total_boost * db_user.total_capacity
             # additional_value = composition / 100 if composition != 0 else 0
-            level = await LevelDAO.find_first(ses, level=db_user.level)
-            tap_price = level.tap_price
+            level = (await CatalogService.get()).levels.find(db_user.level)
 
             if level is None or level.tap_price is None:
                 raise HTTPException(
@@ -425,17 +573,19 @@ class UserService:
                 )
 
             if db_user.energy >= new_tap_count:
-                db_user.game_balance += tap_price * new_tap_count
+                db_user.game_balance += level.tap_price * new_tap_count
                 db_user.energy -= new_tap_count
                 await ses.commit()
+                await LeaderboardService.sync_users([db_user], rating_types=(RatingType.gdp,))
                 return dict(
                     message="Balance successfully updated",
                     balance=db_user.game_balance
                 )
             else:
-                db_user.game_balance += tap_price * db_user.energy
+                db_user.game_balance += level.tap_price * db_user.energy
                 db_user.energy = 0
                 await ses.commit()
+                await LeaderboardService.sync_users([db_user], rating_types=(RatingType.gdp,))
                 return dict(
                     message="Balance successfully updated",
                     balance=db_user.game_balance
@@ -482,10 +632,11 @@ class UserService:
                     detail=f"User not found"
                 )
 
+            # Счетчики поддерживаются при вставке рефералов, поэтому не зависят от их количества
             stmt = (
-                select(ReferralModel.level_id, func.count(ReferralModel.id))
-                .filter(ReferralModel.owner_id == db_user.id)
-                .group_by(ReferralModel.level_id)
+                select(ReferralLevelStatModel.level_id, ReferralLevelStatModel.referrals_count)
+                .filter(ReferralLevelStatModel.owner_id == db_user.id)
+                .filter(ReferralLevelStatModel.referrals_count > 0)
             )
             res = await ses.execute(stmt)
             refferal_counts = res.all()
@@ -511,6 +662,10 @@ class UserService:
         if user is None:
             return
 
+        # Юзер уже есть в базе: неизменившийся профиль не пишем, изменения пишутся отложенно
+        if cfg.auth_write_behind_enabled and await AuthSyncService.touch_profile(user):
+            return
+
         async with db.session_factory() as ses:
             try:
                 tg_user_id = user.id
@@ -565,23 +720,17 @@ class UserService:
                             enterprise_id=1,
                         )
                     )
-                    current_ent = await EnterpriseDAO.find_one_or_none(ses, id=1)
+                    catalog = await CatalogService.get()
+                    current_ent = catalog.enterprises.get(1)
                     total_capacity += current_ent.capacity
                     new_user.total_capacity = total_capacity
-                    await ses.commit()
 
                     if owner_user:
-                        level = 1
-                        current_referrer_id = owner_user.referrer_id
-
                         owner_user.referrals_counter += 1
 
                         # Добавялем запись овнеру о выполненном задании на кол-во рефералов
                         if owner_user.referrals_counter:
-                            reward = await ReferralRewardsDAO.find_first(
-                                ses,
-                                ref_count=owner_user.referrals_counter
-                            )
+                            reward = catalog.referral_rewards.find(owner_user.referrals_counter)
                             if reward and reward.amount and reward.ref_count == owner_user.referrals_counter:
                                 exist_task = await UserReferralRewardsDAO.find_first(
                                     ses, tg_id=owner_user.tg_id, reward_id=reward.id)
@@ -595,38 +744,12 @@ class UserService:
                                         )
                                     )
 
-                        # Реализация многоуровневой реферальной системы
-                        # Идем вверх по цепочке, пока не достигнем 10 уровня или юзера, которого никто не приглашал
-                        while level <= 10:
-
-                            # если такой юзер найден, добавляем одну запись и выходим из цикла
-                            if current_referrer_id is None:
-                                ref_obj = UserReferralCreate(
-                                    owner_id=owner_user.id,
-                                    referral_id=new_user.id,
-                                    level_id=1
-                                )
-                                await UserReferralDAO.add(ses, obj_in=ref_obj)
-                                await ses.commit()
-                                break
-                            else:  # если нет, добавляем записи (рефералов) для каждого юзера вверх по цепочке
-                                next_owner = await UserDAO.find_one_or_none(ses, id=current_referrer_id)
-                                if next_owner is None:
-                                    break
-
-                                level += 1
-                                ref_for_next_owner = UserReferralCreate(
-                                    owner_id=next_owner.id,
-                                    referral_id=new_user.id,
-                                    level_id=level
-                                )
-                                await UserReferralDAO.add(ses, obj_in=ref_for_next_owner)
-                                await ses.commit()
-                                current_referrer_id = next_owner.referrer_id
- 
+                        # Многоуровневая реферальная система: вся цепочка вверх одним запросом
+                        await cls._add_referral_chain(ses, owner_id=owner_user.id, referral_id=new_user.id)
 
                     if new_user is not None:
                         await ses.commit()
+                        await LeaderboardService.sync_users([new_user])
                         cfg.debug and log.success(f'Новый пользователь успешно создан: {new_user}')
                     else:
                         cfg.debug and log.error(f'Ошибка создания пользователя:  {exist_user}')
@@ -646,6 +769,9 @@ class UserService:
                     )
                     cfg.debug and log.success(f'Пользователь успешно обновлен: {updated_user}')
 
+                if cfg.auth_write_behind_enabled:
+                    await AuthSyncService.remember_profile(user)
+
             except Exception as e:
                 cfg.debug and log.error(f'Ошибка при создании или обновлении пользователя: {e}')
 
@@ -709,23 +835,17 @@ class UserService:
                             enterprise_id=1,
                         )
                     )
-                    current_ent = await EnterpriseDAO.find_one_or_none(ses, id=1)
+                    catalog = await CatalogService.get()
+                    current_ent = catalog.enterprises.get(1)
                     total_capacity += current_ent.capacity
                     new_user.total_capacity = total_capacity
-                    await ses.commit()
 
                     if owner_user:
-                        level = 1
-                        current_referrer_id = owner_user.referrer_id
-
                         owner_user.referrals_counter += 1
 
                         # Добавялем запись овнеру о выполненном задании на кол-во рефералов
                         if owner_user.referrals_counter:
-                            reward = await ReferralRewardsDAO.find_first(
-                                ses,
-                                ref_count=owner_user.referrals_counter
-                            )
+                            reward = catalog.referral_rewards.find(owner_user.referrals_counter)
                             if reward and reward.amount:
                                 exist_task = await UserReferralRewardsDAO.find_first(
                                     ses, tg_id=owner_user.tg_id, reward_id=reward.id)
@@ -739,42 +859,12 @@ class UserService:
                                         )
                                     )
 
-                        # Реализация многоуровневой реферальной системы
-                        # Идем вверх по цепочке, пока не достигнем 10 уровня или юзера, которого никто не приглашал
-                        while level <= 10:
-
-                            # если такой юзер найден, добавляем одну запись и выходим из цикла
-                            if current_referrer_id is None:
-                                ref_obj = UserReferralCreate(
-                                    owner_id=owner_user.id,
-                                    referral_id=new_user.id,
-                                    level_id=1
-                                )
-                                cfg.debug and log.success(f'Юзер найден. Добавляем одну запись:{ref_obj}')
-                                await UserReferralDAO.add(ses, obj_in=ref_obj)
-                                await ses.commit()
-                                break
-                            else:  # если нет, добавляем записи (рефералов) для каждого юзера вверх по цепочке
-                                cfg.debug and log.warning(f'Юзер не найден. Идем вверх по цепочке')
-                                next_owner = await UserDAO.find_one_or_none(ses, id=current_referrer_id)
-                                if next_owner is None:
-                                    log.warning(f'Next owner не найден')
-                                    break
-
-                                level += 1
-                                ref_for_next_owner = UserReferralCreate(
-                                    owner_id=next_owner.id,
-                                    referral_id=new_user.id,
-                                    level_id=level
-                                )
-                                await UserReferralDAO.add(ses, obj_in=ref_for_next_owner)
-                                await ses.commit()
-                                current_referrer_id = next_owner.referrer_id
-                        else:
-                            cfg.debug and log.warning(f"Owner by uuid: {owner_user.referrer_id} not found")
+                        # Многоуровневая реферальная система: вся цепочка вверх одним запросом
+                        await cls._add_referral_chain(ses, owner_id=owner_user.id, referral_id=new_user.id)
 
                     if new_user is not None:
                         await ses.commit()
+                        await LeaderboardService.sync_users([new_user])
 
                         cfg.debug and log.success(f'Новый пользователь успешно создан: {new_user}')
                     else:
@@ -823,6 +913,57 @@ class UserService:
         return user_update
 
 
+    @classmethod
+    async def _add_referral_chain(
+            cls,
+            session,
+            owner_id: uuid.UUID,
+            referral_id: uuid.UUID,
+    ) -> int:
+        """
+        Добавляет записи о реферале для всей цепочки пригласивших:
+        owner - 1 уровень, его пригласивший - 2 и т.д. до REFERRAL_MAX_LEVEL.
+        Цепочка ищется рекурсивным CTE по users.referrer_id и вставляется одним запросом,
+        в нем же увеличиваются счетчики referral_level_stats.
+        Коммит остается за вызывающим кодом
+        """
+        chain = (
+            select(
+                UserModel.id.label('owner_id'),
+                UserModel.referrer_id.label('referrer_id'),
+                literal(1).label('level_id'),
+            )
+            .where(UserModel.id == owner_id)
+            .cte('referral_chain', recursive=True)
+        )
+        chain = chain.union_all(
+            select(UserModel.id, UserModel.referrer_id, chain.c.level_id + 1)
+            .join(chain, UserModel.id == chain.c.referrer_id)
+            .where(chain.c.level_id < REFERRAL_MAX_LEVEL)
+        )
+
+        inserted = (
+            insert(ReferralModel)
+            .from_select(
+                ['owner_id', 'referral_id', 'level_id'],
+                select(chain.c.owner_id, literal(referral_id, ReferralModel.referral_id.type), chain.c.level_id),
+            )
+            .returning(ReferralModel.owner_id, ReferralModel.level_id)
+            .cte('inserted_referrals')
+        )
+        stats = pg_insert(ReferralLevelStatModel).from_select(
+            ['owner_id', 'level_id', 'referrals_count'],
+            select(inserted.c.owner_id, inserted.c.level_id, literal(1)),
+        )
+        stmt = stats.on_conflict_do_update(
+            index_elements=[ReferralLevelStatModel.owner_id, ReferralLevelStatModel.level_id],
+            set_=dict(referrals_count=ReferralLevelStatModel.referrals_count + stats.excluded.referrals_count),
+        )
+        result = await session.execute(stmt)
+        cfg.debug and log.info(f'Добавлено {result.rowcount} записей о реферале {referral_id}')
+        return result.rowcount
+
+
     @classmethod
     async def get_users_rating_by_region(
             cls,
@@ -830,6 +971,12 @@ class UserService:
             offset: int = 0,
             limit: int = 100,
     ) -> list[Dict[str, Any]]:
+        # Пока рейтинги не собраны rebuild_leaderboards, отдаем рейтинг из базы
+        if cfg.leaderboard_enabled and await LeaderboardService.is_ready():
+            return await LeaderboardService.get_top(
+                RatingType.gdp, RatingScope.region, region_id, offset=offset, limit=limit
+            )
+
         async with db.session_factory() as ses:
             stmt = (
                 select(UserModel)
@@ -877,7 +1024,7 @@ class UserService:
                     detail=f"User not found"
                 )
 
-            referral_rewards = await ReferralRewardsDAO.find_all(ses, offset=offset, limit=limit)
+            referral_rewards = (await CatalogService.get()).referral_rewards.rows[offset:offset + limit]
             if not referral_rewards:
                 raise HTTPException(
                     status_code=status.HTTP_404_NOT_FOUND,
@@ -928,20 +1075,21 @@ class UserService:
                     detail=f"The user has no referrals"
                 )
 
-            reward = await ReferralRewardsDAO.find_one_or_none(
-                ses,
-                ref_count=ref_count
-            )
+            reward = (await CatalogService.get()).referral_rewards.find(ref_count)
             if reward is None:
                 raise HTTPException(
                     status_code=status.HTTP_404_NOT_FOUND,
                     detail=f"Referral reward not found"
                 )
 
-            exist_task = await UserReferralRewardsDAO.find_first(
-                ses,
-                tg_id=db_user.tg_id,
-                reward_id=reward.id
+            # Блокировка задания: параллельный запрос дождется коммита и увидит is_claimed
+            exist_task = await ses.scalar(
+                select(UserReferralRewardsDAO.model)
+                .where(
+                    UserReferralRewardsDAO.model.tg_id == db_user.tg_id,
+                    UserReferralRewardsDAO.model.reward_id == reward.id,
+                )
+                .with_for_update()
             )
 
             if exist_task is None:
@@ -962,9 +1110,21 @@ class UserService:
             #         detail=f"There are no rewards available"
             #     )
 
-            db_user.game_balance += reward.amount
+            # Начисление одним UPDATE: сброс тапов между чтением и коммитом не теряется
+            user = (await ses.execute(
+                update(UserModel)
+                .where(UserModel.tg_id == db_user.tg_id)
+                .values(game_balance=func.coalesce(UserModel.game_balance, 0) + reward.amount)
+                .returning(
+                    UserModel.id, UserModel.tg_id, UserModel.country_id,
+                    UserModel.region_id, UserModel.game_balance
+                )
+                .execution_options(synchronize_session=False)
+            )).one()
             exist_task.is_claimed = True
             await ses.commit()
+            await TapService.sync_balances([user])
+            await LeaderboardService.sync_users([user], rating_types=(RatingType.gdp,))
 
             return dict(
                 user_task=exist_task.to_dict(),
@@ -986,6 +1146,7 @@ class UserService:
                 obj_in=user_upd)
 
             await session.commit()
+            await cls.invalidate_user_flags(user.id)
             return user_update
 
     @classmethod
@@ -995,8 +1156,29 @@ class UserService:
     ):
         async with db.session_factory() as session:
             try:
+                # Записи о юзере как о реферале удалятся каскадом, поэтому уменьшаем счетчики его овнеров
+                referrals = (
+                    select(ReferralModel.owner_id, ReferralModel.level_id, func.count().label('cnt'))
+                    .where(ReferralModel.referral_id == user.id)
+                    .group_by(ReferralModel.owner_id, ReferralModel.level_id)
+                    .subquery()
+                )
+                await session.execute(
+                    update(ReferralLevelStatModel)
+                    .where(
+                        ReferralLevelStatModel.owner_id == referrals.c.owner_id,
+                        ReferralLevelStatModel.level_id == referrals.c.level_id,
+                    )
+                    .values(referrals_count=ReferralLevelStatModel.referrals_count - referrals.c.cnt)
+                )
                 await UserDAO.delete(session, UserModel.id == user.id)
                 await session.commit()
+                await LeaderboardService.remove_user(user.id, user.country_id, user.region_id)
+                await AuthSyncService.forget(user.tg_id)
+                await cls.invalidate_user_flags(user.id)
+                # В postgres сессии удалятся каскадом вместе с юзером
+                if cfg.refresh_session_backend == 'redis':
+                    await get_session_store().delete_user(user.id)
             except Exception as e:
                 log.error(f"Error deleting user: {e}")
 
@@ -1038,6 +1220,28 @@ class UserService:
             cls,
             tg_id: int,
             auth_timestamp: int
+    ):
+        if not cfg.auth_write_behind_enabled:
+            return await cls._telegram_check_in(tg_id, auth_timestamp)
+
+        if not await AuthSyncService.claim_check_in(tg_id):
+            # Юзер уже заходил сегодня: счетчик ежедневных наград не меняется, дату входа пишем отложенно.
+            # В базе к этому моменту уже лежит auth_date первого входа за сегодня,
+            # поэтому расчет пропущенных дней при следующем входе не пострадает
+            await AuthSyncService.enqueue_auth_date(tg_id, auth_timestamp)
+            return
+
+        try:
+            await cls._telegram_check_in(tg_id, auth_timestamp)
+        except Exception:
+            await AuthSyncService.release_check_in(tg_id)
+            raise
+
+    @classmethod
+    async def _telegram_check_in(
+            cls,
+            tg_id: int,
+            auth_timestamp: int
     ):
         async with db.session_factory() as ses:
             db_user = await UserDAO.find_first(ses, tg_id=tg_id)
@@ -1070,10 +1274,7 @@ class UserService:
                 pass
 
 
-            daily_reward = await DailyRewardsDAO.find_first(
-                ses,
-                day_number=db_user.daily_reward_counter
-            )
+            daily_reward = (await CatalogService.get()).daily_rewards.find(db_user.daily_reward_counter)
             if daily_reward and daily_reward.day_number == db_user.daily_reward_counter:
                 exist_task = await UserDailyRewardedTaskDAO.find_first(
                     ses,
@@ -1,7 +1,17 @@
+import base64
+import uuid
+from datetime import date, datetime
+from decimal import Decimal
+
+import asyncpg
+import orjson
 from src.core.enums import SortType
-from typing import Any, Dict, Generic, List, Optional, TypeVar, Union
+from src.core.exceptions import InvalidCursorException, BulkWriteException
+from typing import Any, AsyncGenerator, Dict, Generic, List, NoReturn, Optional, Sequence, Tuple, TypeVar, Union
 
-from sqlalchemy import select, insert, update, delete, text, desc, asc
+from sqlalchemy import select, insert, update, delete, text, desc, asc, tuple_, inspect, literal, values, column, \
+    Row, Select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.sql import func
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -15,6 +25,9 @@ ModelType = TypeVar("ModelType", bound=Base)
 CreateSchemaType = TypeVar("CreateSchemaType", bound=BaseModel)
 UpdateSchemaType = TypeVar("UpdateSchemaType", bound=BaseModel)
 
+# asyncpg не принимает больше 32767 параметров в одном запросе
+MAX_QUERY_PARAMS = 32767
+
 
 class BaseDAO(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
     model = None
@@ -40,28 +53,162 @@ class BaseDAO(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
         limit: int = 100,
         order_by: Optional[str] = None,
         sort_type: str = SortType.ASC,
+        cursor: Optional[str] = None,
         **filter_by
     ) -> List[ModelType]:
         stmt = (
             select(cls.model)
             .filter(*filter)
             .filter_by(**filter_by)
-            .offset(offset)
-            .limit(limit)
+        )
+        stmt = cls.paginate(
+            stmt,
+            offset=offset,
+            limit=limit,
+            order_by=order_by,
+            sort_type=sort_type,
+            cursor=cursor,
+        )
+        result = await session.execute(stmt)
+        return result.scalars().all()
+
+    @classmethod
+    async def stream(
+        cls,
+        session: AsyncSession,
+        *filter,
+        columns: Optional[Sequence[Any]] = None,
+        batch_size: int = 1000,
+        order_by: Optional[str] = None,
+        limit: Optional[int] = None,
+        **filter_by
+    ) -> AsyncGenerator[Row, None]:
+        """
+        Потоковое чтение выборки серверным курсором: в памяти одновременно не больше batch_size строк.
+        Отдаются Row с колонками columns (по умолчанию все колонки модели, ключи как у to_dict), а не ORM объекты.
+        Курсор держит транзакцию сессии открытой до конца обхода, поэтому долгую обработку
+        лучше вести сегментами с limit, продолжая со значения order_by последней строки
+        """
+        stmt = (
+            select(*(columns or cls.model.columns()))
+            .select_from(cls.model)
+            .filter(*filter)
+            .filter_by(**filter_by)
+            .execution_options(yield_per=batch_size)
         )
         if order_by:
-            # order_by_clause = ""
-            # if len(order_by) > 1:
-            #     for item in order_by[1:]:
-            #         order_by_clause += " AND ".join(item)
+            stmt = stmt.order_by(getattr(cls.model, order_by))
+        if limit:
+            stmt = stmt.limit(limit)
+
+        result = await session.stream(stmt)
+        try:
+            async for row in result:
+                yield row
+        finally:
+            # Если обход прервали, курсор закроется при aclose() генератора
+            # (contextlib.aclosing) или при его финализации
+            await result.close()
+
+    @classmethod
+    def paginate(
+        cls,
+        stmt: Select,
+        offset: int = 0,
+        limit: int = 100,
+        order_by: Optional[str] = None,
+        sort_type: str = SortType.ASC,
+        cursor: Optional[str] = None,
+    ) -> Select:
+        """
+        Добавляет в запрос сортировку и пагинацию.
+        Без курсора - обычный offset/limit, с курсором - keyset по (order_by, первичный ключ),
+        который работает одинаково быстро на любой странице
+        """
+        columns = cls._cursor_columns(order_by)
+        if columns is None:
+            # order_by - произвольное выражение, keyset для него не поддерживается
+            if cursor:
+                raise InvalidCursorException
+            order = asc(text(order_by)) if sort_type == SortType.ASC else desc(text(order_by))
+            return stmt.order_by(order).offset(offset).limit(limit)
 
+        direction = asc if sort_type == SortType.ASC else desc
+        stmt = stmt.order_by(*[direction(column) for column in columns])
+        if cursor:
+            values = cls._decode_cursor(cursor, columns)
             if sort_type == SortType.ASC:
-                stmt = stmt.order_by(asc(text(order_by)))
+                stmt = stmt.where(tuple_(*columns) > tuple_(*values))
             else:
-                stmt = stmt.order_by(desc(text(order_by)))
+                stmt = stmt.where(tuple_(*columns) < tuple_(*values))
+        else:
+            stmt = stmt.offset(offset)
+        return stmt.limit(limit)
 
-        result = await session.execute(stmt)
-        return result.scalars().all()
+    @classmethod
+    def encode_cursor(cls, row: ModelType, order_by: Optional[str] = None) -> str:
+        """
+        Курсор на следующую страницу после row (обычно последняя запись текущей страницы)
+        """
+        columns = cls._cursor_columns(order_by) or []
+        values = [getattr(row, column.key) for column in columns]
+        return base64.urlsafe_b64encode(orjson.dumps(values, default=str)).decode()
+
+    @classmethod
+    def next_cursor(cls, rows: List[ModelType], limit: int, order_by: Optional[str] = None) -> Optional[str]:
+        if not rows or len(rows) < limit:
+            return None
+        return cls.encode_cursor(rows[-1], order_by)
+
+    @classmethod
+    def decode_cursor(cls, cursor: str, order_by: Optional[str] = None) -> list:
+        """
+        Значения ключа (order_by, первичный ключ) из курсора - для запросов, собранных без paginate
+        """
+        columns = cls._cursor_columns(order_by)
+        if columns is None:
+            raise InvalidCursorException
+        return cls._decode_cursor(cursor, columns)
+
+    @classmethod
+    def _cursor_columns(cls, order_by: Optional[str]) -> Optional[list]:
+        mapper = inspect(cls.model)
+        pk = getattr(cls.model, mapper.get_property_by_column(mapper.primary_key[0]).key)
+        if not order_by:
+            return [pk]
+        # Только колонки модели: связи, свойства и методы в keyset не годятся
+        if order_by not in mapper.columns:
+            return None
+        column = getattr(cls.model, order_by)
+        return [column] if column.key == pk.key else [column, pk]
+
+    @classmethod
+    def _decode_cursor(cls, cursor: str, columns: list) -> list:
+        try:
+            values = orjson.loads(base64.urlsafe_b64decode(cursor.encode()))
+            if not isinstance(values, list) or len(values) != len(columns):
+                raise ValueError
+            return [cls._coerce_cursor_value(column, value) for column, value in zip(columns, values)]
+        except (ValueError, TypeError):
+            raise InvalidCursorException
+
+    @staticmethod
+    def _coerce_cursor_value(column, value: Any) -> Any:
+        if value is None:
+            raise ValueError
+        try:
+            python_type = column.type.python_type
+        except NotImplementedError:
+            return value
+        if python_type is datetime:
+            return datetime.fromisoformat(value)
+        if python_type is date:
+            return date.fromisoformat(value)
+        if python_type is uuid.UUID:
+            return uuid.UUID(value)
+        if python_type is Decimal:
+            return Decimal(value)
+        return python_type(value)
 
 
     @classmethod
@@ -144,38 +291,210 @@ class BaseDAO(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
         return result.scalars().one()
 
     @classmethod
-    async def add_bulk(cls, session: AsyncSession, data: List[Dict[str, Any]]):
+    async def add_bulk(cls, session: AsyncSession, data: List[Dict[str, Any]]) -> List[ModelType]:
+        """
+        Вставка списка строк с возвратом созданных объектов.
+        При ошибке поднимается BulkWriteException, транзакцию откатывает вызывающий код
+        """
         try:
             result = await session.execute(
                 insert(cls.model).returning(cls.model),
                 data
             )
             return result.scalars().all()
-        except (SQLAlchemyError, Exception) as e:
-            msg = ''
-            if isinstance(e, SQLAlchemyError):
-                msg = "Database Exc"
-            elif isinstance(e, Exception):
-                msg = "Unknown Exc"
-            msg += ": Cannot bulk insert data into table"
+        except SQLAlchemyError as e:
+            cls._raise_bulk_error(0, e)
 
-            # logger.error(msg, extra={"table": cls.model.__tablename__}, exc_info=True)
-            return None
+    @classmethod
+    async def upsert_bulk(
+        cls,
+        session: AsyncSession,
+        data: Sequence[Dict[str, Any]],
+        index_elements: Optional[Sequence[str]] = None,
+        update_columns: Optional[Sequence[str]] = None,
+        do_nothing: bool = False,
+        chunk_size: int = 1000,
+    ) -> int:
+        """
+        INSERT ... ON CONFLICT пачками по chunk_size строк, один multi-row VALUES запрос на пачку.
+        index_elements - колонки ключа конфликта (по умолчанию первичный ключ),
+        update_columns - что обновлять при конфликте (по умолчанию все переданные колонки кроме ключа),
+        do_nothing=True - существующие строки не трогаются.
+        Все строки должны содержать одинаковый набор колонок.
+        Возвращает количество вставленных и обновленных строк. Коммит остается за вызывающим кодом
+        """
+        if not data:
+            return 0
+
+        mapper = inspect(cls.model)
+        columns = list(data[0].keys())
+        if index_elements is None:
+            index_elements = [mapper.get_property_by_column(column).key for column in mapper.primary_key]
+        if update_columns is None:
+            update_columns = [key for key in columns if key not in index_elements]
+        conflict_target = [mapper.columns[key] for key in index_elements]
+        do_nothing = do_nothing or not update_columns
+        chunk_size = max(1, min(chunk_size, MAX_QUERY_PARAMS // len(columns)))
+
+        total = 0
+        for start in range(0, len(data), chunk_size):
+            chunk = data[start:start + chunk_size]
+            if not do_nothing:
+                # Postgres не дает обновить одну строку дважды в одном запросе - оставляем последнюю
+                chunk = cls._dedupe_by_key(chunk, index_elements)
+
+            stmt = pg_insert(cls.model).values(chunk)
+            if do_nothing:
+                stmt = stmt.on_conflict_do_nothing(index_elements=conflict_target)
+            else:
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=conflict_target,
+                    set_={
+                        mapper.columns[key]: stmt.excluded[mapper.columns[key].key] for key in update_columns
+                    },
+                )
+            try:
+                result = await session.execute(stmt)
+            except SQLAlchemyError as e:
+                cls._raise_bulk_error(start, e)
+            total += result.rowcount
+        return total
 
     @classmethod
-    async def update_bulk(cls, session: AsyncSession, data: List[Dict[str, Any]]):
+    async def copy_in(
+        cls,
+        session: AsyncSession,
+        data: Sequence[Union[Dict[str, Any], Sequence[Any]]],
+        columns: Optional[Sequence[str]] = None,
+    ) -> int:
+        """
+        Загрузка строк бинарным COPY (asyncpg copy_records_to_table) в транзакции сессии.
+        Строки - dict или кортежи в порядке columns (для кортежей columns обязательны).
+        Значения должны быть уже нужных python типов, default модели не применяются - только серверные.
+        Конфликты не обрабатываются: любая ошибка отменяет всю загрузку.
+        Возвращает количество загруженных строк. Коммит остается за вызывающим кодом
+        """
+        if not data:
+            return 0
+
+        table = cls.model.__table__
+        mapper = inspect(cls.model)
+        if isinstance(data[0], dict):
+            columns = columns or list(data[0].keys())
+            records = [tuple(row[key] for key in columns) for row in data]
+        elif columns:
+            records = data
+        else:
+            raise ValueError('columns are required for tuple rows')
+
+        connection = await session.connection()
+        # Драйвер открывает транзакцию только на первом запросе - без этого COPY ушел бы мимо нее
+        await connection.execute(select(literal(1)))
+        raw_connection = await connection.get_raw_connection()
         try:
-            stmt = update(cls.model)
-            await session.execute(update(cls.model), data)
-        except (SQLAlchemyError, Exception) as e:
-            msg = ''
-            if isinstance(e, SQLAlchemyError):
-                msg = "Database Exc"
-            elif isinstance(e, Exception):
-                msg = "Unknown Exc"
-            msg += ": Cannot bulk update data into table"
-            # logger.error(msg, extra={"table": cls.model.__tablename__}, exc_info=True)
-            return None
+            copy_status = await raw_connection.driver_connection.copy_records_to_table(
+                table.name,
+                records=records,
+                columns=[mapper.columns[key].name for key in columns],
+                schema_name=table.schema,
+            )
+        except (asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+            cls._raise_bulk_error(0, e)
+        # copy_status имеет вид "COPY 100000"
+        return int(copy_status.split()[-1])
+
+    @staticmethod
+    def _dedupe_by_key(chunk: Sequence[Dict[str, Any]], keys: Sequence[str]) -> Sequence[Dict[str, Any]]:
+        if any(key not in chunk[0] for key in keys):
+            return chunk
+        unique = {tuple(row[key] for key in keys): row for row in chunk}
+        return chunk if len(unique) == len(chunk) else list(unique.values())
+
+    @classmethod
+    def _raise_bulk_error(cls, offset: int, error: Exception) -> NoReturn:
+        logger.error(f"table: {cls.model.__tablename__} - cannot bulk write rows from {offset}: {error}")
+        raise BulkWriteException(cls.model.__tablename__, offset, error) from error
+
+    @classmethod
+    async def update_bulk(
+        cls,
+        session: AsyncSession,
+        data: Sequence[Tuple[Any, ...]],
+        *where,
+        key: Optional[str] = None,
+        chunk_size: int = 1000,
+    ) -> int:
+        """
+        Массовое обновление строк по ключу.
+        data - кортежи (ключ, {колонка: новое значение}) или (ключ, {колонка: новое}, {колонка: ожидаемое}).
+        Строки группируются по набору колонок, каждая группа пачками по chunk_size уходит
+        одним UPDATE ... FROM (VALUES ...).
+        Третий элемент - условие CAS: строка обновится, только если ее текущие значения
+        совпадают с ожидаемыми. where - дополнительные условия для всех строк.
+        key - колонка поиска строк, по умолчанию первичный ключ; при повторе ключа побеждает последняя запись.
+        Возвращает количество обновленных строк. Коммит остается за вызывающим кодом
+        """
+        mapper = inspect(cls.model)
+        key = key or mapper.get_property_by_column(mapper.primary_key[0]).key
+
+        groups: Dict[Tuple[Tuple[str, ...], Tuple[str, ...]], Dict[Any, Tuple[Dict, Dict]]] = {}
+        for item in data:
+            row_key, new_values = item[0], item[1]
+            expected = item[2] if len(item) > 2 else {}
+            if not new_values:
+                continue
+            signature = (tuple(sorted(new_values)), tuple(sorted(expected)))
+            groups.setdefault(signature, {})[row_key] = (new_values, expected)
+
+        total = 0
+        for (set_columns, cas_columns), rows in groups.items():
+            total += await cls._update_group(session, key, set_columns, cas_columns, rows, where, chunk_size)
+        return total
+
+    @classmethod
+    async def _update_group(
+        cls,
+        session: AsyncSession,
+        key: str,
+        set_columns: Tuple[str, ...],
+        cas_columns: Tuple[str, ...],
+        rows: Dict[Any, Tuple[Dict, Dict]],
+        where: Sequence[Any],
+        chunk_size: int,
+    ) -> int:
+        mapper = inspect(cls.model)
+        source_columns = [column('pk', mapper.columns[key].type)]
+        source_columns += [column(f'set_{name}', mapper.columns[name].type) for name in set_columns]
+        source_columns += [column(f'cas_{name}', mapper.columns[name].type) for name in cas_columns]
+        chunk_size = max(1, min(chunk_size, MAX_QUERY_PARAMS // len(source_columns)))
+
+        items = list(rows.items())
+        total = 0
+        for start in range(0, len(items), chunk_size):
+            source = values(*source_columns, name='bulk_update').data([
+                (
+                    row_key,
+                    *[new_values[name] for name in set_columns],
+                    *[expected[name] for name in cas_columns],
+                )
+                for row_key, (new_values, expected) in items[start:start + chunk_size]
+            ])
+            stmt = (
+                update(cls.model)
+                .where(mapper.columns[key] == source.c.pk, *where)
+                .where(*[
+                    mapper.columns[name].is_not_distinct_from(source.c[f'cas_{name}'])
+                    for name in cas_columns
+                ])
+                .values({mapper.columns[name]: source.c[f'set_{name}'] for name in set_columns})
+                .execution_options(synchronize_session=False)
+            )
+            try:
+                result = await session.execute(stmt)
+            except SQLAlchemyError as e:
+                cls._raise_bulk_error(start, e)
+            total += result.rowcount
+        return total
 
     @classmethod
     async def count(cls, session: AsyncSession, *filter, **filter_by):
@@ -6,4 +6,7 @@ DB_NAMING_CONVENTION = {
     "ck": "%(table_name)s_%(constraint_name)s_check",
     "fk": "%(table_name)s_%(column_0_name)s_fkey",
     "pk": "%(table_name)s_pkey",
-}
\ No newline at end of file
+}
+
+# Глубина многоуровневой реферальной системы
+REFERRAL_MAX_LEVEL = 10
@@ -1,9 +1,12 @@
-from typing import AsyncGenerator
+from decimal import Decimal
+from operator import attrgetter, itemgetter
+from typing import Any, AsyncGenerator, Callable, Dict, List, Sequence, Tuple
 from typing_extensions import Annotated
 
+import orjson
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker, AsyncEngine
 from sqlalchemy.orm import DeclarativeBase
-from sqlalchemy import String, MetaData
+from sqlalchemy import String, MetaData, Row, inspect
 
 from src.settings import get_settings
 from src.core.constants import DB_NAMING_CONVENTION
@@ -31,9 +34,76 @@ class Base(DeclarativeBase):
 
         return f"<{self.__class__.__name__} {', '.join(cols)}>"
 
-    # TODO: можно сделать быстрее
-    def to_dict(self):
-        return {column.name: getattr(self, column.name) for column in self.__table__.columns}
+    def to_dict(self) -> Dict[str, Any]:
+        names, loaded_values, values = type(self)._serializer()
+        try:
+            # Быстрый путь: все колонки уже загружены и лежат в __dict__ объекта
+            row = loaded_values(self.__dict__)
+        except KeyError:
+            # Есть expired/deferred колонки - читаем через атрибуты ORM, они догрузят значения
+            row = values(self)
+        return dict(zip(names, row))
+
+    @classmethod
+    def _serializer(cls) -> Tuple[Tuple[str, ...], Callable, Callable]:
+        """
+        Собирается один раз на класс модели: имена колонок и itemgetter/attrgetter,
+        которые достают значения всех колонок одним вызовом
+        """
+        serializer = cls.__dict__.get('_to_dict_serializer')
+        if serializer is None:
+            mapper = inspect(cls)
+            columns = cls.__table__.columns
+            names = tuple(column.name for column in columns)
+            keys = tuple(mapper.get_property_by_column(column).key for column in columns)
+            serializer = (names, _tuple_getter(itemgetter, keys), _tuple_getter(attrgetter, keys))
+            # через type.__setattr__, чтобы декларативный маппинг не воспринял это как атрибут модели
+            type.__setattr__(cls, '_to_dict_serializer', serializer)
+        return serializer
+
+    @classmethod
+    def columns(cls) -> Tuple[Any, ...]:
+        """
+        Колонки модели для select(*Model.columns()): запрос вернет Row без создания ORM объектов,
+        ключи строк совпадают с ключами to_dict
+        """
+        mapper = inspect(cls)
+        attributes = []
+        for column in cls.__table__.columns:
+            attribute = getattr(cls, mapper.get_property_by_column(column).key)
+            attributes.append(attribute if attribute.key == column.name else attribute.label(column.name))
+        return tuple(attributes)
+
+
+def _tuple_getter(getter, keys: Tuple[str, ...]) -> Callable:
+    # itemgetter/attrgetter с одним ключом возвращают значение, а не кортеж
+    if len(keys) == 1:
+        single = getter(keys[0])
+        return lambda obj: (single(obj),)
+    return getter(*keys)
+
+
+def rows_to_dicts(rows: Sequence[Row]) -> List[Dict[str, Any]]:
+    """
+    Строки результата select(*Model.columns()) / select(col1, col2...) в список dict
+    """
+    if not rows:
+        return []
+    keys = rows[0]._fields
+    return [dict(zip(keys, row)) for row in rows]
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError
+
+
+def dump_json(content: Any) -> bytes:
+    """
+    Сериализация ответа в json через orjson (datetime, date и UUID он понимает сам)
+    """
+    return orjson.dumps(content, default=_json_default)
 
 
 
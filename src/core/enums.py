@@ -9,3 +9,9 @@ class SortType(str, Enum):
 class RatingType(str, Enum):
     gdp = 'gdp'
     capacity = 'capacity'
+
+
+class RatingScope(str, Enum):
+    global_ = 'global'
+    country = 'country'
+    region = 'region'
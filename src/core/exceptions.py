@@ -13,4 +13,22 @@ class TokenExpiredException(HTTPException):
 
 class InvalidCredentialsException(HTTPException):
     def __init__(self):
-        super().__init__(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid telegram_id")
\ No newline at end of file
+        super().__init__(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid telegram_id")
+
+
+class InvalidCursorException(HTTPException):
+    def __init__(self):
+        super().__init__(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid pagination cursor")
+
+
+class BulkWriteException(Exception):
+    """
+    Ошибка массовой записи (add_bulk / upsert_bulk / copy_in).
+    offset - номер первой строки пачки, на которой упала запись, original - исходная ошибка драйвера.
+    Текст ошибки драйвера пишется только в лог, наружу уходит общий 500
+    """
+    def __init__(self, table: str, offset: int, original: Exception):
+        self.table = table
+        self.offset = offset
+        self.original = original
+        super().__init__(f"Bulk write into {table} failed at row {offset}")
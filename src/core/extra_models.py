@@ -0,0 +1,100 @@
+import uuid
+from datetime import datetime
+
+from sqlalchemy import func, ForeignKey, Index, BigInteger, String
+from sqlalchemy.orm import Mapped, mapped_column
+
+from src.core.database import Base
+from src.core.models import RefreshSessionModel
+
+
+# Служебные таблицы, которые не относятся к игровой схеме напрямую,
+# а обслуживают фоновые процессы (буферы, журналы, проекции)
+
+class TapFlushBatchModel(Base):
+    """
+    Журнал примененных пачек тапов из redis.
+    Нужен для идемпотентности: повторный сброс той же пачки после падения не начислит баланс дважды
+    """
+    __tablename__ = 'tap_flush_batches'
+
+    id: Mapped[str] = mapped_column(primary_key=True, nullable=False)
+    users_count: Mapped[int] = mapped_column(nullable=False, default=0)
+    created_at: Mapped[datetime] = mapped_column(nullable=False, server_default=func.now())
+
+
+
+class ReferralLevelStatModel(Base):
+    """
+    Материализованные счетчики рефералов по уровням (owner x level).
+    Обновляются при вставке цепочки рефералов, пересобираются скриптом rebuild_referral_stats
+    """
+    __tablename__ = 'referral_level_stats'
+
+    owner_id: Mapped[uuid.UUID] = mapped_column(
+        ForeignKey(column='users.id', onupdate='CASCADE', ondelete='CASCADE'),
+        primary_key=True,
+        nullable=False
+    )
+    level_id: Mapped[int] = mapped_column(primary_key=True, nullable=False)
+    referrals_count: Mapped[int] = mapped_column(nullable=False, default=0)
+
+
+
+class MarketSearchModel(Base):
+    """
+    Поисковая проекция маркета: одна строка на объявление x валюту.
+    Поля для фильтров продублированы из объявления и предприятия, индексы совпадают с комбинациями
+    фильтров /market/ads и сортировкой по цене. Строки удаляются каскадом вместе с объявлением
+    """
+    __tablename__ = 'market_search'
+    __table_args__ = (
+        Index('ix_market_search_currency_price', 'currency_id', 'price', 'market_id'),
+        Index('ix_market_search_capacity_price', 'capacity', 'currency_id', 'price', 'market_id'),
+        Index('ix_market_search_type_price', 'type_id', 'currency_id', 'price', 'market_id'),
+        Index('ix_market_search_type_capacity_price', 'type_id', 'capacity', 'currency_id', 'price', 'market_id'),
+    )
+
+    market_id: Mapped[int] = mapped_column(
+        ForeignKey(column='market.id', onupdate='CASCADE', ondelete='CASCADE'),
+        primary_key=True,
+        nullable=False
+    )
+    currency_id: Mapped[int] = mapped_column(primary_key=True, nullable=False)
+    price: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    enterprise_id: Mapped[int] = mapped_column(nullable=False)
+    capacity: Mapped[int] = mapped_column(nullable=True)
+    type_id: Mapped[int] = mapped_column(nullable=True)
+    tg_id: Mapped[int] = mapped_column(BigInteger, nullable=True)
+
+
+
+class RatingPositionModel(Base):
+    """
+    Позиции юзеров в рейтингах (глобальный, по стране, по региону) на момент последнего пересчета.
+    score, country_id и region_id - снимок, по которому считались позиции:
+    сравнение снимка с users показывает, у кого очки изменились с прошлого пересчета.
+    Пересчитывается RatingPositionService, строки удаляются каскадом вместе с юзером
+    """
+    __tablename__ = 'rating_positions'
+
+    rating_type: Mapped[str] = mapped_column(String(16), primary_key=True, nullable=False)
+    user_id: Mapped[uuid.UUID] = mapped_column(
+        ForeignKey(column='users.id', onupdate='CASCADE', ondelete='CASCADE'),
+        primary_key=True,
+        nullable=False
+    )
+    score: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    country_id: Mapped[int] = mapped_column(nullable=True)
+    region_id: Mapped[int] = mapped_column(nullable=True)
+    position: Mapped[int] = mapped_column(nullable=False)
+    country_position: Mapped[int] = mapped_column(nullable=True)
+    region_position: Mapped[int] = mapped_column(nullable=True)
+    updated_at: Mapped[datetime] = mapped_column(nullable=False, server_default=func.now())
+
+
+
+# Уникальный токен сессии: журнал сессий из redis (RefreshSessionMaintenance.flush_audit)
+# после падения может записаться повторно и вставляет сессии через ON CONFLICT DO NOTHING.
+# Перед созданием индекса дубли refresh_token в refresh_session нужно удалить
+Index('ux_refresh_session_refresh_token', RefreshSessionModel.refresh_token, unique=True)
@@ -19,6 +19,9 @@ from pydantic import BaseModel, Field
 class Pagination(BaseModel):
     offset: int = Field(default=0)
     limit: int = Field(default=100, gt=0, le=200)
+    # Непрозрачный курсор из заголовка X-Next-Cursor предыдущей страницы.
+    # Если передан, offset игнорируется и страница выбирается по ключу (keyset)
+    cursor: Optional[str] = Field(default=None)
 
 
 class StarsTransactionPagination(BaseModel):
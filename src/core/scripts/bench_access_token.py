@@ -0,0 +1,59 @@
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from jose import jwt
+
+from src.api.auth import decode_access_token, access_token_cache, _decode_jose, _decode_hs256
+from src.settings import get_settings
+from loguru import logger as log
+
+cfg = get_settings()
+
+TARGET_RPS = 10_000
+
+
+def make_token(tg_id: int) -> str:
+    return jwt.encode(
+        {
+            "sub": str(uuid.uuid4()),
+            "tg_id": str(tg_id),
+            "exp": datetime.utcnow() + timedelta(minutes=cfg.ACCESS_TOKEN_EXPIRE_MINUTES),
+        },
+        cfg.SECRET_KEY,
+        algorithm=cfg.ALGORITHM,
+    )
+
+
+def bench(name: str, func, tokens: list[str], rounds: int) -> None:
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for token in tokens:
+            func(token)
+    elapsed = time.perf_counter() - started
+    per_call = elapsed / (rounds * len(tokens))
+    # Доля одного ядра, которую съедает проверка токена при TARGET_RPS запросов в секунду
+    cpu_share = per_call * TARGET_RPS * 100
+    log.info(f'{name}: {per_call * 1e6:.2f} us/request, {cpu_share:.1f}% CPU at {TARGET_RPS} rps')
+
+
+# Накладные расходы проверки access токена на запрос: jose, hs256 и кэш.
+# Запуск: python -m src.core.scripts.bench_access_token [users] [rounds]
+def main(users: int, rounds: int):
+    tokens = [make_token(tg_id) for tg_id in range(1, users + 1)]
+
+    bench('jose.jwt.decode', _decode_jose, tokens, rounds)
+    if cfg.ALGORITHM == 'HS256':
+        bench('hs256 (hmac)', _decode_hs256, tokens, rounds)
+
+    access_token_cache.clear()
+    bench('decode_access_token (cached)', decode_access_token, tokens, rounds)
+    log.info(f'cache stats: {access_token_cache.stats()}')
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 1000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 20,
+    )
@@ -0,0 +1,93 @@
+import asyncio
+import sys
+import time
+from datetime import datetime
+
+from sqlalchemy import BigInteger, String, DateTime, delete
+from sqlalchemy.orm import Mapped, mapped_column
+
+from src.core.base_dao import BaseDAO
+from src.core.database import db_helper as db, Base
+from loguru import logger as log
+
+
+class BenchBulkModel(Base):
+    # Временная таблица бенчмарка, создается и удаляется скриптом
+    __tablename__ = 'bench_bulk_rows'
+
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    tg_id: Mapped[int] = mapped_column(BigInteger)
+    name: Mapped[str] = mapped_column(String(64))
+    balance: Mapped[int] = mapped_column(BigInteger)
+    created_at: Mapped[datetime] = mapped_column(DateTime)
+
+
+class BenchBulkDAO(BaseDAO[BenchBulkModel, None, None]):
+    model = BenchBulkModel
+
+
+def make_rows(count: int, balance: int = 0) -> list[dict]:
+    now = datetime.utcnow()
+    return [
+        dict(id=idx, tg_id=1_000_000 + idx, name=f'user {idx}', balance=balance + idx, created_at=now)
+        for idx in range(1, count + 1)
+    ]
+
+
+async def bench(name: str, count: int, func, truncate: bool = True) -> None:
+    async with db.session_factory() as ses:
+        if truncate:
+            await ses.execute(delete(BenchBulkModel))
+            await ses.commit()
+
+        started = time.perf_counter()
+        written = await func(ses)
+        await ses.commit()
+        elapsed = time.perf_counter() - started
+    log.info(f'{name}: {written} rows, {elapsed:.2f}s, {count / elapsed:,.0f} rows/sec')
+
+
+# Скорость массовой записи: add_bulk, upsert_bulk (вставка / обновление / do nothing) и COPY.
+# Таблица bench_bulk_rows создается на время запуска (только тестовая база!).
+# Запуск: python -m src.core.scripts.bench_bulk_write [rows] [chunk_size]
+async def main(count: int, chunk_size: int):
+    async with db.engine.begin() as conn:
+        await conn.run_sync(BenchBulkModel.__table__.create, checkfirst=True)
+
+    try:
+        rows = make_rows(count)
+        await bench(
+            'add_bulk (executemany + returning)', count,
+            lambda ses: _count(BenchBulkDAO.add_bulk(ses, rows)),
+        )
+        await bench(
+            'upsert_bulk insert', count,
+            lambda ses: BenchBulkDAO.upsert_bulk(ses, rows, chunk_size=chunk_size),
+        )
+        updated = make_rows(count, balance=100)
+        await bench(
+            'upsert_bulk update', count,
+            lambda ses: BenchBulkDAO.upsert_bulk(ses, updated, chunk_size=chunk_size),
+            truncate=False,
+        )
+        await bench(
+            'upsert_bulk do nothing', count,
+            lambda ses: BenchBulkDAO.upsert_bulk(ses, updated, do_nothing=True, chunk_size=chunk_size),
+            truncate=False,
+        )
+        await bench('copy_in', count, lambda ses: BenchBulkDAO.copy_in(ses, rows))
+    finally:
+        async with db.engine.begin() as conn:
+            await conn.run_sync(BenchBulkModel.__table__.drop, checkfirst=True)
+        await db.dispose()
+
+
+async def _count(awaitable) -> int:
+    return len(await awaitable)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 100_000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 1000,
+    ))
@@ -0,0 +1,59 @@
+import hashlib
+import hmac
+import json
+import sys
+import time
+from urllib.parse import urlencode
+
+from aiogram.utils.web_app import safe_parse_webapp_init_data
+
+from src.api.auth import parse_init_data, init_data_cache
+from src.settings import get_settings
+from loguru import logger as log
+
+cfg = get_settings()
+
+
+def make_init_data(tg_id: int) -> str:
+    # Подписываем initData так же, как это делает телеграм
+    data = {
+        'auth_date': str(int(time.time())),
+        'query_id': f'AAH{tg_id}',
+        'user': json.dumps({'id': tg_id, 'first_name': 'Bench', 'username': f'bench{tg_id}'}),
+    }
+    data_check_string = '\n'.join(f'{k}={v}' for k, v in sorted(data.items()))
+    secret_key = hmac.new(b'WebAppData', cfg.bot_token.encode(), hashlib.sha256).digest()
+    data['hash'] = hmac.new(secret_key, data_check_string.encode(), hashlib.sha256).hexdigest()
+    return urlencode(data)
+
+
+def bench(name: str, func, init_data: list[str], rounds: int) -> None:
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for item in init_data:
+            func(item)
+    elapsed = time.perf_counter() - started
+    calls = rounds * len(init_data)
+    log.info(f'{name}: {calls} calls, {elapsed:.3f}s, {elapsed / calls * 1e6:.2f} us/call')
+
+
+# Микробенчмарк проверки initData с кэшем и без.
+# Запуск: python -m src.core.scripts.bench_init_data [users] [rounds]
+def main(users: int, rounds: int):
+    init_data = [make_init_data(tg_id) for tg_id in range(1, users + 1)]
+
+    bench(
+        'safe_parse_webapp_init_data',
+        lambda item: safe_parse_webapp_init_data(token=cfg.bot_token, init_data=item),
+        init_data, rounds,
+    )
+    init_data_cache.clear()
+    bench('parse_init_data (cached)', parse_init_data, init_data, rounds)
+    log.info(f'cache stats: {init_data_cache.stats()}')
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 1000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 20,
+    )
@@ -0,0 +1,54 @@
+import asyncio
+import statistics
+import sys
+import time
+
+from sqlalchemy import select, func
+
+from src.core.models import UserModel
+from src.api.dao import UserDAO
+from src.core.database import db_helper as db
+from loguru import logger as log
+
+
+async def bench(name: str, rounds: int, **kwargs) -> None:
+    latencies: list[float] = []
+    async with db.session_factory() as ses:
+        for _ in range(rounds):
+            started = time.perf_counter()
+            await UserDAO.find_all(ses, **kwargs)
+            latencies.append(time.perf_counter() - started)
+    latencies.sort()
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    log.info(f'{name}: p50 {statistics.median(latencies) * 1000:.2f}ms, p99 {p99 * 1000:.2f}ms')
+
+
+# Страница 1 и страница N таблицы users: OFFSET против курсора (keyset по created_at, id).
+# Только чтение. Курсор страницы N берется с последней строки страницы N - 1 до замера.
+# Запуск: python -m src.core.scripts.bench_pagination [page] [limit] [rounds]
+async def main(page: int, limit: int, rounds: int):
+    try:
+        async with db.session_factory() as ses:
+            total = await ses.scalar(select(func.count()).select_from(UserModel))
+        page = min(page, max(total // limit, 1))
+        log.info(f'{total} users, comparing page 1 and page {page} by {limit}')
+
+        async with db.session_factory() as ses:
+            previous = await UserDAO.find_all(ses, offset=(page - 1) * limit - 1, limit=1, order_by='created_at') \
+                if page > 1 else []
+        cursor = UserDAO.encode_cursor(previous[0], order_by='created_at') if previous else None
+
+        await bench('offset, page 1', rounds, offset=0, limit=limit, order_by='created_at')
+        await bench(f'offset, page {page}', rounds, offset=(page - 1) * limit, limit=limit, order_by='created_at')
+        await bench('cursor, page 1', rounds, limit=limit, order_by='created_at')
+        await bench(f'cursor, page {page}', rounds, limit=limit, order_by='created_at', cursor=cursor)
+    finally:
+        await db.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 10_000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 100,
+        int(sys.argv[3]) if len(sys.argv) > 3 else 20,
+    ))
@@ -0,0 +1,66 @@
+import asyncio
+import statistics
+import sys
+import time
+
+from sqlalchemy import select
+
+from src.core.models import UserModel
+from src.api.services.user_service import UserService
+from src.core.database import db_helper as db
+from src.others.redis_client import redis_client
+from loguru import logger as log
+
+
+async def bench(name: str, func, tg_ids: list[int], rounds: int, concurrency: int) -> None:
+    latencies: list[float] = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def call(tg_id: int):
+        async with semaphore:
+            started = time.perf_counter()
+            await func(tg_id)
+            latencies.append(time.perf_counter() - started)
+
+    # Прогрев: пул соединений и справочники
+    await asyncio.gather(*[call(tg_id) for tg_id in tg_ids[:concurrency]])
+    latencies.clear()
+
+    started = time.perf_counter()
+    for _ in range(rounds):
+        await asyncio.gather(*[call(tg_id) for tg_id in tg_ids])
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    log.info(
+        f'{name}: {len(latencies)} calls, {len(latencies) / elapsed:,.0f} rps, '
+        f'p50 {statistics.median(latencies) * 1000:.2f}ms, p99 {p99 * 1000:.2f}ms'
+    )
+
+
+# Профиль /user/me одним запросом против прежних последовательных запросов (флаг profile_single_query).
+# Только чтение, берутся существующие юзеры.
+# Запуск: python -m src.core.scripts.bench_profile [users] [rounds] [concurrency]
+async def main(users: int, rounds: int, concurrency: int):
+    await redis_client.connect()
+    try:
+        async with db.session_factory() as ses:
+            tg_ids = (await ses.scalars(select(UserModel.tg_id).order_by(UserModel.tg_id).limit(users))).all()
+        if not tg_ids:
+            log.error('No users found')
+            return
+
+        await bench('sequential', UserService._get_profile_sequential, tg_ids, rounds, concurrency)
+        await bench('single query', UserService._get_profile_single_query, tg_ids, rounds, concurrency)
+    finally:
+        await redis_client.close()
+        await db.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 200,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 10,
+        int(sys.argv[3]) if len(sys.argv) > 3 else 10,
+    ))
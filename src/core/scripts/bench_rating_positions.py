@@ -0,0 +1,115 @@
+import asyncio
+import random
+import sys
+import time
+import uuid
+from datetime import datetime
+
+from sqlalchemy import select, update, delete, func
+
+from src.core.models import UserModel, CountryModel, RegionModel
+from src.api.dao import UserDAO
+from src.api.services.rating_position_service import RatingPositionService
+from src.core.database import db_helper as db
+from src.core.enums import RatingType
+from loguru import logger as log
+
+# Синтетические юзеры получают tg_id ниже этой границы, по ней же удаляются после замера
+SYNTHETIC_TG_ID = -10 ** 12
+COPY_BATCH = 50_000
+
+
+async def seed_users(count: int, first: int = 0) -> None:
+    async with db.session_factory() as ses:
+        countries = (await ses.scalars(select(CountryModel.id))).all() or [None]
+        regions = (await ses.scalars(select(RegionModel.id))).all() or [None]
+
+    now = datetime.utcnow()
+    started = time.perf_counter()
+    for start in range(first, first + count, COPY_BATCH):
+        rows = [
+            dict(
+                id=uuid.uuid4(),
+                tg_id=SYNTHETIC_TG_ID - idx,
+                first_name=f'bench {idx}',
+                game_balance=random.randint(0, 10_000_000),
+                total_capacity=random.randint(0, 100_000),
+                country_id=random.choice(countries),
+                region_id=random.choice(regions),
+                created_at=now,
+                updated_at=now,
+            )
+            for idx in range(start, min(start + COPY_BATCH, first + count))
+        ]
+        async with db.session_factory() as ses:
+            await UserDAO.copy_in(ses, rows)
+            await ses.commit()
+    log.info(f'{count} synthetic users seeded in {time.perf_counter() - started:.1f}s')
+
+
+async def touch_users(share: float) -> int:
+    # Меняем очки части синтетических юзеров, как будто они тапали
+    async with db.session_factory() as ses:
+        result = await ses.execute(
+            update(UserModel)
+            .where(UserModel.tg_id <= SYNTHETIC_TG_ID, func.random() < share)
+            .values(game_balance=UserModel.game_balance + func.floor(func.random() * 100_000))
+        )
+        await ses.commit()
+    return result.rowcount
+
+
+async def drop_users() -> None:
+    # Позиции удалятся каскадом вместе с юзерами
+    while True:
+        async with db.session_factory() as ses:
+            batch = (
+                select(UserModel.id)
+                .where(UserModel.tg_id <= SYNTHETIC_TG_ID)
+                .limit(COPY_BATCH)
+                .scalar_subquery()
+            )
+            result = await ses.execute(delete(UserModel).where(UserModel.id.in_(batch)))
+            await ses.commit()
+        if result.rowcount < COPY_BATCH:
+            break
+
+
+async def bench(name: str, **kwargs) -> dict:
+    started = time.perf_counter()
+    stats = await RatingPositionService.recompute(RatingType.gdp, **kwargs)
+    log.info(f'{name}: {time.perf_counter() - started:.2f}s {stats}')
+    return stats
+
+
+# Пересчет позиций рейтинга на синтетических юзерах: полный, без изменений, после изменения части очков
+# и после появления новых юзеров. Полный пересчет в конце проверяет инкрементальный:
+# если инкрементальный пересчет ничего не упустил, полному переписывать нечего.
+# Юзеры пишутся в users (только тестовая база!) и удаляются после замера.
+# Запуск: python -m src.core.scripts.bench_rating_positions [users] [changed_share] [new_users]
+async def main(count: int, share: float, new_count: int):
+    try:
+        await seed_users(count)
+        await bench('full recompute', full=True)
+        await bench('incremental, nothing changed')
+        changed = await touch_users(share)
+        log.info(f'{changed} users changed their score')
+        await bench('incremental after changes')
+        await seed_users(new_count, first=count)
+        await bench('incremental after new users')
+        stats = await bench('full recompute after changes', full=True)
+        if stats['written']:
+            log.error(f"Incremental recompute missed {stats['written']} positions")
+        else:
+            log.success('Incremental recompute matches the full one')
+    finally:
+        await drop_users()
+        await db.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000,
+        float(sys.argv[2]) if len(sys.argv) > 2 else 0.01,
+        int(sys.argv[3]) if len(sys.argv) > 3 else 1000,
+    ))
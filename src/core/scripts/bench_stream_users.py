@@ -0,0 +1,61 @@
+import asyncio
+import sys
+import time
+import tracemalloc
+
+from src.api.dao import UserDAO
+from src.api.services.user_service import UserService
+from src.core.database import db_helper as db
+from loguru import logger as log
+
+
+async def paginated(page_size: int) -> int:
+    # Прежний подход get_all_users: страницы через OFFSET, все ORM объекты копятся в списке
+    users = []
+    offset = 0
+    while True:
+        page = await UserService.get_users(order_by='tg_id', limit=page_size, offset=offset)
+        if not page:
+            break
+        users.extend(page)
+        offset += page_size
+    return len(users)
+
+
+async def streamed(batch_size: int) -> int:
+    count = 0
+    async with db.session_factory() as ses:
+        async for _ in UserDAO.stream(ses, order_by='tg_id', batch_size=batch_size):
+            count += 1
+    return count
+
+
+async def bench(name: str, func, size: int) -> None:
+    tracemalloc.start()
+    started = time.perf_counter()
+    rows = await func(size)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    log.info(
+        f'{name}: {rows} rows, {elapsed:.2f}s, {rows / elapsed if elapsed else 0:,.0f} rows/sec, '
+        f'peak memory {peak / 1024 / 1024:.1f} MB'
+    )
+
+
+# Полный обход таблицы users: OFFSET пагинация со сбором в список против UserDAO.stream.
+# Только чтение, но на большой таблице прежний подход съест много памяти.
+# Запуск: python -m src.core.scripts.bench_stream_users [page_size] [batch_size]
+async def main(page_size: int, batch_size: int):
+    try:
+        await bench('paginated (offset + list)', paginated, page_size)
+        await bench('UserDAO.stream (yield_per)', streamed, batch_size)
+    finally:
+        await db.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 500,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 1000,
+    ))
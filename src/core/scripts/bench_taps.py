@@ -0,0 +1,133 @@
+import asyncio
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime
+
+from sqlalchemy import update, delete
+
+from src.core.models import UserModel
+from src.api.dao import UserDAO
+from src.api.services.catalog_service import CatalogService
+from src.api.services.tap_service import TapService, TAPS_DIRTY_KEY, _state_key
+from src.api.services.user_service import UserService
+from src.core.database import db_helper as db
+from src.others.redis_client import redis_client
+from src.settings import get_settings
+from loguru import logger as log
+
+cfg = get_settings()
+
+# Синтетические юзеры получают tg_id ниже этой границы, по ней же удаляются после замера
+SYNTHETIC_TG_ID = -2 * 10 ** 12
+
+
+def synthetic_tg_ids(count: int) -> list[int]:
+    return [SYNTHETIC_TG_ID - idx for idx in range(count)]
+
+
+async def seed_users(count: int) -> None:
+    level = (await CatalogService.get()).levels.rows[0].level
+    now = datetime.utcnow()
+    rows = [
+        dict(
+            id=uuid.uuid4(), tg_id=tg_id, first_name=f'bench {tg_id}', level=level,
+            energy=cfg.energy_limit, game_balance=0, created_at=now, updated_at=now,
+        )
+        for tg_id in synthetic_tg_ids(count)
+    ]
+    async with db.session_factory() as ses:
+        await UserDAO.copy_in(ses, rows)
+        await ses.commit()
+
+
+async def reset_users(count: int) -> None:
+    # Перед каждым замером энергия полная, а кэш тапов пуст
+    tg_ids = synthetic_tg_ids(count)
+    async with db.session_factory() as ses:
+        await ses.execute(
+            update(UserModel).where(UserModel.tg_id <= SYNTHETIC_TG_ID).values(energy=cfg.energy_limit)
+        )
+        await ses.commit()
+    await redis_client.redis.delete(*[_state_key(tg_id) for tg_id in tg_ids])
+    await redis_client.redis.srem(TAPS_DIRTY_KEY, *tg_ids)
+
+
+async def drop_users(count: int) -> None:
+    async with db.session_factory() as ses:
+        await ses.execute(delete(UserModel).where(UserModel.tg_id <= SYNTHETIC_TG_ID))
+        await ses.commit()
+    await redis_client.redis.delete(*[_state_key(tg_id) for tg_id in synthetic_tg_ids(count)])
+
+
+def report(name: str, latencies: list[float], elapsed: float) -> None:
+    latencies.sort()
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    log.info(
+        f'{name}: {len(latencies)} calls, {elapsed:.2f}s, {len(latencies) / elapsed:,.0f} taps/sec, '
+        f'p50 {statistics.median(latencies) * 1000:.2f}ms, p99 {p99 * 1000:.2f}ms'
+    )
+
+
+async def tap(name: str, func, count: int, taps: int) -> None:
+    # Каждый юзер шлет taps запросов подряд с растущим счетчиком, юзеры работают параллельно
+    latencies: list[float] = []
+
+    async def user_taps(tg_id: int):
+        for tap_count in range(1, taps + 1):
+            started = time.perf_counter()
+            await func(tg_id=tg_id, new_tap_count=tap_count)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[user_taps(tg_id) for tg_id in synthetic_tg_ids(count)])
+    report(name, latencies, time.perf_counter() - started)
+
+
+async def flush() -> None:
+    latencies: list[float] = []
+    users = 0
+    started = time.perf_counter()
+    while True:
+        flush_started = time.perf_counter()
+        flushed = await TapService.flush()
+        if not flushed:
+            break
+        latencies.append(time.perf_counter() - flush_started)
+        users += flushed
+    elapsed = time.perf_counter() - started
+    if latencies:
+        log.info(
+            f'flush: {users} users in {len(latencies)} batches, {elapsed:.2f}s, '
+            f'batch p50 {statistics.median(latencies) * 1000:.1f}ms, max {max(latencies) * 1000:.1f}ms'
+        )
+
+
+# Тапы напрямую в postgres (UserService.update_game_balance) против буфера в redis (TapService)
+# и задержка сброса буфера в базу пачками.
+# Юзеры пишутся в users (только тестовая база!) и удаляются после замера.
+# Запуск: python -m src.core.scripts.bench_taps [users] [taps_per_user]
+async def main(count: int, taps: int):
+    if taps >= cfg.energy_limit:
+        log.error(f'taps_per_user must be less than energy_limit ({cfg.energy_limit})')
+        return
+
+    await redis_client.connect()
+    try:
+        await seed_users(count)
+        await tap('direct (postgres)', UserService.update_game_balance, count, taps)
+        await reset_users(count)
+        await tap('buffered (redis)', TapService.update_game_balance, count, taps)
+        await flush()
+    finally:
+        await drop_users(count)
+        await redis_client.close()
+        await db.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 1000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 20,
+    ))
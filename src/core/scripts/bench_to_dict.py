@@ -0,0 +1,85 @@
+import sys
+import time
+import uuid
+from datetime import date, datetime
+from decimal import Decimal
+
+import orjson
+from sqlalchemy.engine.result import result_tuple
+
+from src.core.models import UserMarketHistoryModel, MarketModel, UserModel
+from src.core.database import rows_to_dicts, dump_json
+from loguru import logger as log
+
+MODELS = {
+    'history': UserMarketHistoryModel,
+    'market': MarketModel,
+    'user': UserModel,
+}
+
+
+def sample_value(column, idx: int):
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        return None
+    if python_type is datetime:
+        return datetime.now()
+    if python_type is date:
+        return date.today()
+    if python_type is uuid.UUID:
+        return uuid.uuid4()
+    if python_type is Decimal:
+        return Decimal(idx)
+    if python_type is bool:
+        return bool(idx % 2)
+    if python_type is str:
+        return f'value {idx}'
+    if python_type in (int, float):
+        return python_type(idx)
+    return None
+
+
+def legacy_to_dict(obj):
+    # Прежняя реализация Base.to_dict
+    return {column.name: getattr(obj, column.name) for column in obj.__table__.columns}
+
+
+def bench(name: str, func, rounds: int, count: int) -> None:
+    started = time.perf_counter()
+    for _ in range(rounds):
+        func()
+    elapsed = (time.perf_counter() - started) / rounds
+    log.info(f'{name}: {elapsed * 1e3:.2f} ms per {count} rows, {elapsed / count * 1e6:.2f} us/row')
+
+
+# Сериализация N строк модели: прежний to_dict, новый to_dict и строки без ORM объектов.
+# Запуск: python -m src.core.scripts.bench_to_dict [history|market|user] [rows] [rounds]
+def main(model_name: str, count: int, rounds: int):
+    model = MODELS[model_name]
+    columns = list(model.__table__.columns)
+    values = [{column.name: sample_value(column, idx) for column in columns} for idx in range(count)]
+
+    objects = [model(**{column.key: row[column.name] for column in columns}) for row in values]
+    make_row = result_tuple([column.name for column in columns])
+    rows = [make_row([row[column.name] for column in columns]) for row in values]
+
+    bench('legacy to_dict', lambda: [legacy_to_dict(obj) for obj in objects], rounds, count)
+    bench('Base.to_dict', lambda: [obj.to_dict() for obj in objects], rounds, count)
+    bench('rows_to_dicts (Row)', lambda: rows_to_dicts(rows), rounds, count)
+
+    bench(
+        'legacy to_dict + orjson',
+        lambda: orjson.dumps([legacy_to_dict(obj) for obj in objects], default=str),
+        rounds, count,
+    )
+    bench('Base.to_dict + dump_json', lambda: dump_json([obj.to_dict() for obj in objects]), rounds, count)
+    bench('rows_to_dicts + dump_json', lambda: dump_json(rows_to_dicts(rows)), rounds, count)
+
+
+if __name__ == "__main__":
+    main(
+        sys.argv[1] if len(sys.argv) > 1 else 'history',
+        int(sys.argv[2]) if len(sys.argv) > 2 else 10_000,
+        int(sys.argv[3]) if len(sys.argv) > 3 else 20,
+    )
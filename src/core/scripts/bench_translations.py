@@ -0,0 +1,48 @@
+import gettext
+import sys
+import time
+
+from src.core.utils import LOCALEDIR, translations, negotiate_language
+from loguru import logger as log
+
+
+PAGE_SIZE = 100
+ACCEPT_LANGUAGE = 'ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7'
+
+
+def old_translation(domain: str, header: str):
+    # Прежний путь: поиск и разбор каталога gettext на каждый запрос
+    lang = header.split(',')[0] if header else 'en'
+    return gettext.translation(domain, LOCALEDIR, languages=[lang], fallback=True).gettext
+
+
+def new_translation(domain: str, header: str):
+    return translations.gettext(domain, negotiate_language(header))
+
+
+def bench(name: str, get_translation, domain: str, messages: list[str], requests: int) -> None:
+    started = time.perf_counter()
+    for _ in range(requests):
+        _ = get_translation(domain, ACCEPT_LANGUAGE)
+        for message in messages:
+            _(message)
+    elapsed = time.perf_counter() - started
+    log.info(f'{name}: {elapsed / requests * 1e6:.2f} us per {PAGE_SIZE}-item page')
+
+
+# Стоимость перевода одной страницы маркета (название + описание для 100 объявлений).
+# Запуск: python -m src.core.scripts.bench_translations [domain] [requests]
+def main(domain: str, requests: int):
+    translations.load()
+    messages = [f'Предприятие {i}' for i in range(PAGE_SIZE)] + [f'Описание {i}' for i in range(PAGE_SIZE)]
+
+    bench('gettext.translation per request', old_translation, domain, messages, requests)
+    bench('TranslationRegistry', new_translation, domain, messages, requests)
+    log.info(f'negotiate_language cache: {negotiate_language.cache_info()}')
+
+
+if __name__ == "__main__":
+    main(
+        sys.argv[1] if len(sys.argv) > 1 else 'enterprises',
+        int(sys.argv[2]) if len(sys.argv) > 2 else 10000,
+    )
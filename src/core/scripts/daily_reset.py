@@ -0,0 +1,33 @@
+import asyncio
+import sys
+
+from src.api.services.daily_reset_service import DailyResetService
+from src.core.database import db_helper as db
+from src.others.redis_client import redis_client
+from loguru import logger as log
+
+
+# Ночное восстановление энергии и сброс ежедневных наград вручную.
+# run - обработка за текущие сутки (продолжит прерванную), force - запустить заново,
+# status - прогресс последнего запуска.
+# Запуск: python -m src.core.scripts.daily_reset [run|force|status] [batch_size] [pause]
+async def main(command: str, batch_size: int | None, pause: float | None):
+    await redis_client.connect()
+    try:
+        if command == 'status':
+            log.info(f'Daily reset progress: {await DailyResetService.progress()}')
+            return
+
+        progress = await DailyResetService.run(batch_size=batch_size, pause=pause, force=command == 'force')
+        log.success(f'Daily reset: {progress}')
+    finally:
+        await redis_client.close()
+        await db.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(
+        sys.argv[1] if len(sys.argv) > 1 else 'run',
+        int(sys.argv[2]) if len(sys.argv) > 2 else None,
+        float(sys.argv[3]) if len(sys.argv) > 3 else None,
+    ))
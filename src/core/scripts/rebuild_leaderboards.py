@@ -0,0 +1,23 @@
+import asyncio
+import sys
+
+from src.api.services.leaderboard_service import LeaderboardService
+from src.core.database import db_helper as db
+from src.others.redis_client import redis_client
+from loguru import logger as log
+
+
+# Полная пересборка рейтингов (redis sorted sets) по таблице users.
+# Запуск: python -m src.core.scripts.rebuild_leaderboards [batch_size]
+async def main(batch_size: int):
+    await redis_client.connect()
+    try:
+        total = await LeaderboardService.rebuild(batch_size=batch_size)
+        log.success(f'Leaderboards rebuilt: {total} users')
+    finally:
+        await redis_client.close()
+        await db.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000))
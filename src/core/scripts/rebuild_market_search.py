@@ -0,0 +1,42 @@
+import asyncio
+
+from sqlalchemy import select, insert, delete, text
+
+from src.core.models import MarketModel, UserMarketPriceModel, EnterpriseModel
+from src.core.extra_models import MarketSearchModel
+from src.core.database import db_helper as db
+from loguru import logger as log
+
+
+# Полная пересборка поисковой проекции маркета (market_search) по таблицам market и user_market_prices.
+# Нужна для первичного заполнения (backfill) и для исправления расхождений.
+# Запуск: python -m src.core.scripts.rebuild_market_search
+async def rebuild_market_search() -> int:
+    async with db.session_factory() as ses:
+        # Блокируем проекцию на время пересборки, параллельные объявления дождутся ее окончания
+        await ses.execute(text(f'LOCK TABLE {MarketSearchModel.__tablename__} IN EXCLUSIVE MODE'))
+        await ses.execute(delete(MarketSearchModel))
+
+        stmt = insert(MarketSearchModel).from_select(
+            ['market_id', 'currency_id', 'price', 'enterprise_id', 'capacity', 'type_id', 'tg_id'],
+            select(
+                MarketModel.id, UserMarketPriceModel.currency_id, UserMarketPriceModel.price,
+                MarketModel.enterprise_id, EnterpriseModel.capacity, EnterpriseModel.type_id, MarketModel.tg_id
+            )
+            .join(UserMarketPriceModel, UserMarketPriceModel.market_id == MarketModel.id)
+            .join(EnterpriseModel, EnterpriseModel.id == MarketModel.enterprise_id)
+            .where(UserMarketPriceModel.currency_id.is_not(None), UserMarketPriceModel.price.is_not(None))
+        )
+        result = await ses.execute(stmt)
+        await ses.commit()
+    return result.rowcount
+
+
+async def main():
+    rows = await rebuild_market_search()
+    log.success(f'market_search rebuilt: {rows} rows')
+    await db.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,38 @@
+import asyncio
+
+from sqlalchemy import select, insert, delete, func, text
+
+from src.core.models import ReferralModel
+from src.core.extra_models import ReferralLevelStatModel
+from src.core.database import db_helper as db
+from loguru import logger as log
+
+
+# Полная пересборка таблицы referral_level_stats по таблице referrals.
+# Нужна для первичного заполнения (backfill) и для исправления расхождений.
+# Запуск: python -m src.core.scripts.rebuild_referral_stats
+async def rebuild_referral_stats() -> int:
+    async with db.session_factory() as ses:
+        # Блокируем счетчики на время пересборки, чтобы параллельные регистрации
+        # дождались ее окончания и не потерялись
+        await ses.execute(text(f'LOCK TABLE {ReferralLevelStatModel.__tablename__} IN EXCLUSIVE MODE'))
+        await ses.execute(delete(ReferralLevelStatModel))
+
+        stmt = insert(ReferralLevelStatModel).from_select(
+            ['owner_id', 'level_id', 'referrals_count'],
+            select(ReferralModel.owner_id, ReferralModel.level_id, func.count(ReferralModel.id))
+            .group_by(ReferralModel.owner_id, ReferralModel.level_id)
+        )
+        result = await ses.execute(stmt)
+        await ses.commit()
+    return result.rowcount
+
+
+async def main():
+    rows = await rebuild_referral_stats()
+    log.success(f'referral_level_stats rebuilt: {rows} rows')
+    await db.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
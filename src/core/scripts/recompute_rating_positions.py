@@ -0,0 +1,26 @@
+import asyncio
+import sys
+
+from src.api.services.rating_position_service import RatingPositionService
+from src.core.database import db_helper as db
+from src.others.redis_client import redis_client
+from loguru import logger as log
+
+
+# Пересчет позиций в рейтингах (rating_positions): инкрементальный или полный (full).
+# Запуск: python -m src.core.scripts.recompute_rating_positions [full]
+async def main(full: bool):
+    await redis_client.connect()
+    try:
+        stats = await RatingPositionService.recompute_all(full=full)
+        if not stats:
+            log.warning('Rating positions are being recomputed by another worker')
+            return
+        log.success(f'Rating positions recomputed: {stats}')
+    finally:
+        await redis_client.close()
+        await db.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(len(sys.argv) > 1 and sys.argv[1] == 'full'))
@@ -0,0 +1,70 @@
+import asyncio
+import sys
+
+from fastapi import HTTPException
+from sqlalchemy import select, func
+
+from src.core.models import UserModel, MarketModel, UserMarketPriceModel
+from src.core.database import db_helper as db
+from src.api.services.market_service import MarketService
+from src.others.redis_client import redis_client
+from loguru import logger as log
+
+
+# Нагрузочная проверка покупки на маркете: много покупателей одновременно покупают одно объявление.
+# Объявление должно достаться ровно одному, сумма балансов участников не должна измениться.
+# ВНИМАНИЕ: выполняет настоящую покупку, запускать только на тестовой базе.
+# Запуск: python -m src.core.scripts.stress_market_buy market_id currency_id [buyers]
+async def main(market_id: int, currency_id: int, buyers_count: int):
+    await redis_client.connect()
+    try:
+        async with db.session_factory() as ses:
+            ad = (await ses.execute(
+                select(MarketModel.tg_id, UserMarketPriceModel.price)
+                .join(UserMarketPriceModel, UserMarketPriceModel.market_id == MarketModel.id)
+                .where(MarketModel.id == market_id, UserMarketPriceModel.currency_id == currency_id)
+            )).first()
+            if ad is None:
+                log.error('Ad or price not found')
+                return
+
+            buyers = (await ses.scalars(
+                select(UserModel.tg_id)
+                .where(UserModel.tg_id != ad.tg_id, UserModel.game_balance >= ad.price)
+                .limit(buyers_count)
+            )).all()
+            participants = [ad.tg_id, *buyers]
+            balance_before = await ses.scalar(
+                select(func.sum(UserModel.game_balance)).where(UserModel.tg_id.in_(participants))
+            )
+
+        async def buy(tg_id: int):
+            try:
+                await MarketService.buy(buyer_tg_id=tg_id, market_id=market_id, currency_id=currency_id)
+                return 200
+            except HTTPException as e:
+                return e.status_code
+
+        results = await asyncio.gather(*[buy(tg_id) for tg_id in buyers])
+
+        async with db.session_factory() as ses:
+            balance_after = await ses.scalar(
+                select(func.sum(UserModel.game_balance)).where(UserModel.tg_id.in_(participants))
+            )
+
+        codes = {code: results.count(code) for code in set(results)}
+        log.info(f'{len(buyers)} buyers, responses: {codes}')
+        assert codes.get(200) == 1, 'The ad must be sold exactly once'
+        assert balance_before == balance_after, f'Balances changed: {balance_before} -> {balance_after}'
+        log.success('OK: sold once, total balance preserved')
+    finally:
+        await redis_client.close()
+        await db.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(
+        int(sys.argv[1]),
+        int(sys.argv[2]),
+        int(sys.argv[3]) if len(sys.argv) > 3 else 50,
+    ))
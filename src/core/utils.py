@@ -1,23 +1,140 @@
 import gettext
 import os
-from fastapi import Request
+from functools import lru_cache
+from typing import Callable, Dict, Optional, Tuple
+from fastapi import Request, Response
 
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
 
-# Функция для получения переводов на основе языка
-def _get_translation_text(domain: str, lang):
-    # Получаем путь к директории, где находится данный файл
-    current_dir = os.path.dirname(__file__)
-    # Путь к папке locales, находящейся в корне проекта
-    localedir = os.path.abspath(os.path.join(current_dir, '../../locales'))
-    # log.debug(f'localedir: {localedir}')
-    translation = gettext.translation(domain, localedir, languages=[lang], fallback=True)
-    return translation.gettext
+
+LOCALEDIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../locales'))
+DEFAULT_LANGUAGE = 'en'
+
+
+def _identity(message):
+    return message
+
+
+class TranslationRegistry:
+    """
+    Все переводы из locales/<lang>/LC_MESSAGES/<domain>.mo|.po, загруженные один раз в словари.
+    Для каждой пары (domain, lang) хранится готовая функция перевода
+    """
+
+    def __init__(self, localedir: str):
+        self.localedir = localedir
+        self.languages: set = set()
+        self._catalogs: Dict[Tuple[str, str], Dict[str, str]] = {}
+        self._functions: Dict[Tuple[str, str], Callable[[str], str]] = {}
+        self._loaded = False
+
+    def load(self) -> None:
+        catalogs = {}
+        languages = set()
+        if os.path.isdir(self.localedir):
+            for lang in os.listdir(self.localedir):
+                messages_dir = os.path.join(self.localedir, lang, 'LC_MESSAGES')
+                if not os.path.isdir(messages_dir):
+                    continue
+                languages.add(lang)
+                for filename in sorted(os.listdir(messages_dir)):
+                    domain, ext = os.path.splitext(filename)
+                    path = os.path.join(messages_dir, filename)
+                    # скомпилированный .mo приоритетнее исходного .po
+                    if ext == '.mo':
+                        catalogs[(domain, lang)] = self._read_mo(path)
+                    elif ext == '.po' and (domain, lang) not in catalogs \
+                            and not os.path.exists(os.path.join(messages_dir, f'{domain}.mo')):
+                        catalogs[(domain, lang)] = self._read_po(path)
+
+        self._catalogs = catalogs
+        self.languages = languages
+        self._functions = {}
+        self._loaded = True
+        negotiate_language.cache_clear()
+
+    @staticmethod
+    def _read_mo(path: str) -> Dict[str, str]:
+        with open(path, 'rb') as fp:
+            catalog = gettext.GNUTranslations(fp)._catalog
+        return {key: value for key, value in catalog.items() if isinstance(key, str) and key and value}
+
+    @staticmethod
+    def _read_po(path: str) -> Dict[str, str]:
+        from babel.messages.pofile import read_po
+
+        with open(path, 'rb') as fp:
+            catalog = read_po(fp)
+        return {
+            message.id: message.string
+            for message in catalog
+            if message.id and isinstance(message.id, str) and message.string
+        }
+
+    def gettext(self, domain: str, lang: str) -> Callable[[str], str]:
+        if not self._loaded:
+            self.load()
+        key = (domain, lang)
+        function = self._functions.get(key)
+        if function is None:
+            catalog = self._catalogs.get(key)
+            if catalog:
+                get = catalog.get
+                function = lambda message: get(message, message)
+            else:
+                function = _identity
+            self._functions[key] = function
+        return function
+
+
+translations = TranslationRegistry(LOCALEDIR)
+
+
+@lru_cache(maxsize=1024)
+def negotiate_language(accept_language: Optional[str]) -> str:
+    """
+    Выбирает язык из заголовка Accept-Language среди доступных в locales:
+    учитывает q-значения и откатывается с региона на язык (ru-RU -> ru)
+    """
+    if not translations._loaded:
+        translations.load()
+    if not accept_language:
+        return DEFAULT_LANGUAGE
+
+    candidates = []
+    for position, item in enumerate(accept_language.split(',')):
+        lang, _, params = item.strip().partition(';')
+        lang = lang.strip().replace('-', '_')
+        if not lang or lang == '*':
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                continue
+        if quality > 0:
+            candidates.append((-quality, position, lang))
+
+    available = {lang.lower(): lang for lang in translations.languages}
+    for _, _, lang in sorted(candidates):
+        for option in (lang, lang.split('_')[0]):
+            found = available.get(option.lower())
+            if found:
+                return found
+    return DEFAULT_LANGUAGE
 
 
 def get_translation(request: Request, domain: str):
-    lang_header = request.headers.get('Accept-Language')
-    lang = lang_header.split(',')[0] if lang_header else 'en'
-    return _get_translation_text(domain, lang)
+    lang = negotiate_language(request.headers.get('Accept-Language'))
+    return translations.gettext(domain, lang)
+
+
+# Курсор следующей страницы отдается в заголовке, чтобы не менять формат ответа списков
+def set_next_cursor(response: Response, next_cursor: Optional[str]) -> None:
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
 
 
 # if __name__ == "__main__":
@@ -20,6 +20,14 @@ from src.api.routes.country_routes import country_router
 from src.api.routes.boost_routes import boost_router
 from src.api.routes.case_routes import case_router
 from api.routes.market_routes import market_router
+from src.api.services.tap_service import TapService
+from src.api.services.catalog_service import CatalogService
+from src.api.services.auth_sync_service import AuthSyncService
+from src.api.services.session_store import RefreshSessionMaintenance
+from src.api.services.daily_reset_service import DailyResetService
+from src.api.services.rating_position_service import RatingPositionService
+from src.others.redis_client import redis_client
+from src.core.utils import NEXT_CURSOR_HEADER, translations
 
 # from src.core.queque import get_broker, get_stream, get_config
 from src.settings import get_settings
@@ -32,6 +40,7 @@ if cfg.run_type != "local":
     from src.telegram.dispatcher import get_dispatcher
     from src.telegram.handlers.base import bot, start_telegram, end_telegram
     from aiogram.types import Update
+    from src.telegram.update_queue import publish_update
 
 
 @asynccontextmanager
@@ -40,9 +49,32 @@ async def lifespan(application: FastAPI):
     log.info(f"Run type: {cfg.run_type}")
     if cfg.run_type != 'local':
         await start_telegram()
+    translations.load()
+    await redis_client.connect()
+    await CatalogService.start()
+    if cfg.taps_buffer_enabled:
+        TapService.start()
+    if cfg.auth_write_behind_enabled:
+        AuthSyncService.start()
+    RefreshSessionMaintenance.start()
+    if cfg.daily_reset_enabled:
+        DailyResetService.start()
+    if cfg.rating_positions_enabled:
+        RatingPositionService.start()
     # await get_broker().start()
     yield
     # await get_broker().close()
+    if cfg.rating_positions_enabled:
+        await RatingPositionService.stop()
+    if cfg.daily_reset_enabled:
+        await DailyResetService.stop()
+    await RefreshSessionMaintenance.stop()
+    if cfg.auth_write_behind_enabled:
+        await AuthSyncService.stop()
+    if cfg.taps_buffer_enabled:
+        await TapService.stop()
+    await CatalogService.stop()
+    await redis_client.close()
     if cfg.run_type != 'local':
         await end_telegram()
     log.info("⛔ Stopping FastAPI application")
@@ -63,7 +95,8 @@ app.add_middleware(
     allow_origins=cfg.cors_origins,
     allow_credentials=cfg.cors_credentials,
     allow_methods=cfg.cors_methods,
-    allow_headers=cfg.cors_headers
+    allow_headers=cfg.cors_headers,
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
 
 app.include_router(base_router)
@@ -97,12 +130,12 @@ async def bot_webhook(
             cfg.debug and log.error(f"Wrong secret token ! : {x_telegram_bot_api_secret_token}")
             return {"status": "error", "message": "Wrong secret token!"}
 
+        if cfg.webhook_queue_enabled:
+            # Апдейт обработают воркеры src.telegram.update_worker, телеграму сразу отвечаем 200
+            await publish_update(payload)
+            return {'status': 'ok'}
+
         update = await request.json()
-        # await get_broker().publish(
-        #     stream=cfg.stream_name,
-        #     subject=cfg.stream_subject,
-        #     message=update
-        # )
         update = Update.model_validate(update, context={"bot": bot})
         await get_dispatcher().feed_update(bot, update)
         return {'status': 'ok'}
@@ -1,3 +1,6 @@
+import uuid
+from typing import Optional
+
 import redis.asyncio as aioredis
 from redis.asyncio import Redis, ConnectionPool
 from settings import get_settings
@@ -5,6 +8,24 @@ from settings import get_settings
 cfg = get_settings()
 
 
+# Лок снимается и продлевается только своим владельцем: в ключе лежит токен того, кто его взял
+# KEYS[1] - лок, ARGV[1] - токен
+RELEASE_LOCK_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# KEYS[1] - лок, ARGV[1] - токен, ARGV[2] - ttl
+EXTEND_LOCK_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
 class RedisClient:
     def __init__(
             self,
@@ -17,12 +38,20 @@ class RedisClient:
         self.db = db
         self.pool = None
         self.redis = None
+        # клиент без декодирования ответов - для готовых байтов (кэш сериализованных ответов)
+        self.binary_pool = None
+        self.binary = None
+        self._scripts = {}
 
     async def connect(self):
         self.pool = aioredis.ConnectionPool.from_url(
             f'redis://{self.host}:{self.port}/{self.db}',
             decode_responses=True
         )
+        self.redis = aioredis.Redis(connection_pool=self.pool)
+        self.binary_pool = aioredis.ConnectionPool.from_url(f'redis://{self.host}:{self.port}/{self.db}')
+        self.binary = aioredis.Redis(connection_pool=self.binary_pool)
+        self._scripts = {}
         # self.redis = aioredis.Redis.from_url(
         #     f'redis://{self.host}:{self.port}/{self.db}',
         #     decode_responses=True
@@ -49,13 +78,40 @@ class RedisClient:
     async def delete(self, key):
         await self.redis.delete(key)
 
+    async def acquire_lock(self, key: str, ttl: int) -> Optional[str]:
+        """
+        Берет лок через SET NX. Возвращает токен владельца или None, если лок занят
+        """
+        token = uuid.uuid4().hex
+        if await self.redis.set(key, token, nx=True, ex=ttl):
+            return token
+        return None
+
+    async def extend_lock(self, key: str, token: str, ttl: int) -> bool:
+        """
+        Продлевает лок, если он все еще наш. False - лок истек или его взял другой воркер
+        """
+        return bool(await self._script('extend_lock', EXTEND_LOCK_LUA)(keys=[key], args=[token, ttl]))
+
+    async def release_lock(self, key: str, token: str) -> bool:
+        return bool(await self._script('release_lock', RELEASE_LOCK_LUA)(keys=[key], args=[token]))
+
+    def _script(self, name: str, lua: str):
+        script = self._scripts.get(name)
+        if script is None:
+            script = self.redis.register_script(lua)
+            self._scripts[name] = script
+        return script
+
     async def close(self):
-        # await self.redis.aclose()
+        await self.binary.aclose()
+        await self.binary_pool.disconnect()
+        await self.redis.aclose()
         await self.pool.disconnect()
 
 
 
-redis_client = RedisClient(host=cfg.server_host, port=6379, db=0)
+redis_client = RedisClient(host=cfg.redis_host, port=cfg.redis_port, db=0)
 
 # if __name__ == '__main__':
 #     async def main():
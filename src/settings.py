@@ -29,6 +29,17 @@ class Settings(BaseSettings):
     REFRESH_TOKEN_EXPIRE_DAYS: int = 1
     SECRET_KEY: str = 'secret'
     ALGORITHM: str = 'HS256'
+    # jose - проверка токена через python-jose, hs256 - быстрая проверка подписи через hmac (только для HS256)
+    jwt_backend: Literal['jose', 'hs256'] = 'jose'
+    jwt_cache_size: int = 50000  # количество проверенных access токенов в кэше процесса
+
+    # хранилище refresh сессий: redis (ttl из коробки) или postgres.
+    # Сессии из postgres в redis не переносятся: при переключении на redis все юзеры разлогинятся
+    refresh_session_backend: Literal['redis', 'postgres'] = 'postgres'
+    refresh_session_audit: bool = False  # дублировать сессии из redis в postgres (пачками, отложенно)
+    refresh_session_audit_interval: float = 5.0  # секунды между сбросами журнала в postgres
+    refresh_session_sweep_interval: int = 3600  # секунды между чистками протухших сессий в postgres
+    refresh_session_sweep_batch: int = 5000
 
     # uvicorn config
     host: str = '0.0.0.0'
@@ -45,6 +56,55 @@ class Settings(BaseSettings):
     redis_host: str = 'redis'
     redis_port: int = 6379
     redis_url: str = f'redis://{redis_host}:{redis_port}/0'
+    redis_broker_url: str = f'redis://{redis_host}:{redis_port}/2'
+
+    # taps buffer config
+    taps_buffer_enabled: bool = True
+    taps_flush_interval: float = 1.0  # секунды между сбросами в базу
+    taps_flush_batch_size: int = 1000
+    taps_state_ttl: int = 3600  # время жизни состояния юзера в redis после сброса
+
+    # ночное восстановление энергии и сброс ежедневных наград
+    daily_reset_enabled: bool = False
+    daily_reset_hour: int = 0  # час (UTC), после которого запускается обработка за сутки
+    daily_reset_batch_size: int = 5000  # юзеров в одной транзакции
+    daily_reset_pause: float = 0.05  # секунды между пачками, чтобы не мешать основной нагрузке
+    daily_reset_check_interval: int = 60  # секунды между проверками, пора ли запускать
+
+    # профиль юзера (/user/me) одним запросом вместо последовательных
+    profile_single_query: bool = True
+
+    # рейтинги юзеров в redis sorted sets
+    leaderboard_enabled: bool = True
+
+    # пересчет позиций в рейтингах (rating_positions)
+    rating_positions_enabled: bool = False
+    rating_positions_interval: int = 300  # секунды между инкрементальными пересчетами
+    rating_positions_full_interval: int = 86400  # секунды между полными пересчетами
+
+    # initData webapp
+    init_data_ttl: int = 3 * 3600  # время жизни initData с момента auth_date
+    init_data_cache_size: int = 50000  # количество проверенных initData в кэше процесса
+
+    # кэш флагов is_superuser/is_active для проверки прав
+    user_flags_ttl: int = 300  # секунды
+
+    # отложенная запись служебных данных авторизации (имя, auth_date)
+    auth_write_behind_enabled: bool = True
+    auth_flush_interval: float = 5.0  # секунды между сбросами в базу
+    auth_flush_batch_size: int = 1000
+    auth_fingerprint_ttl: int = 86400  # время жизни отпечатка профиля в redis
+
+    # catalog (справочники) config
+    catalog_ttl: int = 300  # секунды
+    catalog_channel: str = 'catalog:invalidate'
+    catalog_miss_reload_interval: float = 5.0  # секунды, перечитывание при запросе неизвестного предприятия
+
+    # кэш ответов /market/ads
+    market_cache_enabled: bool = True
+    market_cache_ttl: int = 10  # секунды в redis
+    market_cache_l1_ttl: float = 2.0  # секунды в памяти процесса
+    market_cache_l1_size: int = 1024
 
     # cors
     cors_origins: list[str] = ['*']
@@ -91,6 +151,23 @@ class Settings(BaseSettings):
     # Дополнительный токен безопасности для webhook (можно придумать самому)
     tg_secret_token: str = '111'
 
+    # рассылка (/new_post)
+    broadcast_rate: float = 25  # сообщений в секунду (глобальный лимит телеграма ~30)
+    broadcast_concurrency: int = 20
+    broadcast_batch_size: int = 100  # прогресс сохраняется после каждой пачки
+    broadcast_max_retries: int = 3
+    broadcast_report_interval: float = 10  # секунды между обновлениями статуса для админа
+    broadcast_lock_ttl: int = 300  # секунды, лок рассылки продлевается после каждой пачки
+
+    # очередь апдейтов вебхука (redis streams)
+    webhook_queue_enabled: bool = False
+    webhook_stream: str = 'tg_updates'
+    webhook_group: str = 'tg_updates_workers'
+    webhook_consumer: str = 'worker'
+    webhook_shards: int = 16  # апдейты одного чата всегда попадают в один шард
+    webhook_stream_maxlen: int = 100000
+    webhook_max_retries: int = 3
+
 
 @lru_cache()  # get it from memory
 def get_settings() -> Settings:
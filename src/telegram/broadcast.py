@@ -0,0 +1,304 @@
+import asyncio
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError, TelegramBadRequest
+from aiogram.types import InlineKeyboardMarkup
+
+from src.others.redis_client import redis_client
+from src.telegram.utils import stream_chat_ids
+from src.settings import get_settings
+from loguru import logger as log
+
+cfg = get_settings()
+
+
+BROADCAST_PREFIX = 'broadcast:'
+BROADCAST_ACTIVE_KEY = 'broadcast:active'  # id последней незавершенной рассылки
+# Лок владельца: рассылку ведет только одна задача во всех процессах,
+# новую рассылку нельзя создать и прерванную нельзя продолжить, пока текущая идет
+BROADCAST_LOCK_KEY = 'broadcast:lock'
+
+STATUS_RUNNING = 'running'
+STATUS_STOPPING = 'stopping'  # запрошена остановка, рассылка остановится после текущей пачки
+STATUS_STOPPED = 'stopped'
+STATUS_FINISHED = 'finished'
+
+
+class TokenBucket:
+    """
+    Ограничитель частоты: rate токенов в секунду, не больше capacity подряд
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds: float) -> None:
+        # flood wait от телеграма действует на весь бот, поэтому тормозим всех отправителей
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+
+class Broadcast:
+    """
+    Рассылка сообщения всем юзерам.
+    Юзеры читаются потоково, сообщения отправляются с ограничением частоты и параллелизма,
+    прогресс сохраняется в redis, поэтому прерванную рассылку можно продолжить.
+    Запускать рассылку можно только с токеном лока BROADCAST_LOCK_KEY (acquire_lock), run() его снимает
+    """
+
+    def __init__(
+            self,
+            bot: Bot,
+            broadcast_id: str,
+            from_chat_id: int,
+            message_id: int,
+            reply_markup: Optional[InlineKeyboardMarkup] = None,
+            admin_chat_id: Optional[int] = None,
+            status_message_id: Optional[int] = None,
+            last_tg_id: Optional[int] = None,
+            sent: int = 0,
+            failed: int = 0,
+            blocked: int = 0,
+            lock_token: Optional[str] = None,
+    ):
+        self.bot = bot
+        self.broadcast_id = broadcast_id
+        self.from_chat_id = from_chat_id
+        self.message_id = message_id
+        self.reply_markup = reply_markup
+        self.admin_chat_id = admin_chat_id
+        self.status_message_id = status_message_id
+        self.last_tg_id = last_tg_id
+        self.sent = sent
+        self.failed = failed
+        self.blocked = blocked
+        self.lock_token = lock_token
+
+        self.bucket = TokenBucket(rate=cfg.broadcast_rate)
+        self.semaphore = asyncio.Semaphore(cfg.broadcast_concurrency)
+        self.reported_at = 0.0
+
+    @property
+    def key(self) -> str:
+        return f'{BROADCAST_PREFIX}{self.broadcast_id}'
+
+    @classmethod
+    async def acquire_lock(cls) -> Optional[str]:
+        """
+        Токен лока рассылок или None, если рассылка уже идет (в этом или другом процессе)
+        """
+        return await redis_client.acquire_lock(BROADCAST_LOCK_KEY, cfg.broadcast_lock_ttl)
+
+    @classmethod
+    async def release_lock(cls, lock_token: str) -> None:
+        await redis_client.release_lock(BROADCAST_LOCK_KEY, lock_token)
+
+    @classmethod
+    async def create(
+            cls,
+            bot: Bot,
+            from_chat_id: int,
+            message_id: int,
+            lock_token: str,
+            reply_markup: Optional[InlineKeyboardMarkup] = None,
+            admin_chat_id: Optional[int] = None,
+            status_message_id: Optional[int] = None,
+    ) -> "Broadcast":
+        """
+        Новая рассылка. Незавершенная предыдущая (лок у нас, значит она не идет) больше не продолжится
+        """
+        previous_id = await redis_client.redis.get(BROADCAST_ACTIVE_KEY)
+        if previous_id:
+            log.warning(f'Unfinished broadcast {previous_id} is replaced by a new one')
+
+        broadcast = cls(
+            bot=bot,
+            broadcast_id=uuid.uuid4().hex,
+            from_chat_id=from_chat_id,
+            message_id=message_id,
+            reply_markup=reply_markup,
+            admin_chat_id=admin_chat_id,
+            status_message_id=status_message_id,
+            lock_token=lock_token,
+        )
+        await redis_client.redis.hset(broadcast.key, mapping={
+            'from_chat_id': from_chat_id,
+            'message_id': message_id,
+            'reply_markup': reply_markup.model_dump_json() if reply_markup else '',
+            'admin_chat_id': admin_chat_id or '',
+            'status_message_id': status_message_id or '',
+            'status': STATUS_RUNNING,
+        })
+        await redis_client.redis.set(BROADCAST_ACTIVE_KEY, broadcast.broadcast_id)
+        return broadcast
+
+    @classmethod
+    async def load_active(cls, bot: Bot, lock_token: str) -> Optional["Broadcast"]:
+        """
+        Загружает незавершенную рассылку из redis для продолжения.
+        Читать состояние нужно уже под локом, иначе можно продолжить с устаревшей позиции
+        """
+        broadcast_id = await redis_client.redis.get(BROADCAST_ACTIVE_KEY)
+        if not broadcast_id:
+            return None
+        state: Dict[str, str] = await redis_client.redis.hgetall(f'{BROADCAST_PREFIX}{broadcast_id}')
+        if not state or state.get('status') == STATUS_FINISHED:
+            return None
+
+        return cls(
+            bot=bot,
+            broadcast_id=broadcast_id,
+            from_chat_id=int(state['from_chat_id']),
+            message_id=int(state['message_id']),
+            reply_markup=InlineKeyboardMarkup.model_validate_json(state['reply_markup'])
+            if state.get('reply_markup') else None,
+            admin_chat_id=int(state['admin_chat_id']) if state.get('admin_chat_id') else None,
+            status_message_id=int(state['status_message_id']) if state.get('status_message_id') else None,
+            last_tg_id=int(state['last_tg_id']) if state.get('last_tg_id') else None,
+            sent=int(state.get('sent', 0)),
+            failed=int(state.get('failed', 0)),
+            blocked=int(state.get('blocked', 0)),
+            lock_token=lock_token,
+        )
+
+    async def run(self) -> None:
+        await redis_client.redis.hset(self.key, 'status', STATUS_RUNNING)
+        try:
+            async for batch in stream_chat_ids(after_tg_id=self.last_tg_id, yield_per=cfg.broadcast_batch_size):
+                await asyncio.gather(*[self._send(chat_id) for _, chat_id in batch])
+                status = await self._checkpoint(batch)
+                if not await redis_client.extend_lock(BROADCAST_LOCK_KEY, self.lock_token, cfg.broadcast_lock_ttl):
+                    # Лок истек и мог достаться другой задаче: продолжать нельзя, иначе сообщения задвоятся
+                    log.error(f'Broadcast {self.broadcast_id} lost its lock, stopping')
+                    return
+                if status == STATUS_STOPPING:
+                    # Остановку могли запросить из другого процесса (/stop_post в другом воркере)
+                    await redis_client.redis.hset(self.key, 'status', STATUS_STOPPED)
+                    await self._report(force=True, title='Рассылка остановлена')
+                    return
+                await self._report()
+
+            await redis_client.redis.hset(self.key, 'status', STATUS_FINISHED)
+            await redis_client.redis.delete(BROADCAST_ACTIVE_KEY)
+            await self._report(force=True, title='Рассылка завершена')
+        except asyncio.CancelledError:
+            await redis_client.redis.hset(self.key, 'status', STATUS_STOPPED)
+            await self._report(force=True, title='Рассылка остановлена')
+            raise
+        finally:
+            await self.release_lock(self.lock_token)
+
+    async def _send(self, chat_id: int) -> None:
+        async with self.semaphore:
+            for _ in range(cfg.broadcast_max_retries):
+                await self.bucket.acquire()
+                try:
+                    await self.bot.copy_message(
+                        chat_id=chat_id,
+                        from_chat_id=self.from_chat_id,
+                        message_id=self.message_id,
+                        reply_markup=self.reply_markup,
+                    )
+                    self.sent += 1
+                    return
+                except TelegramRetryAfter as e:
+                    cfg.debug and log.warning(f'Broadcast flood wait {e.retry_after}s')
+                    self.bucket.pause(e.retry_after)
+                    await asyncio.sleep(e.retry_after)
+                except TelegramForbiddenError:
+                    # юзер заблокировал бота
+                    self.blocked += 1
+                    return
+                except TelegramBadRequest as e:
+                    cfg.debug and log.error(f"Error sending message to {chat_id}: {e}")
+                    self.failed += 1
+                    return
+                except Exception as e:
+                    log.error(f"Error sending message to {chat_id}: {e}")
+                    # не больше одного сообщения в секунду в один чат
+                    await asyncio.sleep(1)
+            self.failed += 1
+
+    async def _checkpoint(self, batch: List[Tuple[int, int]]) -> Optional[str]:
+        """
+        Сохраняет прогресс и возвращает текущий статус рассылки
+        """
+        self.last_tg_id = batch[-1][0]
+        async with redis_client.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(self.key, mapping={
+                'last_tg_id': self.last_tg_id,
+                'sent': self.sent,
+                'failed': self.failed,
+                'blocked': self.blocked,
+            })
+            pipe.hget(self.key, 'status')
+            _, status = await pipe.execute()
+        return status
+
+    async def _report(self, force: bool = False, title: str = 'Рассылка идет') -> None:
+        if self.admin_chat_id is None or self.status_message_id is None:
+            return
+        now = time.monotonic()
+        if not force and now - self.reported_at < cfg.broadcast_report_interval:
+            return
+        self.reported_at = now
+        try:
+            await self.bot.edit_message_text(
+                chat_id=self.admin_chat_id,
+                message_id=self.status_message_id,
+                text=(
+                    f"<b>{title}</b>\n"
+                    f"Отправлено: <b>{self.sent}</b>\n"
+                    f"Заблокировали бота: <b>{self.blocked}</b>\n"
+                    f"Ошибок: <b>{self.failed}</b>\n"
+                ),
+            )
+        except TelegramBadRequest:
+            # текст не изменился
+            pass
+
+
+# Ссылки на запущенные рассылки, чтобы задачи не собрал сборщик мусора
+_running: Dict[str, asyncio.Task] = {}
+
+
+def start_broadcast(broadcast: Broadcast) -> asyncio.Task:
+    task = asyncio.create_task(broadcast.run())
+    _running[broadcast.broadcast_id] = task
+    task.add_done_callback(lambda _: _running.pop(broadcast.broadcast_id, None))
+    return task
+
+
+async def stop_broadcasts() -> int:
+    """
+    Запрашивает остановку идущей рассылки. Флаг лежит в redis, поэтому рассылка остановится
+    после текущей пачки в любом процессе. Возвращает количество остановленных рассылок
+    """
+    broadcast_id = await redis_client.redis.get(BROADCAST_ACTIVE_KEY)
+    if not broadcast_id or not await redis_client.redis.exists(BROADCAST_LOCK_KEY):
+        return 0
+    await redis_client.redis.hset(f'{BROADCAST_PREFIX}{broadcast_id}', 'status', STATUS_STOPPING)
+    return 1
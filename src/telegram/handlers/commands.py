@@ -16,7 +16,7 @@ from loguru import logger as log
 
 from src.telegram.bot import get_bot
 from src.telegram.keyboards.base import payment_keyboard
-from telegram.utils import get_all_users
+from src.telegram.broadcast import Broadcast, start_broadcast, stop_broadcasts
 
 cfg = get_settings()
 
@@ -181,19 +181,59 @@ async def post_text(message: Message, state: FSMContext):
     """
     Send post to all users
     """
-    # Получаем список всех юзеров с базы
-    db_users = await get_all_users(limit=500)
-
     await state.clear()
 
-    # Проверяем наличие инлайн кнопок в исходном сообщении
-    inline_keyboard = message.reply_markup if message.reply_markup else None
-
-    # Отправляем пост всем полученным юзерам
-    for user in db_users:
-        try:
-            await message.send_copy(chat_id=user.tg_chat_id, reply_markup=inline_keyboard)
-            # Чтобы не превышать лимиты телеги, делаем задержку
-            await asyncio.sleep(0.2)  # 5 сообщений в сек
-        except Exception as e:
-            log.error(f"Error sending message to {user.tg_chat_id}: {e}")
+    lock_token = await Broadcast.acquire_lock()
+    if lock_token is None:
+        await message.answer("Уже идет рассылка. Остановить ее: /stop_post")
+        return
+
+    try:
+        status_message = await message.answer("Рассылка запускается...")
+
+        # Рассылка идет в фоне, чтобы не держать вебхук
+        broadcast = await Broadcast.create(
+            bot=get_bot(),
+            from_chat_id=message.chat.id,
+            message_id=message.message_id,
+            lock_token=lock_token,
+            reply_markup=message.reply_markup if message.reply_markup else None,
+            admin_chat_id=message.chat.id,
+            status_message_id=status_message.message_id,
+        )
+    except Exception:
+        await Broadcast.release_lock(lock_token)
+        raise
+    start_broadcast(broadcast)
+
+
+@commands_router.message((F.text == "/resume_post") & (F.from_user.id.in_(cfg.bot_admins)))
+async def resume_post(message: Message):
+    """
+    Продолжить прерванную рассылку с последней сохраненной позиции
+    """
+    lock_token = await Broadcast.acquire_lock()
+    if lock_token is None:
+        await message.answer("Рассылка уже идет")
+        return
+
+    try:
+        broadcast = await Broadcast.load_active(get_bot(), lock_token=lock_token)
+        if broadcast is None:
+            await Broadcast.release_lock(lock_token)
+            await message.answer("Нет незавершенных рассылок")
+            return
+
+        status_message = await message.answer(f"Продолжаем рассылку. Уже отправлено: {broadcast.sent}")
+    except Exception:
+        await Broadcast.release_lock(lock_token)
+        raise
+    broadcast.admin_chat_id = message.chat.id
+    broadcast.status_message_id = status_message.message_id
+    start_broadcast(broadcast)
+
+
+@commands_router.message((F.text == "/stop_post") & (F.from_user.id.in_(cfg.bot_admins)))
+async def stop_post(message: Message):
+    stopped = await stop_broadcasts()
+    await message.answer(f"Остановлено рассылок: {stopped}")
@@ -0,0 +1,50 @@
+from typing import Any, Dict, Optional
+
+import orjson
+
+from src.others.redis_queue import queue
+from src.settings import get_settings
+
+cfg = get_settings()
+
+
+def shard_stream(shard: int) -> str:
+    return f'{cfg.webhook_stream}:{shard}'
+
+
+def dead_letter_stream() -> str:
+    return f'{cfg.webhook_stream}:dead'
+
+
+def extract_chat_id(update: Dict[str, Any]) -> Optional[int]:
+    """
+    Чат (или юзер), к которому относится апдейт.
+    По нему апдейты раскладываются по шардам, чтобы сохранить порядок внутри чата
+    """
+    for key, event in update.items():
+        if key == 'update_id' or not isinstance(event, dict):
+            continue
+        chat = event.get('chat') or (event.get('message') or {}).get('chat')
+        if chat and chat.get('id') is not None:
+            return chat['id']
+        sender = event.get('from') or event.get('user')
+        if sender and sender.get('id') is not None:
+            return sender['id']
+    return None
+
+
+async def publish_update(payload: bytes) -> None:
+    """
+    Кладет сырое тело апдейта в redis stream своего шарда.
+    Обработка идет в воркерах src.telegram.update_worker
+    """
+    update = orjson.loads(payload)
+    chat_id = extract_chat_id(update)
+    shard_key = chat_id if chat_id is not None else update.get('update_id', 0)
+
+    await queue.get_redis().xadd(
+        shard_stream(shard_key % cfg.webhook_shards),
+        {'body': payload},
+        maxlen=cfg.webhook_stream_maxlen,
+        approximate=True,
+    )
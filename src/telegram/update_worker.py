@@ -0,0 +1,132 @@
+import asyncio
+import sys
+from typing import Dict, List
+
+from aiogram.types import Update
+from redis.exceptions import ResponseError
+
+from src.others.redis_queue import queue
+from src.others.redis_client import redis_client
+from src.telegram.bot import get_bot
+from src.telegram.dispatcher import get_dispatcher
+from src.telegram.update_queue import shard_stream, dead_letter_stream
+from src.settings import get_settings
+from loguru import logger as log
+
+cfg = get_settings()
+
+
+class UpdateWorker:
+    """
+    Пул обработчиков апдейтов из redis streams.
+    Каждый шард читается одной корутиной последовательно, поэтому апдейты одного чата
+    обрабатываются строго по порядку. Апдейт подтверждается (XACK) только после обработки,
+    после нескольких неудачных попыток уходит в dead-letter stream.
+
+    Один шард должен обслуживаться только одним процессом:
+    при нескольких процессах раздайте им непересекающиеся диапазоны шардов
+    """
+
+    def __init__(self, shards: List[int]):
+        self.shards = shards
+        self.redis = queue.get_redis()
+        self.bot = get_bot()
+        self.dispatcher = get_dispatcher()
+
+    async def run(self) -> None:
+        for shard in self.shards:
+            try:
+                await self.redis.xgroup_create(shard_stream(shard), cfg.webhook_group, id='0', mkstream=True)
+            except ResponseError as e:
+                # группа уже создана
+                if 'BUSYGROUP' not in str(e):
+                    raise
+
+        await asyncio.gather(*[self._consume(shard) for shard in self.shards])
+
+    async def _consume(self, shard: int) -> None:
+        stream = shard_stream(shard)
+        # Имя консьюмера постоянное, поэтому после рестарта сначала дочитываем свои
+        # неподтвержденные апдейты ('0'), а затем переходим к новым ('>')
+        consumer = f'{cfg.webhook_consumer}-{shard}'
+        last_id = '0'
+
+        while True:
+            try:
+                response = await self.redis.xreadgroup(
+                    cfg.webhook_group,
+                    consumer,
+                    {stream: last_id},
+                    count=100,
+                    block=None if last_id == '0' else 5000,
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.error(f'Update worker read error ({stream}): {e}')
+                await asyncio.sleep(1)
+                continue
+
+            entries = response[0][1] if response else []
+            if not entries:
+                last_id = '>'
+                continue
+
+            for entry_id, fields in entries:
+                await self._process(stream, entry_id, fields)
+
+    async def _process(self, stream: str, entry_id: bytes, fields: Dict[bytes, bytes]) -> None:
+        body = (fields or {}).get(b'body')
+        if body is None:
+            # запись уже вытеснена из стрима по maxlen
+            await self.redis.xack(stream, cfg.webhook_group, entry_id)
+            return
+
+        error = None
+        for attempt in range(cfg.webhook_max_retries):
+            try:
+                update = Update.model_validate_json(body, context={"bot": self.bot})
+                await self.dispatcher.feed_update(self.bot, update)
+                error = None
+                break
+            except Exception as e:
+                error = e
+                cfg.debug and log.warning(f'Update {entry_id} failed (attempt {attempt + 1}): {e}')
+                await asyncio.sleep(0.5 * (attempt + 1))
+
+        if error is not None:
+            log.error(f'Update {entry_id} moved to dead letter: {error}')
+            await self.redis.xadd(
+                dead_letter_stream(),
+                {'body': body or b'', 'error': str(error), 'stream': stream, 'entry_id': entry_id},
+                maxlen=cfg.webhook_stream_maxlen,
+                approximate=True,
+            )
+        await self.redis.xack(stream, cfg.webhook_group, entry_id)
+
+
+def parse_shards(arg: str) -> List[int]:
+    # "0-7" или "0,3,5"
+    if '-' in arg:
+        start, end = arg.split('-')
+        return list(range(int(start), int(end) + 1))
+    return [int(item) for item in arg.split(',')]
+
+
+async def main(shards: List[int]):
+    await redis_client.connect()
+    log.info(f'🚀 Update worker started, shards: {shards}')
+    try:
+        await UpdateWorker(shards).run()
+    finally:
+        await redis_client.close()
+        await get_bot().session.close()
+
+
+# Запуск: python -m src.telegram.update_worker [0-15]
+if __name__ == "__main__":
+    shards_arg = sys.argv[1] if len(sys.argv) > 1 else f'0-{cfg.webhook_shards - 1}'
+    try:
+        asyncio.run(main(parse_shards(shards_arg)))
+    except KeyboardInterrupt:
+        log.info('⛔ Update worker stopped')
@@ -1,26 +1,57 @@
-from api.services.user_service import UserService
-from loguru import logger as log
+from typing import AsyncGenerator, List, Optional, Tuple
 
+from sqlalchemy import Row
 
-async def get_all_users(limit: int = 500):
-    db_users = []
-    offset = 0
+from src.api.dao import UserDAO
+from src.core.models import UserModel
+from src.core.database import db_helper as db
 
+
+async def get_all_users(batch_size: int = 1000) -> AsyncGenerator[Row, None]:
+    """
+    Все юзеры по возрастанию tg_id потоком: Row с колонками users вместо ORM объектов,
+    в памяти одновременно не больше batch_size строк
+    """
+    async with db.session_factory() as ses:
+        async for user in UserDAO.stream(ses, order_by='tg_id', batch_size=batch_size):
+            yield user
+
+
+async def stream_chat_ids(
+        after_tg_id: Optional[int] = None,
+        segment_size: int = 10000,
+        yield_per: int = 1000,
+) -> AsyncGenerator[List[Tuple[int, int]], None]:
+    """
+    Отдает пачки (tg_id, tg_chat_id) всех юзеров по возрастанию tg_id.
+    Каждый сегмент читается серверным курсором (yield_per) в отдельной короткой транзакции,
+    следующий сегмент продолжается с последнего tg_id, поэтому память не зависит от размера таблицы,
+    а долгая рассылка не держит транзакцию открытой
+    """
+    last_tg_id = after_tg_id
     while True:
-        try:
-            users = await UserService.get_users(
-                order_by='tg_id',
-                limit=limit,
-                offset=offset
-            )
-        except Exception as e:
-            log.error(f"Error fetching users: {e}")
-            break
-
-        if users is None or len(users) == 0:
-            break
-        else:
-            db_users.extend(users)
-            offset += limit
-
-    return db_users
+        filters = [UserModel.tg_chat_id.isnot(None)]
+        if last_tg_id is not None:
+            filters.append(UserModel.tg_id > last_tg_id)
+
+        segment = []
+        async with db.session_factory() as ses:
+            async for row in UserDAO.stream(
+                    ses,
+                    *filters,
+                    columns=(UserModel.tg_id, UserModel.tg_chat_id),
+                    batch_size=yield_per,
+                    order_by='tg_id',
+                    limit=segment_size,
+            ):
+                segment.append((row.tg_id, row.tg_chat_id))
+
+        if not segment:
+            return
+
+        for start in range(0, len(segment), yield_per):
+            yield segment[start:start + yield_per]
+
+        if len(segment) < segment_size:
+            return
+        last_tg_id = segment[-1][0]